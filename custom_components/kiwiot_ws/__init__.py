@@ -1,31 +1,67 @@
+import asyncio
 import logging
+import time
 import aiohttp
+from datetime import timedelta
+from pathlib import Path
 from homeassistant.const import Platform
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.typing import ConfigType
+from homeassistant.util.ssl import get_default_context
 
-from .const import DOMAIN, LOGGER_NAME, CONF_CLIENT_ID, CONF_IGNORE_SSL
+from .const import DOMAIN, LOGGER_NAME, CONF_CLIENT_ID, CONF_IGNORE_SSL, TOPOLOGY_SYNC_INTERVAL
 from .conn.websocket import start_websocket_connection
-from .device_manager import initialize_devices_and_groups
+from .device_manager import initialize_devices_and_groups, TopologyReconciler
+from .conn.userinfo import get_ggid
 from .conn.token_manager import TokenManager
+from .conn.storage import KiwiStorage
+from .conn.media import MediaResolver
+from .conn.snapshots import SnapshotArchive
+from .conn.polling import PollingFallback
+from .conn.metrics import IntegrationMetrics
+from .conn.tracing import TraceBuffer
+from .media_source import KiwiOTSnapshotView
+from .services import async_setup_services
 
 _LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
 
-PLATFORMS = [Platform.SENSOR, Platform.CAMERA, Platform.TEXT, Platform.BUTTON]
+PLATFORMS = [Platform.SENSOR, Platform.CAMERA, Platform.TEXT, Platform.BUTTON, Platform.EVENT, Platform.LOCK]
+SNAPSHOT_VIEW_KEY = f"{DOMAIN}_snapshot_view"
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """服务只注册一次, 配置项重载和卸载时保持可用"""
+    async_setup_services(hass)
+    return True
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
-    """设置配置项"""
+    """设置配置项: 只做 token 和组列表检查, 门锁在后台逐个发现后加入"""
     hass.data.setdefault(DOMAIN, {})
 
     client_id = entry.data.get(CONF_CLIENT_ID)
     ignore_ssl = entry.data.get(CONF_IGNORE_SSL, False)
-    token_manager = TokenManager(hass, entry)
+    # Token 和开锁数据统一存储, 启动时只读取一个文件
+    storage = KiwiStorage(hass, entry)
+    await storage.async_load()
+    hass.data[DOMAIN]["storage"] = storage
+    # 运行指标只在内存中计数, 由诊断传感器定期发布
+    hass.data[DOMAIN]["metrics"] = IntegrationMetrics()
+    hass.data[DOMAIN]["traces"] = TraceBuffer()
+    token_manager = TokenManager(hass, entry, storage)
+    # 先登记共享的 TokenManager, 之后的请求(包括下面的 get_ggid)不会再创建临时实例
+    hass.data[DOMAIN]["token_manager"] = token_manager
     
     # 创建 session 配置
     timeout = aiohttp.ClientTimeout(total=30, connect=10)
+    # 使用 HA 预先加载的 SSL 上下文, 避免首次连接时在事件循环中读取证书
     connector = aiohttp.TCPConnector(
-        ssl=not ignore_ssl,
-        enable_cleanup_closed=True
+        ssl=False if ignore_ssl else get_default_context(),
+        enable_cleanup_closed=True,
+        keepalive_timeout=90
     )
     session = aiohttp.ClientSession(
         connector=connector,
@@ -34,88 +70,120 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     )
 
     try:
-        # 获取初始 token
+        # 获取初始 token 和组列表, 失败时由 HA 稍后重试
         access_token = await token_manager.get_token(session)
         if not access_token:
-            if session and not session.closed:
-                await session.close()
-            return False
-            
-        # 存储 session 和其他数据
-        hass.data[DOMAIN].update({
-            "client_id": client_id,
-            "session": session,
-        })
-
-        # 初始化设备和组信息
-        try:
-            entities_to_add = []
-            entities_by_device = {}
-
-            def add_entities_callback(new_entities):
-                """按设备ID组织实体"""
-                nonlocal entities_by_device
-                for entity in new_entities:
-                    if hasattr(entity, '_device'):
-                        device_id = entity._device.device_id
-                        if device_id not in entities_by_device:
-                            entities_by_device[device_id] = []
-                        entities_by_device[device_id].append(entity)
-                entities_to_add.extend(new_entities)
-
-            await initialize_devices_and_groups(hass, entry, session, add_entities_callback)
-            if not entities_to_add:
-                return False
-
-            # 存储创建的实体，按设备ID组织
-            hass.data[DOMAIN].update({
-                "session": session,
-                "devices": entities_by_device,
-                entry.entry_id: {
-                    "entities": entities_to_add
-                }
-            })
-
-            # 注册平台
-            await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
-
-            # 启动 WebSocket 连接
-            hass.loop.create_task(start_websocket_connection(hass, entry, session))
-
-            _LOGGER.info(f"KiwiOT 集成已成功初始化，添加了 {len(entities_to_add)} 个实体")
-            return True
-
-        except Exception as e:
-            _LOGGER.error(f"设置集成时发生错误: {e}")
-            if session:
-                await session.close()
-            return False
-
+            raise ConfigEntryNotReady("获取 token 失败")
+        groups = await get_ggid(hass, entry, session)
+        if groups is None:
+            raise ConfigEntryNotReady("获取组信息失败")
     except Exception as e:
-        _LOGGER.error(f"获取 token 时发生错误: {e}")
-        return False
-
+        await session.close()
+        hass.data.pop(DOMAIN, None)
+        if isinstance(e, ConfigEntryNotReady):
+            raise
+        raise ConfigEntryNotReady(f"连接 KiwiOT 失败: {e}") from e
     finally:
         if connector:
             connector._cleanup = True
 
+    # 存储 session 和其他数据, 实体索引初始为空
+    hass.data[DOMAIN].update({
+        "entry": entry,
+        "client_id": client_id,
+        "session": session,
+        "token_manager": token_manager,
+        "media_resolver": MediaResolver(hass, entry, session),
+        "devices": {},
+        "response_futures": {},
+        entry.entry_id: {
+            "entities": []
+        },
+    })
+
+    # 事件快照归档, 供媒体浏览器按门锁和日期查看
+    snapshots = SnapshotArchive(hass, Path(hass.config.path("kiwiot_config", "snapshots")))
+    await snapshots.async_load()
+    hass.data[DOMAIN]["snapshots"] = snapshots
+    if not hass.data.get(SNAPSHOT_VIEW_KEY):
+        hass.http.register_view(KiwiOTSnapshotView())
+        hass.data[SNAPSHOT_VIEW_KEY] = True
+
+    # 门锁和用户增删时增量同步, 无需重载集成
+    reconciler = TopologyReconciler(hass, entry, session)
+    hass.data[DOMAIN]["topology"] = reconciler
+
+    # 先注册平台, 之后发现的门锁实体通过信号逐个加入
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+
+    async def _periodic_topology_sync(now):
+        await reconciler.async_reconcile()
+
+    entry.async_on_unload(
+        async_track_time_interval(hass, _periodic_topology_sync, timedelta(seconds=TOPOLOGY_SYNC_INTERVAL))
+    )
+    # 按需加载等选项修改后重新加载集成
+    entry.async_on_unload(entry.add_update_listener(_async_update_listener))
+
+    # WebSocket 断线期间的 REST 轮询
+    hass.data[DOMAIN]["poller"] = PollingFallback(hass, entry, session)
+
+    async def _discover_and_connect():
+        """逐个发现门锁, 每发现一个立即添加其实体, 全部完成后再连接 WebSocket"""
+        started = time.monotonic()
+        count = await initialize_devices_and_groups(hass, entry, session, reconciler.register_entities, groups)
+        _LOGGER.info("KiwiOT 门锁发现完成，共 %s 个门锁，耗时 %.1f 秒", count, time.monotonic() - started)
+        hass.data[DOMAIN]["ws_task"] = entry.async_create_background_task(
+            hass, start_websocket_connection(hass, entry, session), f"{DOMAIN}_websocket"
+        )
+
+    hass.data[DOMAIN]["discovery_task"] = entry.async_create_background_task(
+        hass, _discover_and_connect(), f"{DOMAIN}_discovery"
+    )
+    # 保持 token 和 REST 连接预热, 开锁时无需重新校验和握手
+    entry.async_create_background_task(
+        hass, token_manager.keep_warm(session), f"{DOMAIN}_keep_warm"
+    )
+
+    _LOGGER.info("KiwiOT 集成已初始化，正在后台发现门锁")
+    return True
+
+async def _async_update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    await hass.config_entries.async_reload(entry.entry_id)
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     # 首先卸载所有平台
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     
     if unload_ok:
+        domain_data = hass.data[DOMAIN]
+
+        # 先停止轮询和 WebSocket 任务, 再关闭 session
+        poller = domain_data.get("poller")
+        if poller:
+            poller.stop()
+        tasks = [
+            task for task in (domain_data.get("discovery_task"), domain_data.get("ws_task"))
+            if task and not task.done()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for future in domain_data.get("response_futures", {}).values():
+            if not future.done():
+                future.cancel()
+
+        storage = domain_data.get("storage")
+        if storage:
+            await storage.async_flush()
+
         # 关闭 session
-        session = hass.data[DOMAIN].get("session")
+        session = domain_data.get("session")
         if session:
             await session.close()
-        
-        # 清理该条目的数据
-        if entry.entry_id in hass.data[DOMAIN]:
-            hass.data[DOMAIN].pop(entry.entry_id)
-        
-        # 如果没有其他条目使用这个域，则完全删除域数据
-        if not hass.data[DOMAIN]:
-            hass.data.pop(DOMAIN)
+
+        # 域数据中的 session、实体索引和缓存都属于该配置项, 卸载时全部释放
+        hass.data.pop(DOMAIN, None)
             
         _LOGGER.info("KiwiOT 集成已成功卸载")
     
@@ -1,10 +1,28 @@
 import voluptuous as vol
 from homeassistant import config_entries
+from homeassistant.core import callback
 from typing import Any, Dict, Optional
-from .const import DOMAIN, CONF_IDENTIFIER, CONF_CREDENTIAL, CONF_CLIENT_ID, CONF_IGNORE_SSL
+from .const import (
+    DOMAIN,
+    CONF_IDENTIFIER,
+    CONF_CREDENTIAL,
+    CONF_CLIENT_ID,
+    CONF_IGNORE_SSL,
+    CONF_IMAGE_ROTATION,
+    CONF_LAZY_HYDRATION,
+    CONF_HYDRATE_DEVICES,
+    DEFAULT_IMAGE_ROTATION,
+    IMAGE_ROTATION_MODES,
+)
 
 class KiwiOTConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 1.1
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry: config_entries.ConfigEntry):
+        return KiwiOTOptionsFlow(config_entry)
+
     async def async_step_user(self, user_input: Optional[Dict[str, Any]] = None):
         errors = {}
 
@@ -30,6 +48,9 @@ class KiwiOTConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             vol.Required(CONF_CREDENTIAL): str,
             vol.Required(CONF_CLIENT_ID): str,
             vol.Optional(CONF_IGNORE_SSL, default=False): bool,
+            vol.Optional(CONF_IMAGE_ROTATION, default=DEFAULT_IMAGE_ROTATION): vol.In(IMAGE_ROTATION_MODES),
+            vol.Optional(CONF_LAZY_HYDRATION, default=False): bool,
+            vol.Optional(CONF_HYDRATE_DEVICES, default=""): str,
         })
 
         return self.async_show_form(
@@ -37,3 +58,24 @@ class KiwiOTConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             data_schema=data_schema,
             errors=errors,
         )
+
+
+class KiwiOTOptionsFlow(config_entries.OptionsFlow):
+    """修改按需加载设置, 保存后重新加载集成生效"""
+
+    def __init__(self, config_entry: config_entries.ConfigEntry):
+        self._entry = config_entry
+
+    async def async_step_init(self, user_input: Optional[Dict[str, Any]] = None):
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        def _current(key, default):
+            return self._entry.options.get(key, self._entry.data.get(key, default))
+
+        data_schema = vol.Schema({
+            vol.Optional(CONF_LAZY_HYDRATION, default=_current(CONF_LAZY_HYDRATION, False)): bool,
+            vol.Optional(CONF_HYDRATE_DEVICES, default=_current(CONF_HYDRATE_DEVICES, "")): str,
+        })
+
+        return self.async_show_form(step_id="init", data_schema=data_schema)
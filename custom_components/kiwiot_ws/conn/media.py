@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from ..const import LOGGER_NAME
+from .userinfo import get_llock_video
+from .utils import redact_error
+
+_LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
+
+VIDEO_EXTENSIONS = (".mp4", ".m3u8", ".flv", ".ts", ".mov", ".h264", ".h265")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def get_media_uri(stream_info: Optional[Dict]) -> Optional[str]:
+    """从流信息中取出媒体地址"""
+    if not stream_info:
+        return None
+    return (stream_info.get("media") or {}).get("uri")
+
+
+def is_video_media(stream_info: Optional[Dict]) -> bool:
+    """判断流信息中的媒体是视频片段还是图片"""
+    media = (stream_info or {}).get("media") or {}
+    media_type = str(media.get("type") or media.get("content_type") or "").lower()
+    if media_type.startswith("image"):
+        return False
+    if media_type.startswith("video"):
+        return True
+    path = urlparse(media.get("uri") or "").path.lower()
+    if path.endswith(IMAGE_EXTENSIONS):
+        return False
+    return path.endswith(VIDEO_EXTENSIONS)
+
+
+def extract_poster_frame(clip_head: bytes) -> Optional[bytes]:
+    """从视频片段开头数据中解出第一帧并旋转为竖屏 JPEG (在执行器中运行)"""
+    import ffmpeg
+
+    try:
+        poster, _ = (
+            ffmpeg
+            .input("pipe:0")
+            .output("pipe:1", vframes=1, format="image2", vcodec="mjpeg", vf="transpose=1")
+            .run(input=clip_head, capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        _LOGGER.debug("提取视频封面失败: %s", e.stderr.decode(errors='ignore')[-200:] if e.stderr else e)
+        return None
+    return poster or None
+
+
+class MediaResolver:
+    """按 stream_id 懒加载流信息和视频封面, 带失败缓存"""
+
+    def __init__(self, hass, entry, session):
+        self.hass = hass
+        self._entry = entry
+        self._session = session
+        self._stream_ttl = 600
+        self._failure_ttl = 60
+        self._clip_head_bytes = 1024 * 1024
+        self._max_posters = 8
+        self._max_streams = 32
+        self._streams: "OrderedDict[str, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self._posters: "OrderedDict[str, Tuple[float, Optional[bytes]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stream_hits = 0
+        self.stream_misses = 0
+        self.poster_hits = 0
+        self.poster_misses = 0
+
+    async def _fetch_stream(self, did: str, stream_id: str) -> Optional[Dict]:
+        info = await get_llock_video(self.hass, self._entry, did, self._session, stream_id)
+        if not get_media_uri(info):
+            _LOGGER.warning("流 %s 没有可用的媒体地址", stream_id)
+            info = None
+        self._store_stream(stream_id, self._stream_ttl if info else self._failure_ttl, info)
+        return info
+
+    def _store_stream(self, stream_id: str, ttl: float, info: Optional[Dict]):
+        """缓存流信息, 超出数量时淘汰最早写入的条目"""
+        self._streams[stream_id] = (time.monotonic() + ttl, info)
+        self._streams.move_to_end(stream_id)
+        while len(self._streams) > self._max_streams:
+            self._streams.popitem(last=False)
+
+    async def get_stream(self, did: str, stream_id: str) -> Optional[Dict]:
+        """获取流信息, 成功与失败都会缓存一段时间, 并发请求共享同一次查询"""
+        if not stream_id:
+            return None
+
+        cached = self._streams.get(stream_id)
+        if cached and cached[0] > time.monotonic():
+            self.stream_hits += 1
+            return cached[1]
+        self.stream_misses += 1
+
+        inflight = self._inflight.get(stream_id)
+        if inflight:
+            return await asyncio.shield(inflight)
+
+        future = self.hass.loop.create_future()
+        self._inflight[stream_id] = future
+        try:
+            info = await self._fetch_stream(did, stream_id)
+            future.set_result(info)
+            return info
+        except Exception as e:
+            _LOGGER.error("获取流信息失败: %s", redact_error(e))
+            self._store_stream(stream_id, self._failure_ttl, None)
+            future.set_result(None)
+            return None
+        finally:
+            self._inflight.pop(stream_id, None)
+            if not future.done():
+                future.cancel()
+
+    async def _read_clip_head(self, uri: str) -> Optional[bytes]:
+        """只下载视频片段开头的一部分数据"""
+        headers = {"Range": f"bytes=0-{self._clip_head_bytes - 1}"}
+        async with self._session.get(uri, headers=headers) as response:
+            if response.status not in (200, 206):
+                _LOGGER.error("下载视频片段失败: HTTP %s", response.status)
+                return None
+            buffer = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                buffer.extend(chunk)
+                if len(buffer) >= self._clip_head_bytes:
+                    break
+            return bytes(buffer[:self._clip_head_bytes])
+
+    async def get_poster(self, did: str, stream_id: str) -> Optional[bytes]:
+        """获取视频片段封面, 结果按 stream_id 缓存"""
+        cached = self._posters.get(stream_id)
+        if cached and cached[0] > time.monotonic():
+            self._posters.move_to_end(stream_id)
+            self.poster_hits += 1
+            return cached[1]
+        self.poster_misses += 1
+
+        stream_info = await self.get_stream(did, stream_id)
+        uri = get_media_uri(stream_info)
+        if not uri or not is_video_media(stream_info):
+            return None
+
+        poster = None
+        try:
+            clip_head = await self._read_clip_head(uri)
+            if clip_head:
+                poster = await self.hass.async_add_executor_job(extract_poster_frame, clip_head)
+        except Exception as e:
+            _LOGGER.error("获取视频封面失败: %s", redact_error(e))
+
+        expires = float("inf") if poster else time.monotonic() + self._failure_ttl
+        self._posters[stream_id] = (expires, poster)
+        self._posters.move_to_end(stream_id)
+        while len(self._posters) > self._max_posters:
+            self._posters.popitem(last=False)
+        return poster
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "streams": len(self._streams),
+            "stream_hits": self.stream_hits,
+            "stream_misses": self.stream_misses,
+            "posters": len(self._posters),
+            "poster_bytes": sum(len(poster or b"") for _, poster in self._posters.values()),
+            "poster_hits": self.poster_hits,
+            "poster_misses": self.poster_misses,
+            "inflight": len(self._inflight),
+        }
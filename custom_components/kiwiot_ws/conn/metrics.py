@@ -0,0 +1,178 @@
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from ..const import DOMAIN
+
+# 每类延迟只保留最近的样本, 内存占用固定
+LATENCY_SAMPLES = 200
+MESSAGE_RATE_WINDOW = 300
+
+_ID_SEGMENT_RE = re.compile(r"/(groups|devices|locks|streams)/[^/]+")
+
+
+def endpoint_name(url: str) -> str:
+    """去掉查询参数和 ID, 同一接口的请求归为一类"""
+    path = url.split("?", 1)[0].split("://", 1)[-1]
+    path = path[path.find("/"):] if "/" in path else "/"
+    return _ID_SEGMENT_RE.sub(r"/\1/{id}", path)
+
+
+def percentile(samples, pct: float) -> Optional[float]:
+    """最近邻法计算百分位数, 没有样本时返回 None"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class EndpointStats:
+    __slots__ = ("requests", "errors", "latencies")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else 0,
+            "p50_ms": to_ms(percentile(self.latencies, 50)),
+            "p95_ms": to_ms(percentile(self.latencies, 95)),
+        }
+
+
+def to_ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class IntegrationMetrics:
+    """集成运行指标, 只在内存中计数, 由诊断传感器定期读取"""
+
+    def __init__(self):
+        self.ws_connected_at: Optional[float] = None
+        self.ws_connects = 0
+        self.ping_rtt: Optional[float] = None
+        self._ping_id: Optional[str] = None
+        self._ping_sent_at: Optional[float] = None
+        self.messages = 0
+        self._message_times: Deque[float] = deque(maxlen=4096)
+        self.event_latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.token_refreshes = 0
+        self.image_hits = 0
+        self.image_misses = 0
+        # 缓存目录中图片的总大小, 所有相机共用同一目录, 由清理缓存时统计
+        self.image_cache_bytes = 0
+
+    # WebSocket
+    def ws_connected(self) -> None:
+        self.ws_connected_at = time.monotonic()
+        self.ws_connects += 1
+
+    def ws_disconnected(self) -> None:
+        self.ws_connected_at = None
+        self._ping_id = None
+
+    @property
+    def ws_reconnects(self) -> int:
+        return max(0, self.ws_connects - 1)
+
+    @property
+    def ws_uptime(self) -> Optional[float]:
+        if self.ws_connected_at is None:
+            return None
+        return time.monotonic() - self.ws_connected_at
+
+    def ping_sent(self, message_id: str) -> None:
+        self._ping_id = message_id
+        self._ping_sent_at = time.monotonic()
+
+    def message_received(self, header: dict) -> None:
+        now = time.monotonic()
+        self.messages += 1
+        self._message_times.append(now)
+        if self._ping_id is not None and (
+            header.get("messageId") == self._ping_id or header.get("name") == "Pong"
+        ):
+            self.ping_rtt = now - self._ping_sent_at
+            self._ping_id = None
+
+    def message_rate(self) -> float:
+        """最近 5 分钟每分钟收到的消息数"""
+        cutoff = time.monotonic() - MESSAGE_RATE_WINDOW
+        count = sum(1 for t in self._message_times if t >= cutoff)
+        return round(count * 60 / MESSAGE_RATE_WINDOW, 2)
+
+    def record_event_latency(self, seconds: float) -> None:
+        self.event_latencies.append(seconds)
+
+    # REST
+    def record_request(self, url: str, seconds: float, ok: bool) -> None:
+        name = endpoint_name(url)
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints[name] = EndpointStats()
+        stats.requests += 1
+        stats.latencies.append(seconds)
+        if not ok:
+            stats.errors += 1
+
+    @property
+    def rest_requests(self) -> int:
+        return sum(s.requests for s in self.endpoints.values())
+
+    @property
+    def rest_error_rate(self) -> float:
+        requests = self.rest_requests
+        errors = sum(s.errors for s in self.endpoints.values())
+        return round(errors * 100 / requests, 2) if requests else 0
+
+    def rest_latency(self, pct: float) -> Optional[float]:
+        samples = [t for s in self.endpoints.values() for t in s.latencies]
+        return to_ms(percentile(samples, pct))
+
+    # 图片缓存
+    def image_hit(self) -> None:
+        self.image_hits += 1
+
+    def image_miss(self) -> None:
+        self.image_misses += 1
+
+    @property
+    def image_hit_ratio(self) -> Optional[float]:
+        total = self.image_hits + self.image_misses
+        return round(self.image_hits * 100 / total, 1) if total else None
+
+    def as_dict(self) -> dict:
+        return {
+            "ws_connected": self.ws_connected_at is not None,
+            "ws_uptime": round(self.ws_uptime, 1) if self.ws_uptime is not None else None,
+            "ws_reconnects": self.ws_reconnects,
+            "ping_rtt_ms": to_ms(self.ping_rtt),
+            "messages": self.messages,
+            "messages_per_minute": self.message_rate(),
+            "event_latency_ms": {
+                "p50": to_ms(percentile(self.event_latencies, 50)),
+                "p95": to_ms(percentile(self.event_latencies, 95)),
+                "p99": to_ms(percentile(self.event_latencies, 99)),
+            },
+            "rest": {name: stats.as_dict() for name, stats in self.endpoints.items()},
+            "token_refreshes": self.token_refreshes,
+            "image_cache": {
+                "hits": self.image_hits,
+                "misses": self.image_misses,
+                "hit_ratio": self.image_hit_ratio,
+                "bytes": self.image_cache_bytes,
+            },
+        }
+
+
+def get_metrics(hass) -> IntegrationMetrics:
+    """返回配置项的指标对象, 集成未加载时返回一个不会被读取的临时对象"""
+    metrics = hass.data.get(DOMAIN, {}).get("metrics")
+    return metrics if metrics is not None else IntegrationMetrics()
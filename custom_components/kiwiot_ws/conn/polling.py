@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+from ..const import DOMAIN, LOGGER_NAME
+from ..entity.lock import KiwiLockEvent, parse_event_time
+from .userinfo import get_llock_info
+from .utils import redact_error
+from .websocket import update_device_state
+
+_LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
+
+# 轮询间隔: 有新事件时回到最小值, 无变化时逐次翻倍直到最大值
+POLL_MIN_INTERVAL = 10
+POLL_MAX_INTERVAL = 120
+# 断线期间每个门锁每次只取最近几条事件
+POLL_PAGE_SIZE = 3
+
+
+class PollingFallback:
+    """WebSocket 不可用时通过 REST 轮询事件, 连接恢复后自动停止"""
+
+    def __init__(self, hass, entry, session):
+        self.hass = hass
+        self._entry = entry
+        self._session = session
+        self._task: Optional[asyncio.Task] = None
+        self._last_seen: Dict[str, datetime] = {}
+        self.interval = POLL_MIN_INTERVAL
+        self.polls = 0
+        self.events = 0
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """WebSocket 断开时调用, 已在轮询时不重复启动"""
+        if self.active:
+            return
+        _LOGGER.info("WebSocket 不可用, 开始轮询门锁事件")
+        self.interval = POLL_MIN_INTERVAL
+        self._task = self._entry.async_create_background_task(
+            self.hass, self._run(), f"{DOMAIN}_polling_fallback"
+        )
+
+    def stop(self) -> None:
+        """WebSocket 恢复或集成卸载时调用"""
+        if not self.active:
+            return
+        _LOGGER.info("停止轮询门锁事件 (共轮询 %s 次, 补发 %s 个事件)", self.polls, self.events)
+        self._task.cancel()
+        self._task = None
+        self._last_seen.clear()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                changed = await self._poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _LOGGER.error("轮询门锁事件失败: %s", redact_error(e))
+                changed = False
+            self.interval = POLL_MIN_INTERVAL if changed else min(POLL_MAX_INTERVAL, self.interval * 2)
+            await asyncio.sleep(self.interval)
+
+    def _baseline(self, did: str, entities) -> Optional[datetime]:
+        """以最近一次已应用到实体的事件时间为起点, 之后的事件都视为断线期间的新事件"""
+        if did not in self._last_seen:
+            for entity in entities:
+                if isinstance(entity, KiwiLockEvent) and entity._event:
+                    event_time = parse_event_time(entity._event)
+                    if event_time:
+                        self._last_seen[did] = event_time
+                    break
+        return self._last_seen.get(did)
+
+    async def _poll_once(self) -> bool:
+        domain_data = self.hass.data.get(DOMAIN, {})
+        pending = domain_data.get("pending_hydration", {})
+        self.polls += 1
+        changed = False
+        for did, entities in list(domain_data.get("devices", {}).items()):
+            if did in pending:
+                continue
+            baseline = self._baseline(did, entities)
+            events = await get_llock_info(self.hass, self._entry, did, self._session, per_page=POLL_PAGE_SIZE)
+            if not events:
+                continue
+
+            new_events = []
+            for event in events:
+                event_time = parse_event_time(event) if event.get("created_at") else None
+                if event_time:
+                    new_events.append((event_time, event))
+            if baseline is None:
+                # 没有可比较的起点时只记录最新时间, 不补发历史事件
+                if new_events:
+                    self._last_seen[did] = max(item[0] for item in new_events)
+                continue
+            new_events = [item for item in new_events if item[0] > baseline]
+
+            new_events.sort(key=lambda item: item[0])
+            for event_time, event in new_events:
+                await update_device_state(self.hass, self._entry, did, event)
+                self._last_seen[did] = event_time
+                self.events += 1
+                changed = True
+        return changed
@@ -0,0 +1,141 @@
+import logging
+import re
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+from zoneinfo import ZoneInfo
+
+from ..const import LOGGER_NAME
+from .utils import open_image
+
+_LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
+
+SNAPSHOT_NAME_RE = re.compile(r"^(\d{14})_([A-Z0-9_]+)$")
+THUMBNAIL_SIZE = (160, 240)
+THUMBNAIL_DIR = "thumbs"
+
+
+class SnapshotRecord(NamedTuple):
+    """快照索引项, snapshot_id 由时间和事件名组成, 同时也是文件名"""
+    device_id: str
+    time: datetime
+    event_name: str
+    snapshot_id: str
+
+
+def make_thumbnail(image_data: bytes) -> bytes:
+    """按 EXIF 方向摆正后生成缩略图 (在执行器中运行)"""
+    from PIL import ImageOps
+
+    image = ImageOps.exif_transpose(open_image(image_data))
+    image.thumbnail(THUMBNAIL_SIZE)
+    output = BytesIO()
+    image.convert("RGB").save(output, format="JPEG", quality=80)
+    return output.getvalue()
+
+
+class SnapshotArchive:
+    """按设备保存事件快照和预生成的缩略图, 索引在启动时由文件名重建"""
+
+    def __init__(self, hass, root: Path, max_per_device: int = 200):
+        self.hass = hass
+        self._root = root
+        self._max_per_device = max_per_device
+        self._index: Dict[str, List[SnapshotRecord]] = {}
+
+    def _scan(self) -> Dict[str, List[SnapshotRecord]]:
+        index = {}
+        if not self._root.exists():
+            return index
+        for device_dir in self._root.iterdir():
+            if not device_dir.is_dir():
+                continue
+            records = []
+            for file in device_dir.glob("*.jpg"):
+                record = self._parse_record(device_dir.name, file.stem)
+                if record:
+                    records.append(record)
+            records.sort(key=lambda r: r.snapshot_id, reverse=True)
+            index[device_dir.name] = records
+        return index
+
+    @staticmethod
+    def _parse_record(device_id: str, snapshot_id: str) -> Optional[SnapshotRecord]:
+        match = SNAPSHOT_NAME_RE.match(snapshot_id)
+        if not match:
+            return None
+        time = datetime.strptime(match.group(1), "%Y%m%d%H%M%S").replace(tzinfo=ZoneInfo("Asia/Shanghai"))
+        return SnapshotRecord(device_id, time, match.group(2), snapshot_id)
+
+    async def async_load(self) -> None:
+        """启动时扫描一次快照目录建立索引"""
+        self._index = await self.hass.async_add_executor_job(self._scan)
+        _LOGGER.debug("已加载快照索引: %s 张", sum(len(r) for r in self._index.values()))
+
+    def _write(self, device_id: str, snapshot_id: str, image_data: bytes, removed: List[str]) -> None:
+        device_dir = self._root / device_id
+        (device_dir / THUMBNAIL_DIR).mkdir(parents=True, exist_ok=True)
+        (device_dir / f"{snapshot_id}.jpg").write_bytes(image_data)
+        try:
+            (device_dir / THUMBNAIL_DIR / f"{snapshot_id}.jpg").write_bytes(make_thumbnail(image_data))
+        except Exception as e:
+            _LOGGER.warning("生成缩略图失败: %s", e)
+        for old_id in removed:
+            (device_dir / f"{old_id}.jpg").unlink(missing_ok=True)
+            (device_dir / THUMBNAIL_DIR / f"{old_id}.jpg").unlink(missing_ok=True)
+
+    async def async_add(self, device_id: str, created_at: Optional[str], event_name: Optional[str], image_data: bytes) -> Optional[SnapshotRecord]:
+        """保存一张事件快照并更新索引"""
+        if not image_data:
+            return None
+        try:
+            time = datetime.fromisoformat(created_at.replace('Z', '+00:00')).astimezone(ZoneInfo("Asia/Shanghai"))
+        except (AttributeError, ValueError):
+            time = datetime.now(ZoneInfo("Asia/Shanghai"))
+        name = re.sub(r"[^A-Z0-9_]", "_", (event_name or "UNKNOWN").upper())
+        snapshot_id = f"{time.strftime('%Y%m%d%H%M%S')}_{name}"
+
+        records = self._index.setdefault(device_id, [])
+        if any(r.snapshot_id == snapshot_id for r in records):
+            return None
+        record = SnapshotRecord(device_id, time.replace(microsecond=0), name, snapshot_id)
+        records.append(record)
+        records.sort(key=lambda r: r.snapshot_id, reverse=True)
+        removed = [r.snapshot_id for r in records[self._max_per_device:]]
+        del records[self._max_per_device:]
+
+        try:
+            await self.hass.async_add_executor_job(self._write, device_id, snapshot_id, image_data, removed)
+        except Exception as e:
+            _LOGGER.error("保存事件快照失败: %s", e)
+            records.remove(record)
+            return None
+        return record
+
+    def devices(self) -> List[str]:
+        return [device_id for device_id, records in self._index.items() if records]
+
+    def snapshots(self, device_id: str, day: Optional[str] = None) -> List[SnapshotRecord]:
+        """返回设备的快照, 按时间倒序, day 格式为 YYYYMMDD"""
+        records = self._index.get(device_id, [])
+        if day:
+            return [r for r in records if r.snapshot_id.startswith(day)]
+        return list(records)
+
+    def days(self, device_id: str) -> List[str]:
+        seen = []
+        for record in self._index.get(device_id, []):
+            day = record.snapshot_id[:8]
+            if not seen or seen[-1] != day:
+                seen.append(day)
+        return seen
+
+    def get_path(self, device_id: str, snapshot_id: str, thumbnail: bool = False) -> Optional[Path]:
+        """返回快照文件路径, 只接受索引中存在的快照"""
+        if not any(r.snapshot_id == snapshot_id for r in self._index.get(device_id, [])):
+            return None
+        device_dir = self._root / device_id
+        if thumbnail:
+            return device_dir / THUMBNAIL_DIR / f"{snapshot_id}.jpg"
+        return device_dir / f"{snapshot_id}.jpg"
@@ -0,0 +1,115 @@
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from homeassistant.helpers.storage import Store
+
+from ..const import DOMAIN, LOGGER_NAME, STORAGE_KEY, STORAGE_VERSION, CONF_IDENTIFIER
+
+_LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
+
+# 写入合并: 多次修改在该时间内只落盘一次
+STORAGE_SAVE_DELAY = 5
+
+
+def _read_legacy_files(config_dir: Path, identifier: str) -> Dict[str, Any]:
+    """读取旧版分散的 JSON 文件 (在执行器中运行), 返回迁移后的数据和待删除文件"""
+    data = {"tokens": {}, "unlock_data": {}}
+    files = []
+    if not config_dir.is_dir():
+        return {"data": data, "files": files}
+
+    safe_identifier = identifier.replace("+", "_").replace("/", "_")
+    token_file = config_dir / f"kiwiot_tokens_{safe_identifier}.json"
+    try:
+        if token_file.exists():
+            data["tokens"] = json.loads(token_file.read_text())
+            files.append(token_file)
+    except Exception as e:
+        _LOGGER.warning("读取旧版Token文件失败: %s", e)
+
+    for file in config_dir.glob("unlock_data_*.json"):
+        try:
+            did = file.stem[len("unlock_data_"):]
+            data["unlock_data"][did] = json.loads(file.read_text()).get("unlock_data", "")
+            files.append(file)
+        except Exception as e:
+            _LOGGER.warning("读取旧版解锁数据文件 %s 失败: %s", file.name, e)
+    return {"data": data, "files": files}
+
+
+def _remove_files(files) -> None:
+    for file in files:
+        file.unlink(missing_ok=True)
+
+
+class KiwiStorage:
+    """配置项的持久化数据 (Token 和各门锁的开锁数据), 启动时读取一次, 修改后合并延迟写入"""
+
+    def __init__(self, hass, entry):
+        self.hass = hass
+        self._entry = entry
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{STORAGE_KEY}.{entry.entry_id}", private=True, atomic_writes=True)
+        self._data: Dict[str, Any] = {"tokens": {}, "unlock_data": {}}
+        self._dirty = False
+        self.reads = 0
+        self.writes = 0
+        self.save_requests = 0
+
+    async def async_load(self) -> None:
+        stored = await self._store.async_load()
+        self.reads += 1
+        if stored is not None:
+            self._data = {"tokens": stored.get("tokens") or {}, "unlock_data": stored.get("unlock_data") or {}}
+            return
+
+        # 首次使用时迁移旧版文件
+        legacy = await self.hass.async_add_executor_job(
+            _read_legacy_files, Path(self.hass.config.path("kiwiot_config")), self._entry.data.get(CONF_IDENTIFIER, "")
+        )
+        self._data = legacy["data"]
+        if legacy["files"]:
+            await self._store.async_save(self._data)
+            self.writes += 1
+            await self.hass.async_add_executor_job(_remove_files, legacy["files"])
+            _LOGGER.info("已将 %s 个旧版存储文件迁移到统一存储", len(legacy['files']))
+
+    def _data_to_save(self) -> Dict[str, Any]:
+        self._dirty = False
+        self.writes += 1
+        return self._data
+
+    def _schedule_save(self) -> None:
+        self._dirty = True
+        self.save_requests += 1
+        self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    async def async_flush(self) -> None:
+        """卸载时立即写入尚未落盘的修改"""
+        if self._dirty:
+            await self._store.async_save(self._data_to_save())
+
+    def get_tokens(self) -> Dict[str, Any]:
+        return self._data["tokens"]
+
+    def set_tokens(self, tokens: Dict[str, Any]) -> None:
+        self._data["tokens"] = {**tokens, "updated_at": datetime.now().isoformat()}
+        self._schedule_save()
+
+    def get_unlock_data(self, did: str) -> Optional[str]:
+        return self._data["unlock_data"].get(did)
+
+    def set_unlock_data(self, did: str, value: str) -> None:
+        if self._data["unlock_data"].get(did) == value:
+            return
+        self._data["unlock_data"][did] = value
+        self._schedule_save()
+
+    def stats(self) -> Dict[str, int]:
+        return {"reads": self.reads, "writes": self.writes, "save_requests": self.save_requests}
+
+
+def get_storage(hass) -> Optional[KiwiStorage]:
+    return hass.data.get(DOMAIN, {}).get("storage")
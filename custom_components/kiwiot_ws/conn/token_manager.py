@@ -1,21 +1,19 @@
 import aiohttp
+import asyncio
 import logging
-import json
 import time
-import os
-import aiofiles
-from pathlib import Path
 from typing import Optional, Dict, Any
 from datetime import datetime
 from asyncio import Lock
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
-from ..const import BASE_URL, LOGGER_NAME, CONF_IDENTIFIER, CONF_CREDENTIAL, CONF_CLIENT_ID
+from ..const import BASE_URL, LOGGER_NAME, DOMAIN, CONF_IDENTIFIER, CONF_CREDENTIAL, CONF_CLIENT_ID
+from .metrics import get_metrics
 
 _LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
 
 class TokenManager:
-    def __init__(self, hass: HomeAssistant, entry: ConfigEntry):
+    def __init__(self, hass: HomeAssistant, entry: ConfigEntry, storage=None):
         """初始化 TokenManager"""
         self.hass = hass
         self._entry = entry
@@ -27,48 +25,35 @@ class TokenManager:
         self._token_type: str = "bearer"
         self._expires_at: Optional[float] = None
         self._lock = Lock()
+        # 最近一次确认token有效的时间, 间隔内不再重复发起校验请求
+        self._validated_at: float = 0
+        self._validation_interval = 300
         
-        storage_dir = Path(hass.config.path("kiwiot_config"))
-        storage_dir.mkdir(parents=True, exist_ok=True)
-        safe_identifier = self._identifier.replace("+", "_").replace("/", "_")
-        self._storage_file = storage_dir / f"kiwiot_tokens_{safe_identifier}.json"
+        self._storage = storage
 
-    async def _load_stored_tokens(self) -> None:
-        """从存储文件异步加载令牌"""
-        try:
-            if self._storage_file.exists():
-                async with aiofiles.open(self._storage_file, "r") as f:
-                    data = json.loads(await f.read())
-                    if self._identifier == data.get("identifier"):
-                        self._access_token = data.get("access_token")
-                        self._refresh_token = data.get("refresh_token")
-                        self._expires_at = data.get("expires_at")
-                        self._token_type = data.get("token_type", "bearer")
-                        _LOGGER.info(f"已从{self._storage_file}存储加载Token信息:{data}")
-        except Exception as e:
-            _LOGGER.error(f"加载Token存储失败: {e}")
+    def _load_stored_tokens(self) -> None:
+        """从已加载到内存的存储中读取令牌"""
+        if self._storage is None:
+            return
+        data = self._storage.get_tokens()
+        if data and self._identifier == data.get("identifier"):
+            self._access_token = data.get("access_token")
+            self._refresh_token = data.get("refresh_token")
+            self._expires_at = data.get("expires_at")
+            self._token_type = data.get("token_type", "bearer")
+            _LOGGER.info("已从存储加载Token, 过期时间: %s", datetime.fromtimestamp(self._expires_at) if self._expires_at else None)
 
-    async def _save_tokens(self) -> None:
-        """保存令牌到存储文件"""
-        try:
-            self._storage_file.parent.mkdir(parents=True, exist_ok=True)
-            
-            data = {
-                "identifier": self._identifier,
-                "access_token": self._access_token,
-                "refresh_token": self._refresh_token,
-                "expires_at": self._expires_at,
-                "token_type": self._token_type,
-                "updated_at": datetime.now().isoformat()
-            }
-            
-            async with aiofiles.open(self._storage_file, "w") as f:
-                await f.write(json.dumps(data, indent=2))
-            _LOGGER.debug(f"Token信息已保存到: {self._storage_file}")
-            
-        except Exception as e:
-            _LOGGER.error(f"保存Token失败: {e}")
-            raise
+    def _save_tokens(self) -> None:
+        """保存令牌, 由存储层合并延迟写入"""
+        if self._storage is None:
+            return
+        self._storage.set_tokens({
+            "identifier": self._identifier,
+            "access_token": self._access_token,
+            "refresh_token": self._refresh_token,
+            "expires_at": self._expires_at,
+            "token_type": self._token_type,
+        })
 
     def _is_token_expired(self) -> bool:
         """检查token是否过期"""
@@ -76,47 +61,56 @@ class TokenManager:
             return True
         return time.time() > (self._expires_at - 300)
 
+    def status(self) -> Dict[str, Any]:
+        """诊断用的token状态, 不包含token本身"""
+        return {
+            "has_access_token": self._access_token is not None,
+            "has_refresh_token": self._refresh_token is not None,
+            "token_type": self._token_type,
+            "expires_at": datetime.fromtimestamp(self._expires_at).isoformat() if self._expires_at else None,
+            "expires_in": round(self._expires_at - time.time()) if self._expires_at else None,
+            "expired": self._is_token_expired(),
+            "validated_ago": round(time.monotonic() - self._validated_at) if self._validated_at else None,
+        }
+
+    def _is_recently_validated(self) -> bool:
+        return (
+            self._access_token is not None
+            and not self._is_token_expired()
+            and time.monotonic() - self._validated_at < self._validation_interval
+        )
+
     async def get_token(self, session) -> Optional[str]:
         """获取有效的access token"""
+        if self._is_recently_validated():
+            return self._access_token
         async with self._lock:
             try:
-                if not self._storage_file.exists(): 
-                    _LOGGER.debug(f"Token存储文件不存在，将获取新token: {self._storage_file}")
-                    await self._fetch_new_token(session)
-                    return self._access_token  
-                
                 if self._access_token is None:
-                    if self._storage_file.exists():
-                        await self._load_stored_tokens()
-                    else:
-                        _LOGGER.debug(f"Token存储文件不存在，将获取新token: {self._storage_file}")
-                        try:
-                            await self._fetch_new_token(session)
-                            if self._access_token:
-                                return self._access_token
-                            raise ValueError("获取新token失败")
-                        except Exception as e:
-                            _LOGGER.error(f"初始获取token失败: {e}")
-                            return None
+                    self._load_stored_tokens()
+                if self._access_token is None:
+                    _LOGGER.debug("没有存储的Token，将获取新token")
+                    await self._fetch_new_token(session)
+                    return self._access_token
                       
                 if not self._is_token_expired():
                     if await self.is_token_valid(session):
-                        _LOGGER.info(f"使用缓存的token, 过期时间: {datetime.fromtimestamp(self._expires_at)}")
+                        _LOGGER.debug("使用缓存的token, 过期时间: %s", datetime.fromtimestamp(self._expires_at))
                         return self._access_token
                     elif not await self.is_token_valid(session):
                         _LOGGER.warning("Token无效")
                         await self._fetch_new_token(session)
-                        _LOGGER.warning(f"{self._access_token}使用新token, 过期时间: {datetime.fromtimestamp(self._expires_at)}")
+                        _LOGGER.warning("使用新token, 过期时间: %s", datetime.fromtimestamp(self._expires_at))
                         return self._access_token
                     else:
                         _LOGGER.warning("未知错误")
                         await self._fetch_new_token(session)
-                        _LOGGER.warning(f"{self._access_token}使用新token, 过期时间: {datetime.fromtimestamp(self._expires_at)}")
+                        _LOGGER.warning("使用新token, 过期时间: %s", datetime.fromtimestamp(self._expires_at))
                         return self._access_token
                 else:
-                    _LOGGER.warning(f"Token：{self._access_token} 已过期")
+                    _LOGGER.warning("Token 已过期")
                     await self._fetch_new_token(session)
-                    _LOGGER.warning(f"token已刷新：{self._access_token}, 过期时间: {datetime.fromtimestamp(self._expires_at)}")
+                    _LOGGER.warning("token已刷新, 过期时间: %s", datetime.fromtimestamp(self._expires_at))
                     return self._access_token
 
                 # if self._refresh_token:
@@ -125,12 +119,12 @@ class TokenManager:
                 #         await self._refresh_access_token(session)
                 #         return self._access_token
                 #     except Exception as e:
-                #         _LOGGER.warning(f"刷新token失败: {e}")
+                #         _LOGGER.warning("刷新token失败: %s", e)
 
                 # _LOGGER.info("获取新token")
 
             except Exception as e:
-                _LOGGER.error(f"获取token失败: {e}")
+                _LOGGER.error("获取token失败: %s", e)
                 return None
 
 #刷新接口存在问题，暂时不使用
@@ -166,7 +160,7 @@ class TokenManager:
                 await self._update_tokens(token_data)
                 _LOGGER.info("Token刷新成功")
         except Exception as e:
-            _LOGGER.error(f"刷新token时发生错误: {e}")
+            _LOGGER.error("刷新token时发生错误: %s", e)
             raise
 
     async def _fetch_new_token(self, session) -> None:
@@ -195,7 +189,7 @@ class TokenManager:
                     
 
         except Exception as e:
-            _LOGGER.error(f"获取新token时发生错误: {e}")
+            _LOGGER.error("获取新token时发生错误: %s", e)
             raise
 
     async def _update_tokens(self, token_data: Dict[str, Any]) -> None:
@@ -208,21 +202,22 @@ class TokenManager:
         self._token_type = token_data.get("token_type", "secure")
         expires_in = int(token_data.get("expires_in", 3600))
         self._expires_at = time.time() + expires_in - 300
+        self._validated_at = time.monotonic()
+        get_metrics(self.hass).token_refreshes += 1
 
-        await self._save_tokens()
+        self._save_tokens()
 
     async def is_token_valid(self, session) -> bool:
         """验证当前token是否有效"""
         if not self._access_token or self._is_token_expired():
             return False
-        # _LOGGER.info(f"验证Token有效性: {self._access_token}, {self._token_type}")
         try:
             test_url = f"{BASE_URL}/restapi/groups"
             headers = {
                 "Content-Type": "application/json",
                 "Authorization": f"{self._token_type} {self._access_token}"
             }
-            # _LOGGER.info(f"hearders: {headers}")
+            # _LOGGER.info("hearders: %s", headers)
             async with session.get(
                 test_url,
                 headers=headers,
@@ -230,16 +225,38 @@ class TokenManager:
             ) as response:
                 if response.status == 401:
                     _LOGGER.info("验证：Token已失效")
+                    self._validated_at = 0
                     return False
-                return response.status == 200
+                if response.status == 200:
+                    self._validated_at = time.monotonic()
+                    return True
+                return False
                 
         except Exception as e:
-            _LOGGER.debug(f"Token验证失败: {e}")
+            _LOGGER.debug("Token验证失败: %s", e)
             return False
 
+    async def keep_warm(self, session, interval: int = 60) -> None:
+        """定期校验token, 保持token有效并维持到API服务器的TLS连接, 降低开锁延迟"""
+        while not session.closed:
+            await asyncio.sleep(interval)
+            try:
+                if not await self.is_token_valid(session):
+                    await self.get_token(session)
+            except Exception as e:
+                _LOGGER.debug("保持连接失败: %s", e)
+
     async def invalidate_token(self) -> None:
         """使当前token失效"""
+        self._validated_at = 0
         self._access_token = None
         self._refresh_token = None
         self._expires_at = None
-        await self._save_tokens()
\ No newline at end of file
+        self._save_tokens()
+
+def get_token_manager(hass: HomeAssistant, entry: ConfigEntry) -> TokenManager:
+    """返回配置项共享的 TokenManager, 共享内存中的token和校验状态"""
+    token_manager = hass.data.get(DOMAIN, {}).get("token_manager")
+    if token_manager is None:
+        token_manager = TokenManager(hass, entry, hass.data.get(DOMAIN, {}).get("storage"))
+    return token_manager
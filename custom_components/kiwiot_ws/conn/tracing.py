@@ -0,0 +1,100 @@
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from ..const import DOMAIN
+
+# 只保留最近的事件追踪, 供诊断信息下载
+TRACE_BUFFER_SIZE = 50
+
+
+class EventTrace:
+    """单个事件从接收到状态写入的各阶段耗时, 时间点均为 time.monotonic()"""
+
+    __slots__ = ("did", "event", "created_at", "received_at", "received_wall", "delivery_lag", "finished_at", "spans")
+
+    def __init__(self, received_at: float, received_wall: float):
+        self.did: Optional[str] = None
+        self.event: Optional[str] = None
+        self.created_at: Optional[str] = None
+        self.received_at = received_at
+        self.received_wall = received_wall
+        self.delivery_lag: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        self.spans.append((name, start, end))
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.monotonic())
+
+    def set_event(self, did: Optional[str], event: Optional[str], created_at: Optional[str]) -> None:
+        """记录事件信息, 并用云端 created_at 计算推送延迟"""
+        self.did = did
+        self.event = event
+        self.created_at = created_at
+        try:
+            created = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            self.delivery_lag = self.received_wall - created.timestamp()
+        except (AttributeError, ValueError):
+            self.delivery_lag = None
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+
+    def as_dict(self) -> dict:
+        def offset(t):
+            return round((t - self.received_at) * 1000, 1)
+
+        return {
+            "did": self.did,
+            "event": self.event,
+            "created_at": self.created_at,
+            "received_at": datetime.fromtimestamp(self.received_wall, timezone.utc).isoformat(),
+            "delivery_lag_ms": round(self.delivery_lag * 1000, 1) if self.delivery_lag is not None else None,
+            "total_ms": offset(self.finished_at) if self.finished_at is not None else None,
+            "spans": [
+                {"name": name, "start_ms": offset(start), "duration_ms": round((end - start) * 1000, 1)}
+                for name, start, end in self.spans
+            ],
+        }
+
+
+class TraceBuffer:
+    """固定长度的事件追踪环形缓冲区"""
+
+    def __init__(self, maxlen: int = TRACE_BUFFER_SIZE):
+        self._traces = deque(maxlen=maxlen)
+
+    def start(self, received_at: Optional[float] = None) -> EventTrace:
+        trace = EventTrace(received_at or time.monotonic(), time.time())
+        self._traces.append(trace)
+        return trace
+
+    def __len__(self) -> int:
+        return len(self._traces)
+
+    def as_list(self, did: Optional[str] = None) -> List[dict]:
+        """按时间倒序返回追踪记录, 可按门锁过滤"""
+        return [t.as_dict() for t in reversed(self._traces) if did is None or t.did == did]
+
+
+def get_traces(hass) -> TraceBuffer:
+    """返回配置项的追踪缓冲区, 集成未加载时返回一个临时对象"""
+    traces = hass.data.get(DOMAIN, {}).get("traces")
+    return traces if traces is not None else TraceBuffer()
+
+
+def trace_span(trace: Optional[EventTrace], name: str):
+    """trace 为 None 时(如轮询补发的事件)不记录"""
+    return trace.span(name) if trace is not None else nullcontext()
@@ -1,76 +1,165 @@
 ﻿import aiohttp
+import copy
+import json
 import logging
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 from ..const import BASE_URL, LOGGER_NAME, DOMAIN
-from .token_manager import TokenManager
+from .token_manager import get_token_manager
+from .metrics import get_metrics
+from .utils import redact, redact_error, redact_url
 
 _LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
 
+
+class ValidatorCache:
+    """REST GET 的条件请求缓存, 保存 ETag/Last-Modified 和解析后的结果, 304 时直接复用"""
+
+    def __init__(self, max_entries=256):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_saved = 0
+        self.decodes_saved = 0
+
+    @staticmethod
+    def make_key(url):
+        """缓存键不含 access_token, token 刷新后仍可命中"""
+        parts = urlsplit(url)
+        query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k != "access_token"])
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+
+    def conditional_headers(self, key):
+        self.requests += 1
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        etag, last_modified, _, _ = entry
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def hit(self, key):
+        """服务器返回 304 时取出缓存结果的副本, 调用方修改结果不会影响缓存, 同时统计节省的流量和解析次数"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        self.not_modified += 1
+        self.bytes_saved += entry[3]
+        self.decodes_saved += 1
+        return copy.deepcopy(entry[2])
+
+    def store(self, key, etag, last_modified, data, size):
+        if not etag and not last_modified:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (etag, last_modified, data, size)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "bytes_saved": self.bytes_saved,
+            "decodes_saved": self.decodes_saved,
+            "entries": len(self._entries),
+        }
+
+
+def get_validator_cache(hass):
+    """返回配置项的条件请求缓存, 集成未加载时返回一个不保留的临时对象, 不会重新创建域数据"""
+    domain_data = hass.data.get(DOMAIN)
+    if domain_data is None:
+        return ValidatorCache()
+    if "validator_cache" not in domain_data:
+        domain_data["validator_cache"] = ValidatorCache()
+    return domain_data["validator_cache"]
+
+
 async def _make_request(hass, session, url, error_prefix="获取信息"):
-    
+    cache = get_validator_cache(hass)
+    key = cache.make_key(url)
+    metrics = get_metrics(hass)
+    started = time.monotonic()
     try:
-        async with session.get(url) as response:
+        async with session.get(url, headers=cache.conditional_headers(key)) as response:
+            if response.status == 304:
+                cached = cache.hit(key)
+                if cached is not None:
+                    metrics.record_request(url, time.monotonic() - started, True)
+                    return cached
             if response.status == 200:
-                return await response.json()
-            else:
-                _LOGGER.error(f"{error_prefix}失败: 状态码 {response.status}")
-                response.raise_for_status()
+                body = await response.read()
+                data = json.loads(body)
+                cache.store(key, response.headers.get("ETag"), response.headers.get("Last-Modified"), data, len(body))
+                metrics.record_request(url, time.monotonic() - started, True)
+                return data
+            _LOGGER.error("%s失败: 状态码 %s, 地址 %s", error_prefix, response.status, redact_url(url))
     except aiohttp.ClientError as e:
-        _LOGGER.error(f"在{error_prefix}时发生错误: {e}")
-        return None
+        _LOGGER.error("在%s时发生错误: %s", error_prefix, redact_error(e))
     except Exception as e:
-        _LOGGER.error(f"发生意外错误: {e}")
-        return None
+        _LOGGER.error("发生意外错误: %s", redact_error(e))
+    metrics.record_request(url, time.monotonic() - started, False)
+    return None
 
 async def get_ggid(hass, entry, session):
-    token_manager = TokenManager(hass, entry)
+    token_manager = get_token_manager(hass, entry)
     token = await token_manager.get_token(session)
     url = f"{BASE_URL}/restapi/groups?access_token={token}"
     return await _make_request(hass, session, url, "获取组信息")
 
 async def get_ddevices(hass, entry, gid, session):
-    token_manager = TokenManager(hass, entry)
+    token_manager = get_token_manager(hass, entry)
     token = await token_manager.get_token(session)
     url = f"{BASE_URL}/restapi/groups/{gid}/devices?access_token={token}"
     return await _make_request(hass, session, url, "获取设备信息")
 
 async def get_user_info(hass, entry, session):
-    token_manager = TokenManager(hass, entry)
+    token_manager = get_token_manager(hass, entry)
     token = await token_manager.get_token(session)
     url = f"{BASE_URL}/restapi/user?access_token={token}"
     return await _make_request(hass, session, url, "获取用户信息")
 async def get_device_info(hass, entry, did, session):
-    token_manager = TokenManager(hass, entry)
+    token_manager = get_token_manager(hass, entry)
     token = await token_manager.get_token(session)
     url = f"{BASE_URL}/api/devices/{did}?access_token={token}"
     return await _make_request(hass, session, url, "获取设备信息")
 
 async def get_llock_userinfo(hass, entry, did, session):
-    token_manager = TokenManager(hass, entry)
+    token_manager = get_token_manager(hass, entry)
     token = await token_manager.get_token(session)
     url = f"{BASE_URL}/api/locks/{did}/users?access_token={token}"
     return await _make_request(hass, session, url, "获取锁用户信息")
 
-async def get_llock_info(hass, entry, did, session):
-    token_manager = TokenManager(hass, entry)
+async def get_llock_info(hass, entry, did, session, per_page=15):
+    token_manager = get_token_manager(hass, entry)
     token = await token_manager.get_token(session)
-    url = f"{BASE_URL}/api/devices/{did}/events?page=1&per_page=15&access_token={token}"
+    url = f"{BASE_URL}/api/devices/{did}/events?page=1&per_page={per_page}&access_token={token}"
     return await _make_request(hass, session, url, "获取锁信息")
 
 async def get_llock_video(hass, entry, did, session, stream_id):
-    token_manager = TokenManager(hass, entry)
+    token_manager = get_token_manager(hass, entry)
     token = await token_manager.get_token(session)
     url = f"{BASE_URL}/api/devices/{did}/streams/{stream_id}?page=1&per_page=15&access_token={token}"
     return await _make_request(hass, session, url, "获取锁信息")
 
 async def update_lock_user_alias(hass, entry, did, user_type, user_id, new_alias, session):
     """更新锁用户别名"""
-    token_manager = TokenManager(hass, entry)
+    token_manager = get_token_manager(hass, entry)
     token = await token_manager.get_token(session)
     if len(new_alias) > 16:
         _LOGGER.error("用户别名长度不能超过16个字符")
         return False
         
-    _LOGGER.debug(f"更新用户别名: {new_alias}")
+    _LOGGER.debug("更新用户别名: %s", new_alias)
     url = f"{BASE_URL}/api/locks/{did}/users/{user_type}/{user_id}/alias"
     
     try:
@@ -81,30 +170,30 @@ async def update_lock_user_alias(hass, entry, did, user_type, user_id, new_alias
         
         async with session.put(url, json=new_alias, headers=headers) as response:
             if response.status == 204:
-                _LOGGER.info(f"成功更新用户别名为: {new_alias}")
+                _LOGGER.info("成功更新用户别名为: %s", new_alias)
                 return True
             else:
                 try:
                     error_data = await response.json()
-                    _LOGGER.error(f"更新用户别名失败: 状态码 {response.status}, 错误信息: {error_data}")
+                    _LOGGER.error("更新用户别名失败: 状态码 %s, 错误信息: %s", response.status, error_data)
                 except:
-                    _LOGGER.error(f"更新用户别名失败: 状态码 {response.status}")
+                    _LOGGER.error("更新用户别名失败: 状态码 %s", response.status)
                 return False
                 
     except aiohttp.ClientError as e:
-        _LOGGER.error(f"更新用户别名时发生错误: {e}")
+        _LOGGER.error("更新用户别名时发生错误: %s", redact_error(e))
         return False
     except Exception as e:
-        _LOGGER.error(f"发生意外错误: {e}")
+        _LOGGER.error("发生意外错误: %s", redact_error(e))
         return False
     
 async def create_mfa_token(hass, entry, uid, number, session):
     """开锁"""
-    token_manager = TokenManager(hass, entry)
+    token_manager = get_token_manager(hass, entry)
     token = await token_manager.get_token(session)
     domain_data = hass.data.get(DOMAIN, {})
     client_id = domain_data.get("client_id")
-    _LOGGER.info(f"创建MFA Token: {domain_data}")
+    _LOGGER.debug("创建MFA Token: uid=%s", uid)
 
     if len(number) > 6:
         _LOGGER.error("密码长度不能超过6个字符")
@@ -126,12 +215,13 @@ async def create_mfa_token(hass, entry, uid, number, session):
         async with session.post(url, json=payload, headers=headers) as response:
             try:
                 response_data = await response.json()
-                _LOGGER.info(f"完整响应JSON: {response_data}")
+                if _LOGGER.isEnabledFor(logging.DEBUG):
+                    _LOGGER.debug("完整响应JSON: %s", redact(response_data))
             except aiohttp.ContentTypeError:
                 _LOGGER.error("响应不是有效的JSON格式")
                 return None
             except Exception as e:
-                _LOGGER.error(f"JSON解析异常: {e}")
+                _LOGGER.error("JSON解析异常: %s", e)
                 return None
 
             if response.status == 201:
@@ -159,17 +249,17 @@ async def create_mfa_token(hass, entry, uid, number, session):
                     "details": response_data.get("details")
                 })
                 
-            _LOGGER.error(f"请求失败 [{error_info['status']}]: {error_info['message']}")
+            _LOGGER.error("请求失败 [%s]: %s", error_info['status'], error_info['message'])
             return {
                 "success": False,
                 "error": error_info
             }
             
     except aiohttp.ClientError as e:
-        _LOGGER.error(f"网络请求失败: {str(e)}")
+        _LOGGER.error("网络请求失败: %s", str(e))
         return {"success": False, "error": str(e)}
     except Exception as e:
-        _LOGGER.error(f"未处理异常: {str(e)}", exc_info=True)
+        _LOGGER.error("未处理异常: %s", str(e), exc_info=True)
         return {"success": False, "error": "系统内部错误"}
 
 
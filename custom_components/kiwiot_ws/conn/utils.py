@@ -1,18 +1,82 @@
 ﻿import logging
 import aiohttp
-import aiofiles
 import asyncio
 from datetime import datetime
 from typing import List, Dict, Optional
 from pathlib import Path
 import hashlib
-from PIL import Image
 from io import BytesIO
-from concurrent.futures import ThreadPoolExecutor
 import os
+import re
+import struct
+import time
+from collections import Counter
+from functools import partial
+from ..const import IMAGE_ROTATION_EXIF, DEFAULT_IMAGE_ROTATION
+from .metrics import get_metrics
 
 _LOGGER = logging.getLogger(__name__)
 
+# EXIF 方向值 6: 显示时需顺时针旋转 90 度, 与 rotate(-90) 等效
+EXIF_ORIENTATION_CW90 = 6
+
+# 日志中需要隐藏的字段
+SENSITIVE_KEYS = frozenset({"access_token", "refresh_token", "secureToken", "credential", "Authorization", "token"})
+REDACTED = "**REDACTED**"
+
+
+def redact_url(url: str) -> str:
+    """去掉签名参数, 只保留地址本身"""
+    return url.split("?", 1)[0] + "?**" if "?" in url else url
+
+
+_URL_RE = re.compile(r"(?:https?|wss?)://[^\s'\"]+")
+
+
+def redact_error(error) -> str:
+    """异常文本中的地址去掉查询参数, aiohttp 的异常会带上含 access_token 的完整请求地址"""
+    return _URL_RE.sub(lambda m: redact_url(m.group(0)), str(error))
+
+
+def redact(data):
+    """返回隐藏了 token 和签名地址的副本, 仅用于日志"""
+    if isinstance(data, dict):
+        return {
+            key: REDACTED if key in SENSITIVE_KEYS
+            else redact_url(value) if key in ("uri", "url") and isinstance(value, str)
+            else redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [redact(value) for value in data]
+    return data
+
+
+class LogSummary:
+    """按类型计数, 每隔 interval 秒输出一条汇总日志, 代替逐条记录高频消息"""
+
+    def __init__(self, logger, title: str, interval: float = 300):
+        self._logger = logger
+        self._title = title
+        self._interval = interval
+        self._counts = Counter()
+        self._since = time.monotonic()
+
+    def record(self, kind: str) -> None:
+        self._counts[kind] += 1
+        now = time.monotonic()
+        if now - self._since < self._interval:
+            return
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info(
+                "%s (最近 %d 秒): %s",
+                self._title,
+                now - self._since,
+                ", ".join(f"{name}={count}" for name, count in self._counts.most_common()),
+            )
+        self._counts.clear()
+        self._since = now
+
 async def get_latest_event(events: List[Dict]) -> Optional[Dict]:
     """获取最新的事件."""
     try:
@@ -26,12 +90,12 @@ async def get_latest_event(events: List[Dict]) -> Optional[Dict]:
         )
         
         latest_event = sorted_events[0]
-        _LOGGER.debug(f"最新事件: {latest_event}")
+        _LOGGER.debug("最新事件: %s", redact(latest_event))
         
         return latest_event
         
     except Exception as e:
-        _LOGGER.error(f"获取最新事件失败: {e}")
+        _LOGGER.error("获取最新事件失败: %s", e)
         return None
 
 async def get_latest_event_with_data(events: List[Dict]) -> Optional[Dict]:
@@ -50,13 +114,13 @@ async def get_latest_event_with_data(events: List[Dict]) -> Optional[Dict]:
             if (event.get("data") and 
                 isinstance(event["data"], dict) and 
                 len(event["data"]) > 0):
-                _LOGGER.debug(f"找到最近的data事件: {event}")
+                _LOGGER.debug("找到最近的data事件: %s", redact(event))
                 return event
                 
         return None
         
     except Exception as e:
-        _LOGGER.error(f"获取最近data事件失败: {e}")
+        _LOGGER.error("获取最近data事件失败: %s", e)
         return None
     
 async def get_history_events(events: List[Dict]) -> List[Dict]:
@@ -72,12 +136,12 @@ async def get_history_events(events: List[Dict]) -> List[Dict]:
         )
         
         history_events = sorted_events[1:]
-        _LOGGER.debug(f"历史事件数量: {len(history_events)}")
+        _LOGGER.debug("历史事件数量: %s", len(history_events))
         
         return history_events
         
     except Exception as e:
-        _LOGGER.error(f"获取历史事件失败: {e}")
+        _LOGGER.error("获取历史事件失败: %s", e)
         return []
     
     
@@ -149,62 +213,337 @@ async def convert_media_event_format(event_data: dict) -> dict:
         return converted_data
         
     except Exception as e:
-        _LOGGER.error(f"转换媒体事件数据失败: {e}")
+        _LOGGER.error("转换媒体事件数据失败: %s", e)
         return None
 
+# 规范化后的事件类型, 供事件实体和设备触发器使用
+EVENT_DOORBELL = "doorbell"
+EVENT_HUMAN_WANDERING = "human_wandering"
+EVENT_UNLOCKED_BY_USER = "unlocked_by_user"
+EVENT_UNLOCKED = "unlocked"
+EVENT_LOCKED = "locked"
+EVENT_USER_ADDED = "user_added"
+EVENT_TYPES = [
+    EVENT_DOORBELL,
+    EVENT_HUMAN_WANDERING,
+    EVENT_UNLOCKED_BY_USER,
+    EVENT_UNLOCKED,
+    EVENT_LOCKED,
+    EVENT_USER_ADDED,
+]
+
+LOCK_USER_TYPES = {"FINGERPRINT", "PASSWORD", "CARD", "FACE"}
+UNLOCK_EVENT_NAMES = {"UNLOCKED", "LOCK_INDOOR_BUTTON_UNLOCK", "LOCK_INDOOR_LEVER_UNLOCK", "REMOTE_UNLOCK"}
+
+
+def build_user_aliases(users) -> Dict:
+    """建立 (用户类型, 编号) -> 别名 的索引"""
+    aliases = {}
+    if isinstance(users, list):
+        for user in users:
+            if user.get("alias"):
+                aliases[(user.get("type"), user.get("number"))] = user["alias"]
+    return aliases
+
+
+def normalize_lock_event(event_data: dict, user_aliases: Dict) -> Optional[Dict]:
+    """将事件转换为结构化字段, 无法识别的事件返回 None"""
+    if not event_data:
+        return None
+    name = event_data.get("name")
+    level = event_data.get("level")
+    data = event_data.get("data") or {}
+    lock_user = data.get("lock_user") or {}
+    method = lock_user.get("type")
+
+    try:
+        user_id = int(lock_user.get("id"))
+    except (TypeError, ValueError):
+        user_id = None
+
+    if name == "REMOTE_UNLOCK" and level == "CRITICAL":
+        event_type = EVENT_DOORBELL
+    elif name == "HUMAN_WANDERING":
+        event_type = EVENT_HUMAN_WANDERING
+    elif name == "UNLOCKED" and method in LOCK_USER_TYPES and user_id is not None:
+        event_type = EVENT_UNLOCKED_BY_USER
+    elif name in UNLOCK_EVENT_NAMES:
+        event_type = EVENT_UNLOCKED
+    elif name == "LOCKED":
+        event_type = EVENT_LOCKED
+    elif name == "LOCK_ADD_USER":
+        event_type = EVENT_USER_ADDED
+    else:
+        return None
+
+    # 图片标识不含签名参数, 可以安全地用于比较和记录
+    image_key = data.get("stream_id")
+    image_uri = (data.get("image") or {}).get("uri")
+    if not image_key and image_uri:
+        image_key = hashlib.sha1(image_uri.split("?", 1)[0].encode()).hexdigest()[:16]
+
+    return {
+        "event_type": event_type,
+        "name": name,
+        "level": level,
+        "method": method,
+        "user_id": user_id,
+        "user_alias": user_aliases.get((method, user_id)),
+        "image_key": image_key,
+        "created_at": event_data.get("created_at"),
+    }
+
+
+def _exif_orientation_segment(orientation: int) -> bytes:
+    """只含 Orientation 一项的最小 EXIF APP1 段 (大端 TIFF 头 + IFD0)"""
+    tiff = (
+        b"MM\x00\x2a" + struct.pack(">I", 8)
+        + struct.pack(">H", 1)
+        + struct.pack(">HHIHH", 0x0112, 3, 1, orientation, 0)
+        + struct.pack(">I", 0)
+    )
+    exif_payload = b"Exif\x00\x00" + tiff
+    return b"\xff\xe1" + struct.pack(">H", len(exif_payload) + 2) + exif_payload
+
+
+class JpegOrientationWriter:
+    """流式写入 JPEG 时插入 EXIF 方向标记, 不解码也不重新压缩图像数据.
+
+    只缓存 SOI 和紧随其后的 APPn 段, 遇到第一个非 APPn 标记后输出改写后的头部, 其余数据原样透传.
+    保留 APP0(JFIF) 等其它段, 去掉已有的 EXIF APP1, 新的 EXIF 段放在 APP0 之后.
+    数据不是可处理的 JPEG 时 failed 为 True 并原样输出, 调用方应回退到 PIL 旋转.
+    """
+
+    def __init__(self, orientation: int = EXIF_ORIENTATION_CW90):
+        self._exif_segment = _exif_orientation_segment(orientation)
+        self._header = bytearray()
+        self._done = False
+        self.failed = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        """返回可以写出的数据, 头部未读完时返回空字节"""
+        if self._done:
+            return chunk
+        self._header += chunk
+        return self._rewrite_header()
+
+    def close(self) -> bytes:
+        """数据结束时头部仍不完整, 说明不是可处理的 JPEG"""
+        if self._done:
+            return b""
+        return self._give_up()
+
+    def _give_up(self) -> bytes:
+        self.failed = True
+        self._done = True
+        data = bytes(self._header)
+        self._header = bytearray()
+        return data
+
+    def _rewrite_header(self) -> bytes:
+        header = self._header
+        if len(header) < 2:
+            return b""
+        if header[:2] != b"\xff\xd8":
+            return self._give_up()
+
+        pos = 2
+        segments = []
+        while True:
+            if pos + 2 > len(header):
+                return b""
+            if header[pos] != 0xFF:
+                return self._give_up()
+            marker = header[pos + 1]
+            if not 0xE0 <= marker <= 0xEF:
+                break
+            if pos + 4 > len(header):
+                return b""
+            length = struct.unpack(">H", header[pos + 2:pos + 4])[0]
+            if length < 2:
+                return self._give_up()
+            end = pos + 2 + length
+            if end > len(header):
+                return b""
+            segment = bytes(header[pos:end])
+            if not (marker == 0xE1 and segment[4:10] == b"Exif\x00\x00"):
+                segments.append(segment)
+            pos = end
+
+        insert_at = 1 if segments and segments[0][1] == 0xE0 else 0
+        segments.insert(insert_at, self._exif_segment)
+        data = b"\xff\xd8" + b"".join(segments) + bytes(header[pos:])
+        self._header = bytearray()
+        self._done = True
+        return data
+
+
+def set_jpeg_orientation(data: bytes, orientation: int = EXIF_ORIENTATION_CW90) -> Optional[bytes]:
+    """在 JPEG 头部写入 EXIF 方向标记, 返回 None 表示数据不是可处理的 JPEG"""
+    writer = JpegOrientationWriter(orientation)
+    rewritten = writer.feed(data) + writer.close()
+    return None if writer.failed else rewritten
+
+
+def open_image(data: bytes):
+    """解码图片, 截断的 JPEG 补上结束标记后按可读部分解码, 不修改 PIL 的全局设置"""
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+    try:
+        image.load()
+    except OSError:
+        if not (data[:2] == b"\xff\xd8" and not data.endswith(b"\xff\xd9")):
+            raise
+        _LOGGER.debug("图片数据不完整, 按可读部分解码")
+        image = Image.open(BytesIO(data + b"\xff\xd9"))
+        image.load()
+    return image
+
+
+def rotate_image_with_pil(data: bytes) -> bytes:
+    """解码后顺时针旋转 90 度并重新编码为 JPEG (有损, 作为回退路径)"""
+    image = open_image(data)
+    output = BytesIO()
+    image.rotate(-90, expand=True).convert("RGB").save(output, format="JPEG")
+    return output.getvalue()
+
+
 class ImageCache:
-    def __init__(self, hass, cache_dir: Path):
+    def __init__(self, hass, cache_dir: Path, rotation_mode: str = DEFAULT_IMAGE_ROTATION):
         self.hass = hass
         self._cache_dir = cache_dir
-        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        self._rotation_mode = rotation_mode
+        # 缓存目录在首次下载时于执行器中创建, 构造时不访问文件系统
+        self._cache_dir_ready = False
         self._current_image_url = None
         self._current_cache_file = None
-        self._executor = ThreadPoolExecutor(max_workers=2)
         self._max_cache_files = 10
+        self._max_image_bytes = 5 * 1024 * 1024
+        self._chunk_size = 64 * 1024
+        self._allowed_content_types = ("image/", "application/octet-stream")
+        self._current_digest = None
         self._downloading = False
+        # 最近一次清理后缓存目录中保留的图片总大小
+        self._cache_bytes = 0
 
-    async def _cleanup_old_cache(self):
-        """清理旧的缓存文件，只保留最近的10个文件"""
+    def _cleanup_old_cache(self):
+        """清理旧的缓存文件，只保留最近的10个文件, 并统计保留文件的大小 (在执行器中运行)"""
         try:
             cache_files = sorted(
-                [f for f in self._cache_dir.glob("*.jpg")],
-                key=lambda x: x.stat().st_mtime,
+                ((f, f.stat()) for f in self._cache_dir.glob("*.jpg")),
+                key=lambda item: item[1].st_mtime,
                 reverse=True
             )
             
-            if len(cache_files) > self._max_cache_files:
-                for old_file in cache_files[self._max_cache_files:]:
-                    try:
-                        old_file.unlink()
-                        _LOGGER.debug(f"删除旧缓存文件: {old_file}")
-                    except Exception as e:
-                        _LOGGER.error(f"删除缓存文件失败: {e}")
+            for old_file, _ in cache_files[self._max_cache_files:]:
+                try:
+                    old_file.unlink()
+                    _LOGGER.debug("删除旧缓存文件: %s", old_file)
+                except Exception as e:
+                    _LOGGER.error("删除缓存文件失败: %s", e)
+            self._cache_bytes = sum(stat.st_size for _, stat in cache_files[:self._max_cache_files])
 
         except Exception as e:
-            _LOGGER.error(f"清理缓存文件失败: {e}")
+            _LOGGER.error("清理缓存文件失败: %s", e)
+
+    def _process_and_save(self, part_file: Path, cache_file: Path, previous_file: Optional[Path] = None, oriented: bool = False) -> bytes:
+        """在执行器中完成旋转和写盘, 每张图片只占用一次执行器
+
+        oriented 为 True 时下载时已写入方向标记, 临时文件直接成为缓存文件, 只读取一次作为返回值;
+        否则解码旋转后重新编码. 新图片写入后再删除上一张图片, 保证切换期间始终有图可用, 然后统计缓存大小.
+        """
+        if oriented:
+            os.replace(part_file, cache_file)
+            rotated = cache_file.read_bytes()
+        else:
+            try:
+                image_data = part_file.read_bytes()
+            finally:
+                part_file.unlink(missing_ok=True)
+            if self._rotation_mode == IMAGE_ROTATION_EXIF:
+                _LOGGER.debug("图片不支持EXIF方向标记, 回退到PIL旋转")
+            rotated = rotate_image_with_pil(image_data)
+            del image_data
+
+            tmp_file = cache_file.with_suffix(".tmp")
+            tmp_file.write_bytes(rotated)
+            os.replace(tmp_file, cache_file)
+        if previous_file and previous_file != cache_file:
+            previous_file.unlink(missing_ok=True)
+        self._cleanup_old_cache()
+        return rotated
+
+    async def _save_image_to_file(self, part_file: Path, cache_file: Path, previous_file: Optional[Path] = None, oriented: bool = False) -> bytes:
+        return await self.hass.async_add_executor_job(self._process_and_save, part_file, cache_file, previous_file, oriented)
+
+    async def _ensure_cache_dir(self) -> None:
+        if not self._cache_dir_ready:
+            await self.hass.async_add_executor_job(partial(self._cache_dir.mkdir, parents=True, exist_ok=True))
+            self._cache_dir_ready = True
+
+    async def _download_to_file(self, response, part_file: Path, writer: Optional[JpegOrientationWriter] = None) -> Optional[str]:
+        """流式写入临时文件并同时计算摘要, 超出大小或类型不符时返回 None
+
+        传入 writer 时在同一遍写入中插入 EXIF 方向标记, 摘要始终按原始数据计算.
+        """
+        content_type = response.headers.get("Content-Type", "")
+        if not content_type.startswith(self._allowed_content_types):
+            _LOGGER.error("下载图片失败: 不支持的内容类型 %s", content_type)
+            return None
+        if response.content_length and response.content_length > self._max_image_bytes:
+            _LOGGER.error("下载图片失败: 图片大小 %s 超过限制", response.content_length)
+            return None
+
+        import aiofiles
+        import aiofiles.os
+
+        digest = hashlib.sha1()
+        total = 0
+        try:
+            async with aiofiles.open(part_file, mode="wb") as file:
+                async for chunk in response.content.iter_chunked(self._chunk_size):
+                    total += len(chunk)
+                    if total > self._max_image_bytes:
+                        _LOGGER.error("下载图片失败: 图片大小超过限制 %s", self._max_image_bytes)
+                        break
+                    digest.update(chunk)
+                    await file.write(writer.feed(chunk) if writer else chunk)
+                else:
+                    if writer:
+                        await file.write(writer.close())
+                    return digest.hexdigest()
+        except BaseException:
+            await self.hass.async_add_executor_job(partial(part_file.unlink, missing_ok=True))
+            raise
+
+        await aiofiles.os.remove(part_file)
+        return None
 
-    async def _save_image_to_file(self, image: Image.Image, cache_file: Path) -> None:
-        def _save():
-            image.save(cache_file, format="JPEG")
-        
-        await self.hass.async_add_executor_job(_save)
-        await self._cleanup_old_cache()  
     def _get_cache_filename(self, url: str) -> str:
-        _LOGGER.info( "保存文件：" + hashlib.md5(url.encode()).hexdigest() + ".jpg")
         return hashlib.md5(url.encode()).hexdigest() + ".jpg"
 
     async def _read_file_bytes(self, cache_file: Path) -> bytes:
+        import aiofiles
+
         async with aiofiles.open(cache_file, mode='rb') as file:
             return await file.read()
 
     async def clear_cache(self) -> None:
-        if self._current_cache_file and os.path.exists(self._current_cache_file):
-            try:
-                os.remove(self._current_cache_file)
-                self._current_image_url = None
-                self._current_cache_file = None
-            except Exception as e:
-                _LOGGER.error(f"清除缓存文件失败: {e}")
+        if not self._current_cache_file:
+            return
+        import aiofiles.os
+
+        try:
+            await aiofiles.os.remove(self._current_cache_file)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            _LOGGER.error("清除缓存文件失败: %s", e)
+            return
+        self._current_image_url = None
+        self._current_cache_file = None
+        self._current_digest = None
 
     async def get_image(self, url: str) -> Optional[bytes]:
         """获取图片，支持缓存和预下载"""
@@ -213,12 +552,16 @@ class ImageCache:
 
         cache_file = self._cache_dir / self._get_cache_filename(url)
         
-        if self._current_image_url == url and cache_file.exists():
+        if self._current_image_url == url and self._current_cache_file:
             try:
-                _LOGGER.debug(f"使用缓存图片: {cache_file}")
-                return await self._read_file_bytes(cache_file)
+                _LOGGER.debug("使用缓存图片: %s", self._current_cache_file)
+                image_data = await self._read_file_bytes(self._current_cache_file)
+                get_metrics(self.hass).image_hit()
+                return image_data
+            except FileNotFoundError:
+                _LOGGER.debug("缓存图片已被清理, 重新下载: %s", self._current_cache_file)
             except Exception as e:
-                _LOGGER.error(f"读取缓存图片失败: {e}")
+                _LOGGER.error("读取缓存图片失败: %s", e)
 
         while self._downloading:
             await asyncio.sleep(0.1)
@@ -228,26 +571,38 @@ class ImageCache:
             async with aiohttp.ClientSession() as session:
                 async with session.get(url) as response:
                     if response.status != 200:
-                        _LOGGER.error(f"下载图片失败: HTTP {response.status}")
+                        _LOGGER.error("下载图片失败: HTTP %s", response.status)
+                        return None
+
+                    await self._ensure_cache_dir()
+                    part_file = cache_file.with_suffix(".part")
+                    writer = JpegOrientationWriter() if self._rotation_mode == IMAGE_ROTATION_EXIF else None
+                    digest = await self._download_to_file(response, part_file, writer)
+                    if digest is None:
                         return None
 
-                    image_data = await response.read()
-                    
-                    def process_image():
-                        image = Image.open(BytesIO(image_data))
-                        return image.rotate(-90, expand=True)
-                    
-                    rotated_image = await self.hass.async_add_executor_job(process_image)
-                    await self._save_image_to_file(rotated_image, cache_file)
-                    
+                    if digest == self._current_digest and self._current_cache_file:
+                        # 图片内容未变(仅签名URL不同), 复用已处理的缓存文件
+                        await self.hass.async_add_executor_job(partial(part_file.unlink, missing_ok=True))
+                        self._current_image_url = url
+                        _LOGGER.debug("图片内容未变化, 复用缓存: %s", redact_url(url))
+                        get_metrics(self.hass).image_hit()
+                        return await self._read_file_bytes(self._current_cache_file)
+
+                    oriented = writer is not None and not writer.failed
+                    image_data = await self._save_image_to_file(part_file, cache_file, self._current_cache_file, oriented)
                     self._current_image_url = url
                     self._current_cache_file = cache_file
-                    
-                    _LOGGER.debug(f"图片已下载并缓存: {url}")
-                    return await self._read_file_bytes(cache_file)
+                    self._current_digest = digest
+
+                    metrics = get_metrics(self.hass)
+                    metrics.image_miss()
+                    metrics.image_cache_bytes = self._cache_bytes
+                    _LOGGER.debug("图片已下载并缓存: %s", redact_url(url))
+                    return image_data
 
         except Exception as e:
-            _LOGGER.error(f"处理图片失败: {e}")
+            _LOGGER.error("处理图片失败: %s", redact_error(e))
             return None
         finally:
             self._downloading = False
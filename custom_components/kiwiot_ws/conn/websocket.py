@@ -1,22 +1,35 @@
-import logging
+﻿import logging
 import aiohttp
 import asyncio
 import re
 import random
 import json
-from datetime import datetime
-from zoneinfo import ZoneInfo
+import time
+from collections import deque
 from typing import Optional, Dict, Any
-from ..entity.lock import KiwiLockEvent, KiwiLockCamera, KiwiLockStatus
+from ..entity.lock import KiwiLockEvent, KiwiLockCamera, KiwiLockStatus, KiwiLockEventTime, KiwiLockEventNotify
 from ..const import LOGGER_NAME, WS_URL, DOMAIN
-from .utils import convert_wsevent_format, convert_media_event_format
+from .utils import convert_wsevent_format, convert_media_event_format, build_user_aliases, normalize_lock_event, redact, redact_error, LogSummary
 from homeassistant.helpers.dispatcher import async_dispatcher_send
 from .userinfo import get_llock_userinfo
-from .token_manager import TokenManager
+from .token_manager import get_token_manager
+from .metrics import get_metrics
+from .tracing import get_traces, trace_span
+from ..device_trigger import async_fire_device_triggers
 
 _LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
 
-response_futures: Dict[str, asyncio.Future] = {}
+# 超过该时间未收到任何消息时, 发送指令前先检查连接
+WS_IDLE_TIMEOUT = 45
+# 每个门锁在诊断信息中保留的最近事件数
+RECENT_EVENT_COUNT = 20
+
+def get_response_futures(hass) -> Dict[str, asyncio.Future]:
+    """等待 CtrlResponse 的指令, 按 messageId 索引, 随配置项卸载一起释放"""
+    domain_data = hass.data.get(DOMAIN)
+    if domain_data is None:
+        return {}
+    return domain_data.setdefault("response_futures", {})
 
 async def generate_uuid() -> str:
     """生成符合特定格式的 UUID 字符串。"""
@@ -29,11 +42,13 @@ async def generate_uuid() -> str:
 
 async def start_websocket_connection(hass, entry, session):
     """启动 WebSocket 连接并维护心跳和消息处理."""
-    token_manager = TokenManager(hass, entry)
+    token_manager = get_token_manager(hass, entry)
     base_retry_delay = 5
 
     msg_queue = asyncio.Queue()
     hass.data[DOMAIN]["msg_queue"] = msg_queue
+    poller = hass.data[DOMAIN].get("poller")
+    metrics = get_metrics(hass)
 
     retry_count = 0
     while True:
@@ -50,57 +65,67 @@ async def start_websocket_connection(hass, entry, session):
 
             async with session.ws_connect(ws_url) as ws:
                 hass.data[DOMAIN]["ws"] = ws
-                _LOGGER.info(f"WebSocket 连接已建立 (重试次数: {retry_count})")
+                hass.data[DOMAIN]["ws_last_rx"] = time.monotonic()
+                metrics.ws_connected()
+                _LOGGER.info("WebSocket 连接已建立 (重试次数: %s)", retry_count)
+                if poller:
+                    poller.stop()
 
                 tasks = [
-                    asyncio.create_task(send_heartbeat(ws)),
+                    asyncio.create_task(send_heartbeat(ws, metrics)),
                     asyncio.create_task(handle_websocket_messages(ws, hass, entry)),
-                    asyncio.create_task(process_message_queue(ws, msg_queue))
+                    asyncio.create_task(process_message_queue(ws, msg_queue, get_response_futures(hass)))
                 ]
 
                 try:
+                    # 服务器正常关闭连接时读取任务正常结束, 消息队列任务不会退出,
+                    # 任一任务结束即视为连接结束, 进入重连和轮询回退
                     done, pending = await asyncio.wait(
                         tasks, 
-                        return_when=asyncio.FIRST_EXCEPTION
+                        return_when=asyncio.FIRST_COMPLETED
                     )
 
-                    for task in pending:
-                        task.cancel()
-                        try:
-                            await task
-                        except asyncio.CancelledError:
-                            pass
-
                     for task in done:
                         exc = task.exception()
                         if exc:
-                            _LOGGER.error(f"WebSocket任务异常: {exc}")
+                            _LOGGER.error("WebSocket任务异常: %s", redact_error(exc))
                             raise exc
+                    _LOGGER.warning("WebSocket 连接已结束, 准备重连")
 
                 except asyncio.CancelledError:
                     _LOGGER.info("WebSocket任务被取消")
-                    return
+                    raise
+                finally:
+                    # 无论正常结束还是被取消, 子任务都随连接一起结束
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    hass.data.get(DOMAIN, {}).pop("ws", None)
+                    metrics.ws_disconnected()
 
         except aiohttp.ClientError as e:
             if "Session is closed" in str(e):
                 _LOGGER.warning("Session已关闭,停止重试")
                 return
-            _LOGGER.error(f"WebSocket 连接错误: {e}")
+            _LOGGER.error("WebSocket 连接错误: %s", redact_error(e))
             retry_count += 1
 
         except Exception as e:
-            _LOGGER.error(f"WebSocket 连接发生未知异常: {e}")
+            _LOGGER.error("WebSocket 连接发生未知异常: %s", redact_error(e))
             retry_count += 1
 
         # 无限重连，除非集成被移除或 session 关闭
         if DOMAIN not in hass.data or session.closed:
             _LOGGER.warning("集成已被移除或session已关闭,停止重连")
             return
+        # 重连等待期间由 REST 轮询接管, 避免门锁状态停滞
+        if poller:
+            poller.start()
         wait_time = base_retry_delay * min(10, 2 ** retry_count)
-        _LOGGER.info(f"等待 {wait_time} 秒后重试连接 (当前重试次数: {retry_count})")
+        _LOGGER.info("等待 %s 秒后重试连接 (当前重试次数: %s)", wait_time, retry_count)
         await asyncio.sleep(wait_time)
 
-async def send_heartbeat(ws):
+async def send_heartbeat(ws, metrics=None):
     """发送心跳消息。"""
 
     interval = 30
@@ -116,17 +141,46 @@ async def send_heartbeat(ws):
                 }
             }
             await ws.send_json(ping_message)
+            if metrics is not None:
+                metrics.ping_sent(uuid)
             _LOGGER.debug("心跳消息已发送")
             await asyncio.sleep(interval)
     except asyncio.CancelledError:
         _LOGGER.info("心跳任务被取消")
         raise
     except Exception as e:
-        _LOGGER.error(f"心跳消息发送失败: {e}")
+        _LOGGER.error("心跳消息发送失败: %s", e)
         raise
 
-async def send_unlock_command(hass, send_token, unlock_data, device_id) -> bool:
-    """发送开锁指令"""
+def is_websocket_open(hass) -> bool:
+    ws = hass.data.get(DOMAIN, {}).get("ws")
+    return ws is not None and not ws.closed
+
+async def wait_websocket_alive(hass, timeout: float = 5) -> bool:
+    """等待 WebSocket 可用, 重连中时最多等待 timeout 秒
+
+    连接最近没有收到任何消息时发送一次协议层 ping, 写入失败说明连接已断开.
+    """
+    deadline = time.monotonic() + timeout
+    while not is_websocket_open(hass):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.1)
+
+    domain_data = hass.data.get(DOMAIN, {})
+    if time.monotonic() - domain_data.get("ws_last_rx", 0) > WS_IDLE_TIMEOUT:
+        try:
+            await domain_data["ws"].ping()
+        except Exception as e:
+            _LOGGER.warning("WebSocket 连接检查失败: %s", e)
+            return False
+    return True
+
+async def send_unlock_command(hass, send_token, unlock_data, device_id, response_future=None, bypass_queue=False) -> bool:
+    """发送开锁指令, 传入 response_future 时由对应的 CtrlResponse 完成
+
+    bypass_queue 为 True 且连接可用时直接写入 WebSocket, 不在消息队列中排队.
+    """
     try:
         msg_queue = hass.data.get(DOMAIN, {}).get("msg_queue")
         if not msg_queue:
@@ -148,42 +202,80 @@ async def send_unlock_command(hass, send_token, unlock_data, device_id) -> bool:
                 "data": unlock_data
             }
         }
-        
+
+        if response_future is not None:
+            get_response_futures(hass)[uuid] = response_future
+        ws = hass.data.get(DOMAIN, {}).get("ws")
+        if bypass_queue and ws is not None and not ws.closed:
+            await ws.send_json(msg)
+            _LOGGER.debug("开锁指令已直接发送: %s", device_id)
+            return True
         await msg_queue.put(msg)
-        _LOGGER.debug(f"开锁指令已加入队列: {device_id}")
+        _LOGGER.debug("开锁指令已加入队列: %s", device_id)
         return True
         
     except Exception as e:
-        _LOGGER.error(f"发送开锁指令失败: {e}")
+        _LOGGER.error("发送开锁指令失败: %s", e)
+        release_response_future(hass, response_future)
         return False
 
+def release_response_future(hass, response_future) -> None:
+    """移除等待中的指令响应, 超时或取消后不再保留"""
+    if response_future is None:
+        return
+    response_futures = get_response_futures(hass)
+    for message_id, future in list(response_futures.items()):
+        if future is response_future:
+            response_futures.pop(message_id, None)
+
+def is_ctrl_response_ok(data) -> bool:
+    """判断 CtrlResponse 是否表示成功"""
+    payload = (data or {}).get("payload") or {}
+    if payload.get("error") or payload.get("success") is False:
+        return False
+    return payload.get("code") in (None, 0, "0", 200)
+
 async def handle_websocket_messages(ws, hass, entry):
     """处理 WebSocket 消息并更新实体状态"""
+    domain_data = hass.data.get(DOMAIN, {})
+    # 逐条消息只在 debug 级别记录, info 级别定期输出按类型汇总的数量
+    summary = LogSummary(_LOGGER, "WebSocket 消息统计")
+    metrics = get_metrics(hass)
+    traces = get_traces(hass)
+    response_futures = get_response_futures(hass)
     try:
         async for msg in ws:
+            received_at = domain_data["ws_last_rx"] = time.monotonic()
             if msg.type == aiohttp.WSMsgType.TEXT:
                 try:
                     data = json.loads(msg.data)
-                    _LOGGER.info(f"接收到消息: {data}")
-                    
+                    parsed_at = time.monotonic()
                     header = data.get("header", {})
+                    summary.record(header.get("name", "unknown"))
+                    metrics.message_received(header)
+                    if _LOGGER.isEnabledFor(logging.DEBUG):
+                        _LOGGER.debug("接收到消息: %s", redact(data))
                     if header.get("name") == "CtrlResponse":
                         message_id = header.get("messageId")
                         if message_id in response_futures:
-                            response_futures[message_id].set_result(data)
-                            del response_futures[message_id]
+                            future = response_futures.pop(message_id)
+                            if not future.done():
+                                future.set_result(data)
                             continue
                     
                     if (header.get("namespace") == "Iot.Device" and 
                         header.get("name") == "EventNotify"):
-                        await process_device_event(hass, entry, data)
+                        trace = traces.start(received_at)
+                        trace.add_span("parse", received_at, parsed_at)
+                        await process_device_event(hass, entry, data, trace)
+                        metrics.record_event_latency(time.monotonic() - received_at)
                         
                 except json.JSONDecodeError as e:
-                    _LOGGER.error(f"JSON解析错误: {e}")
+                    _LOGGER.error("JSON解析错误: %s", e)
                     continue
                     
             elif msg.type == aiohttp.WSMsgType.ERROR:
-                _LOGGER.error(f"WebSocket 错误: {msg.data}")
+                _LOGGER.error("WebSocket 错误: %s", msg.data)
                 break
             elif msg.type == aiohttp.WSMsgType.CLOSED:
                 _LOGGER.warning("WebSocket 连接已关闭")
@@ -193,53 +285,93 @@ async def handle_websocket_messages(ws, hass, entry):
         _LOGGER.info("WebSocket消息处理任务被取消")
         raise
     except Exception as e:
-        _LOGGER.error(f"处理 WebSocket 消息时发生错误: {e}")
+        _LOGGER.error("处理 WebSocket 消息时发生错误: %s", e)
         for future in response_futures.values():
             if not future.done():
                 future.set_exception(e)
         raise
     finally:
+        # 连接结束后不会再收到这些指令的响应
         for future in response_futures.values():
             if not future.done():
                 future.cancel()
+        response_futures.clear()
 
-async def process_device_event(hass, entry, data):
-    """处理设备事件通知"""
+async def process_device_event(hass, entry, data, trace=None):
+    """处理设备事件通知, trace 记录各阶段耗时"""
     payload = data.get("payload", {})
     device_id = payload.get("did")
     event_name = payload.get("name")
     event_type = payload.get("level")
     
     try:
-        if event_name in {"UNLOCKED", "LOCKED"}:
-            payload = await convert_wsevent_format(payload)
-        elif event_type == "CRITICAL" and event_name == "REMOTE_UNLOCK":
-            payload = await convert_media_event_format(payload)
-        else:
-            _LOGGER.warning(f"未知事件类型: {payload}")
+        with trace_span(trace, "convert"):
+            if event_name in {"UNLOCKED", "LOCKED"}:
+                payload = await convert_wsevent_format(payload)
+            elif (event_type == "CRITICAL" and event_name == "REMOTE_UNLOCK") or event_name == "HUMAN_WANDERING":
+                payload = await convert_media_event_format(payload)
+            else:
+                _LOGGER.warning("未知事件类型: %s", redact(payload))
+        if trace is not None:
+            trace.set_event(device_id, event_name, payload.get("created_at"))
             
-        _LOGGER.debug(f"事件数据格式化: {payload}")
-        await update_device_state(hass, entry, device_id, payload)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("事件数据格式化: %s", redact(payload))
+        await update_device_state(hass, entry, device_id, payload, trace=trace)
         
     except Exception as e:
-        _LOGGER.error(f"处理设备事件失败: {e}")
+        _LOGGER.error("处理设备事件失败: %s", e)
+    finally:
+        if trace is not None:
+            trace.finish()
+
+async def update_device_state(hass, entry, device_id, event_data, notify=True, trace=None):
+    """根据WebSocket消息更新设备实体状态
+
+    notify 为 False 时(如手动刷新旧事件)只更新状态, 不触发通知事件和设备触发器.
+    trace 不为 None 时记录用户信息获取和状态写入的耗时.
+    """
+    # lock_ctrl 依赖本模块发送指令, 在函数内导入以避免循环导入
+    from ..entity.lock_ctrl import KiwiLock
 
-async def update_device_state(hass, entry, device_id, event_data):
-    """根据WebSocket消息更新设备实体状态"""
     try:
         domain_data = hass.data.get(DOMAIN, {})
         device_entities = domain_data.get("devices", {}).get(device_id, [])
         
         if not device_entities:
-            _LOGGER.warning(f"未找到设备ID {device_id} 对应的实体")
+            _LOGGER.warning("未找到设备ID %s 对应的实体", device_id)
+            # 可能是新绑定的门锁, 触发一次拓扑同步
+            reconciler = domain_data.get("topology")
+            if reconciler:
+                entry.async_create_background_task(
+                    hass, reconciler.async_reconcile(), f"{DOMAIN}_topology_reconcile"
+                )
             return
             
         session = domain_data.get("session")
         if not session:
             _LOGGER.error("无法获取会话实例")
             return
+
+        # 按需加载的门锁在首次收到事件时完整加载, 之后与其它门锁一样更新通知、状态和快照
+        reconciler = domain_data.get("topology")
+        if reconciler and reconciler.is_pending(device_id):
+            with trace_span(trace, "hydrate"):
+                await reconciler.async_hydrate(device_id)
+            device_entities = domain_data.get("devices", {}).get(device_id, [])
             
-        users = await get_llock_userinfo(hass, entry, device_id, session)
+        with trace_span(trace, "userinfo"):
+            users = await get_llock_userinfo(hass, entry, device_id, session)
+        # 获取用户列表失败时沿用上一次的别名索引
+        alias_cache = domain_data.setdefault("user_aliases", {})
+        if users is not None:
+            alias_cache[device_id] = build_user_aliases(users)
+            if reconciler:
+                await reconciler.async_sync_users(device_id, users)
+        normalized = normalize_lock_event(event_data, alias_cache.get(device_id, {}))
+        remember_event(domain_data, device_id, normalized)
+        if normalized and notify:
+            async_fire_device_triggers(hass, device_id, normalized)
         
         update_tasks = []
         for entity in device_entities:
@@ -247,54 +379,81 @@ async def update_device_state(hass, entry, device_id, event_data):
                 update_tasks.append(update_lock_event(entity, event_data, users))
             elif isinstance(entity, KiwiLockStatus) and event_data.get("name") in {"UNLOCKED", "LOCKED", "LOCK_INDOOR_BUTTON_UNLOCK"}:
                 update_tasks.append(update_lock_status(entity, event_data))
+            elif isinstance(entity, KiwiLockEventNotify) and normalized and notify:
+                update_tasks.append(update_event_notify(entity, normalized))
+            elif isinstance(entity, KiwiLock) and normalized:
+                update_tasks.append(update_lock(entity, normalized))
+            elif isinstance(entity, KiwiLockEventTime):
+                update_tasks.append(update_event_time(entity, event_data))
             elif isinstance(entity, KiwiLockCamera) and event_data.get("data"):
-                update_tasks.append(update_camera(entity, event_data))
+                update_tasks.append(update_camera(entity, event_data, trace))
                 
-        await asyncio.gather(*update_tasks, return_exceptions=True)
+        with trace_span(trace, "state_write"):
+            await asyncio.gather(*update_tasks, return_exceptions=True)
         async_dispatcher_send(hass, f"{DOMAIN}_{device_id}_update")
             
     except Exception as e:
-        _LOGGER.error(f"更新设备状态失败: {e}，错误数据结构：{event_data}")
+        _LOGGER.error("更新设备状态失败: %s，错误数据结构：%s", e, redact(event_data))
+
+def remember_event(domain_data, device_id, normalized):
+    """保留每个门锁最近的规范化事件, 供诊断信息使用"""
+    if not normalized:
+        return
+    recent = domain_data.setdefault("recent_events", {})
+    if device_id not in recent:
+        recent[device_id] = deque(maxlen=RECENT_EVENT_COUNT)
+    recent[device_id].append(normalized)
 
 async def update_lock_event(entity, event_data, users):
     """更新门锁事件实体"""
     try:
-        entity._event = event_data
-        entity._users = users
-        if "created_at" in event_data:
-            timestamp = datetime.fromisoformat(
-                event_data["created_at"].replace('Z', '+00:00')
-            ).astimezone(ZoneInfo("Asia/Shanghai"))
-            entity._event_time = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            entity._notify_time = timestamp.strftime("%H:%M:%S")
-        await entity.async_update_ha_state(True)
-        _LOGGER.debug(f"已更新设备事件状态: {entity}")
+        entity.apply_event(event_data, users)
+        entity.async_write_ha_state()
+        _LOGGER.debug("已更新设备事件状态: %s", entity)
     except Exception as e:
-        _LOGGER.error(f"更新门锁事件失败: {e}")
+        _LOGGER.error("更新门锁事件失败: %s", e)
 
 async def update_lock_status(entity, event_data):
     """更新门锁状态实体"""
     try:
-        entity._event = event_data
-        if "created_at" in event_data:
-            timestamp = datetime.fromisoformat(
-                event_data["created_at"].replace('Z', '+00:00')
-            ).astimezone(ZoneInfo("Asia/Shanghai"))
-            entity._event_time = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            entity._notify_time = timestamp.strftime("%H:%M:%S")
-        await entity.async_update_ha_state(True)
-        _LOGGER.debug(f"已更新门锁状态: {entity}")
+        entity.apply_event(event_data)
+        entity.async_write_ha_state()
+        _LOGGER.debug("已更新门锁状态: %s", entity)
+    except Exception as e:
+        _LOGGER.error("更新门锁状态失败: %s", e)
+
+async def update_event_time(entity, event_data):
+    """更新事件时间实体"""
+    try:
+        entity.apply_event(event_data)
+        entity.async_write_ha_state()
+    except Exception as e:
+        _LOGGER.error("更新事件时间失败: %s", e)
+
+async def update_event_notify(entity, normalized):
+    """触发门锁通知事件实体"""
+    try:
+        entity.apply_event(normalized)
+        entity.async_write_ha_state()
+    except Exception as e:
+        _LOGGER.error("触发门锁通知事件失败: %s", e)
+
+async def update_lock(entity, normalized):
+    """更新锁实体状态"""
+    try:
+        if entity.apply_event(normalized):
+            entity.async_write_ha_state()
     except Exception as e:
-        _LOGGER.error(f"更新门锁状态失败: {e}")
+        _LOGGER.error("更新锁状态失败: %s", e)
 
-async def update_camera(entity, event_data):
+async def update_camera(entity, event_data, trace=None):
     """更新相机实体"""
     try:
-        await entity.update_from_event(event_data)
-        await entity.async_update_ha_state(True)
-        _LOGGER.debug("已更新相机状态和图片")
+        with trace_span(trace, "camera_update"):
+            await entity.update_from_event(event_data, trace)
+        _LOGGER.debug("已更新相机状态, 图片在后台下载")
     except Exception as e:
-        _LOGGER.error(f"更新相机状态失败: {e}")
+        _LOGGER.error("更新相机状态失败: %s", e)
 
 async def stop_websocket_connection(websocket_task):
     """停止 WebSocket 连接任务。"""
@@ -308,9 +467,9 @@ async def stop_websocket_connection(websocket_task):
     except asyncio.CancelledError:
         _LOGGER.info("WebSocket 连接任务被取消")
     except Exception as e:
-        _LOGGER.error(f"停止 WebSocket 连接任务时发生错误: {e}")
+        _LOGGER.error("停止 WebSocket 连接任务时发生错误: %s", e)
 
-async def process_message_queue(ws, queue):
+async def process_message_queue(ws, queue, response_futures):
     """处理消息队列中的请求"""
     try:
         while True:
@@ -322,14 +481,14 @@ async def process_message_queue(ws, queue):
                     continue
 
                 await ws.send_json(msg)
-                _LOGGER.debug(f"消息队列发送消息: {msg}")
+                _LOGGER.debug("消息队列发送消息: %s", msg.get("header", {}).get("name"))
                 queue.task_done()
                     
             except asyncio.CancelledError:
                 _LOGGER.info("消息队列处理被取消")
                 raise
             except Exception as e:
-                _LOGGER.error(f"处理消息队列异常: {e}")
+                _LOGGER.error("处理消息队列异常: %s", e)
                 if not queue.empty():
                     queue.task_done()
                 
@@ -340,3 +499,4 @@ async def process_message_queue(ws, queue):
         for fut in response_futures.values():
             if not fut.done():
                 fut.cancel()
+        response_futures.clear()
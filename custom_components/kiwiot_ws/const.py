@@ -5,6 +5,9 @@ CONF_CREDENTIAL = "credential"
 CONF_CLIENT_ID = "X-Kiwik-Client-Id"
 CONF_ACCESS_TOKEN = "access_token"
 CONF_IGNORE_SSL = "ignore_ssl"
+CONF_IMAGE_ROTATION = "image_rotation"
+CONF_LAZY_HYDRATION = "lazy_hydration"
+CONF_HYDRATE_DEVICES = "hydrate_devices"
 
 # 实体类别
 DEVICE_TYPES = {
@@ -24,6 +27,22 @@ TOKEN_EXPIRATION_BUFFER = 300
 STORAGE_VERSION = 1
 STORAGE_KEY = "kiwiot_tokens"
 
+# 拓扑同步: 运行中新增的实体通过该信号交给各平台添加
+SIGNAL_NEW_ENTITIES = f"{DOMAIN}_new_entities_{{}}"
+TOPOLOGY_SYNC_INTERVAL = 1800
+# 按需加载门锁后等待各平台添加新实体的时间(秒)
+HYDRATE_ADD_TIMEOUT = 10
+
+# 诊断指标传感器的发布间隔(秒)
+METRICS_PUBLISH_INTERVAL = 60
+
+# 图片旋转方式: pil 解码旋转后重新编码(默认), exif 仅写入方向标记(无损)
+# HA 的相机代理按尺寸缩放时会丢弃 EXIF, 缩略图不会旋转, 因此 exif 需要手动选择
+IMAGE_ROTATION_EXIF = "exif"
+IMAGE_ROTATION_PIL = "pil"
+IMAGE_ROTATION_MODES = [IMAGE_ROTATION_PIL, IMAGE_ROTATION_EXIF]
+DEFAULT_IMAGE_ROTATION = IMAGE_ROTATION_PIL
+
 
 # 日志
 LOGGER_NAME = f"{DOMAIN}_logger"
\ No newline at end of file
@@ -1,11 +1,24 @@
-﻿import logging
-from .const import LOGGER_NAME
+﻿import asyncio
+import logging
+import re
+import time
+from homeassistant.helpers import device_registry as dr, entity_registry as er
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from .const import (
+    DOMAIN,
+    LOGGER_NAME,
+    CONF_IMAGE_ROTATION,
+    CONF_LAZY_HYDRATION,
+    CONF_HYDRATE_DEVICES,
+    DEFAULT_IMAGE_ROTATION,
+    SIGNAL_NEW_ENTITIES,
+    HYDRATE_ADD_TIMEOUT,
+)
 from .conn.userinfo import (
     get_ggid, 
     get_ddevices, 
     get_llock_userinfo, 
     get_llock_info, 
-    get_llock_video, 
     get_user_info
     )
 from .entity.lock import (
@@ -14,9 +27,11 @@ from .entity.lock import (
     KiwiLockEvent, 
     KiwiLockUser, 
     KiwiLockCamera, 
-    KiwiLockStatus
+    KiwiLockStatus,
+    KiwiLockEventTime,
+    KiwiLockEventNotify
     )
-from .entity.lock_ctrl import KiwiLockPasswordInput, KiwiLockPasswordConfirm, KiwiLockUnlockDataInput
+from .entity.lock_ctrl import KiwiLockPasswordInput, KiwiLockPasswordConfirm, KiwiLockUnlockDataInput, KiwiLock
 from .conn.utils import (
     get_latest_event, 
     get_history_events, 
@@ -26,78 +41,346 @@ from .conn.utils import (
 _LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
 
 
-async def initialize_devices_and_groups(hass, entry, session, callback):
-    """初始化设备和组信息."""
+def entity_device_id(entity):
+    """返回实体所属门锁的 did, 不属于门锁的实体返回 None"""
+    device = getattr(entity, "_device", None) or getattr(entity, "_lock_device", None)
+    return device.device_id if device is not None else None
+
+
+# 旧版用户实体 unique_id: {门锁}_user_{编号}_{列表序号}, 序号随用户增删变化
+LEGACY_USER_UNIQUE_ID_RE = re.compile(r"^(\d+)_(\d+)$")
+
+
+def user_unique_id(lock_device, user):
+    """用户实体 unique_id 由 (类型, 编号) 决定, 与用户列表顺序无关"""
+    user_type = str(user.get("type", "unknown")).lower()
+    return f"{lock_device.unique_id}_user_{user_type}_{user.get('number', 'unknown')}"
+
+
+def migrate_user_unique_ids(hass, entry, lock_device, users):
+    """把旧版按列表序号生成的 unique_id 迁移为按 (类型, 编号) 生成, 保留实体ID和自动化引用"""
+    users = users or []
+    registry = er.async_get(hass)
+    prefix = f"{lock_device.unique_id}_user_"
+    for reg_entry in er.async_entries_for_config_entry(registry, entry.entry_id):
+        if reg_entry.domain != "text" or not reg_entry.unique_id.startswith(prefix):
+            continue
+        match = LEGACY_USER_UNIQUE_ID_RE.match(reg_entry.unique_id[len(prefix):])
+        if not match:
+            continue
+        number, position = match.group(1), int(match.group(2))
+        # 列表未变化时序号直接对应用户; 否则只在编号唯一时迁移
+        if 0 < position <= len(users) and str(users[position - 1].get("number")) == number:
+            user = users[position - 1]
+        else:
+            candidates = [u for u in users if str(u.get("number")) == number]
+            if len(candidates) != 1:
+                continue
+            user = candidates[0]
+        new_unique_id = user_unique_id(lock_device, user)
+        if registry.async_get_entity_id("text", DOMAIN, new_unique_id) is None:
+            registry.async_update_entity(reg_entry.entity_id, new_unique_id=new_unique_id)
+            _LOGGER.debug("用户实体 %s 的 unique_id 已迁移", reg_entry.entity_id)
+
+
+def build_user_entities(hass, entry, lock_device, users):
+    """为门锁用户创建实体"""
+    user_entities = []
+    for user in users or []:
+        try:
+            user_entity = KiwiLockUser(
+                hass,
+                entry,
+                lock_device,
+                user,
+                device_id=lock_device.device_id,
+                unique_id=user_unique_id(lock_device, user)
+            )
+            user_entities.append(user_entity)
+        except ValueError as ve:  
+            _LOGGER.error("创建用户实体时发生值错误: %s, user_data: %s", ve, user)
+            continue
+        except Exception as e:  
+            _LOGGER.error("创建用户实体失败: %s, user_data: %s", e, user)
+            continue
+    return user_entities
+
+
+async def build_lock_entities(hass, entry, session, group, device_info, master_uid):
+    """拉取单个门锁的用户和事件并创建其全部实体"""
+    lock_device = KiwiLockDevice(hass, device_info, group["gid"], group["name"])
+    _LOGGER.debug("设备信息: %s", lock_device.device_info)  
+
+    users = await get_llock_userinfo(hass, entry, device_info["did"], session)
+    events = await get_llock_info(hass, entry, device_info["did"], session)
+    latest_event = await get_latest_event(events)
+    latest_data_event = await get_latest_event_with_data(events)
+    history_events = await get_history_events(events)
+
+    password_input = KiwiLockPasswordInput(hass, lock_device, master_uid, device_info["did"])
+    unlock_data_input = KiwiLockUnlockDataInput(hass, lock_device, master_uid, device_info["did"])
+    password_confirm = KiwiLockPasswordConfirm(hass, entry, lock_device, master_uid, device_info["did"], password_input, unlock_data_input)
+    device_entities = [
+        KiwiLockStatus(hass, lock_device, latest_event, history_events),  
+        KiwiLockEvent(hass, lock_device, latest_event, history_events, users),  
+        KiwiLockEventTime(hass, lock_device, latest_event),
+        KiwiLockEventNotify(hass, lock_device),
+        KiwiLockInfo(hass, lock_device, group),
+        password_input, 
+        password_confirm,
+        unlock_data_input,
+        KiwiLock(hass, entry, lock_device, master_uid, password_input, unlock_data_input, latest_event),
+        KiwiLockCamera(
+            hass,
+            lock_device,
+            latest_data_event,
+            entry.data.get(CONF_IMAGE_ROTATION, DEFAULT_IMAGE_ROTATION)
+        )
+    ]
+    migrate_user_unique_ids(hass, entry, lock_device, users)
+    device_entities.extend(build_user_entities(hass, entry, lock_device, users))
+    return device_entities
+
+
+def get_entry_option(entry, key, default=None):
+    """选项流程中修改的值优先, 其次是初次配置时填写的值"""
+    return entry.options.get(key, entry.data.get(key, default))
+
+
+def should_hydrate(entry, did):
+    """按需加载模式下, 只有包含列表中的门锁在启动时完整加载"""
+    if not get_entry_option(entry, CONF_LAZY_HYDRATION, False):
+        return True
+    include = {item.strip() for item in get_entry_option(entry, CONF_HYDRATE_DEVICES, "").split(",") if item.strip()}
+    return did in include
+
+
+async def build_device_entities(hass, entry, session, group, device_info, master_uid):
+    """创建门锁实体; 按需加载的门锁只创建设备外壳, 不发起任何请求"""
+    did = device_info["did"]
+    if should_hydrate(entry, did):
+        return await build_lock_entities(hass, entry, session, group, device_info, master_uid)
+    hass.data[DOMAIN].setdefault("pending_hydration", {})[did] = (group, device_info)
+    lock_device = KiwiLockDevice(hass, device_info, group["gid"], group["name"])
+    return [KiwiLockInfo(hass, lock_device, group)]
+
+
+async def fetch_cloud_locks(hass, entry, session):
+    """返回云端门锁 {did: (group, device_info)}, 任一请求失败时返回 None"""
+    groups = await get_ggid(hass, entry, session)
+    if groups is None:
+        return None
+    locks = {}
+    for group in groups:
+        devices = await get_ddevices(hass, entry, group["gid"], session)
+        if devices is None:
+            return None
+        for device_info in devices:
+            if device_info["type"] == "LOCK":
+                locks[device_info["did"]] = (group, device_info)
+    return locks
+
+
+async def initialize_devices_and_groups(hass, entry, session, callback, groups=None):
+    """初始化设备和组信息, 每完成一个门锁即通过 callback 交出其实体, 返回门锁数量."""
+    count = 0
     try:
-        groups = await get_ggid(hass, entry, session)
+        if groups is None:
+            groups = await get_ggid(hass, entry, session)
         if not groups:
             _LOGGER.error("获取组信息失败")
-            return
+            return count
+
+        master = await get_user_info(hass, entry, session)
+        master_uid = (master or {}).get("uid", "unknown")
+        hass.data[DOMAIN]["master_uid"] = master_uid
 
-        all_device_entities = []  
         for group in groups:
             devices = await get_ddevices(hass, entry, group["gid"], session)
             if not devices:
-                _LOGGER.warning(f"组 {group['gid']} 内没有设备")
+                _LOGGER.warning("组 %s 内没有设备", group['gid'])
                 continue
 
             for device_info in devices:
                 if device_info["type"] == "LOCK":
-                    lock_device = KiwiLockDevice(hass, device_info, group["gid"], group["name"])
-                    _LOGGER.info(f"设备信息: {lock_device.device_info}")  
-
-                    users = await get_llock_userinfo(hass, entry, device_info["did"], session)
-                    master = await get_user_info(hass, entry, session)
-                    master_uid = master.get("uid", "unknown")
-                    #_LOGGER.info(f"主人数据结构示例: {master}")
-                    events = await get_llock_info(hass, entry, device_info["did"], session)
-                    latest_event = await get_latest_event(events)
-                    latest_data_event = await get_latest_event_with_data(events)
-                    history_events = await get_history_events(events)
-                    video_info = None
-                    if latest_data_event.get("name") == "HUMAN_WANDERING":
-                        stream_id = latest_data_event.get("data", {}).get("stream_id")
-                        video_info = await get_llock_video(hass, entry, device_info["did"], session, stream_id)
-                        
-                    _LOGGER.info(f"图像事件: {video_info}")
-
-                    password_input = KiwiLockPasswordInput(hass, lock_device, master_uid, device_info["did"])
-                    unlock_data_input = KiwiLockUnlockDataInput(hass, lock_device, master_uid, device_info["did"])
-                    password_confirm = KiwiLockPasswordConfirm(hass, entry, lock_device, master_uid, device_info["did"], password_input, unlock_data_input)
-                    device_entities = [
-                        KiwiLockStatus(hass, lock_device, latest_event, history_events),  
-                        KiwiLockEvent(hass, lock_device, latest_event, history_events, users),  
-                        KiwiLockInfo(hass, lock_device, group),
-                        password_input, 
-                        password_confirm,
-                        unlock_data_input,
-                        KiwiLockCamera(hass, lock_device, latest_data_event, video_info) 
-                    ]
-
-                    if users:
-                        #_LOGGER.info(f"用户数据结构示例: {users[0]}")  
-                        for user_count, user in enumerate(users, start=1):
-                            try:
-                                user_id = user.get("number", "unknown")
-                                user_entity = KiwiLockUser(
-                                    hass,
-                                    entry,
-                                    lock_device,
-                                    user,
-                                    device_id=lock_device.device_id,
-                                    unique_id=f"{lock_device.unique_id}_user_{user_id}_{user_count}"
-                                )
-                                device_entities.append(user_entity)
-                            except ValueError as ve:  
-                                _LOGGER.error(f"创建用户实体时发生值错误: {ve}, user_data: {user}")
-                                continue
-                            except Exception as e:  
-                                _LOGGER.error(f"创建用户实体失败: {e}, user_data: {user}")
-                                continue
-
-                    all_device_entities.extend(device_entities)  
-
-        callback(all_device_entities)  
+                    device_entities = await build_device_entities(hass, entry, session, group, device_info, master_uid)
+                    callback(device_entities)
+                    count += 1
 
     except Exception as e:  
-        _LOGGER.error(f"初始化设备和组信息时发生错误: {e}")
\ No newline at end of file
+        _LOGGER.error("初始化设备和组信息时发生错误: %s", e)
+    return count
+
+
+class TopologyReconciler:
+    """对比云端门锁和用户列表与已注册实体, 只增删发生变化的门锁和用户实体, 无需重载集成"""
+
+    def __init__(self, hass, entry, session, min_interval=60):
+        self.hass = hass
+        self._entry = entry
+        self._session = session
+        self._lock = asyncio.Lock()
+        self._min_interval = min_interval
+        self._last_full_sync = 0.0
+
+    @property
+    def _domain_data(self):
+        return self.hass.data.get(DOMAIN, {})
+
+    def register_entities(self, new_entities):
+        """将新实体加入索引并通知各平台添加"""
+        if not new_entities:
+            return
+        devices = self._domain_data.setdefault("devices", {})
+        for entity in new_entities:
+            did = entity_device_id(entity)
+            if did is not None:
+                devices.setdefault(did, []).append(entity)
+        entry_data = self._domain_data.get(self._entry.entry_id)
+        if entry_data is not None:
+            entry_data["entities"].extend(new_entities)
+        async_dispatcher_send(self.hass, SIGNAL_NEW_ENTITIES.format(self._entry.entry_id), new_entities)
+
+    async def _remove_entities(self, entities):
+        """移除实体及其注册表记录"""
+        registry = er.async_get(self.hass)
+        entry_data = self._domain_data.get(self._entry.entry_id)
+        for entity in entities:
+            if entry_data is not None and entity in entry_data["entities"]:
+                entry_data["entities"].remove(entity)
+            did = entity_device_id(entity)
+            device_entities = self._domain_data.get("devices", {}).get(did)
+            if device_entities and entity in device_entities:
+                device_entities.remove(entity)
+            entity_id = entity.entity_id
+            if entity.hass is not None and entity.platform is not None:
+                await entity.async_remove(force_remove=True)
+            if entity_id and registry.async_get(entity_id):
+                registry.async_remove(entity_id)
+
+    async def async_reconcile(self, force=False):
+        """全量对比门锁列表, 新增或移除门锁设备"""
+        if not force and time.monotonic() - self._last_full_sync < self._min_interval:
+            return
+        async with self._lock:
+            self._last_full_sync = time.monotonic()
+            cloud_locks = await fetch_cloud_locks(self.hass, self._entry, self._session)
+            if cloud_locks is None:
+                # 列表不完整时不做任何删除
+                _LOGGER.warning("获取门锁列表失败, 跳过本次拓扑同步")
+                return
+
+            known = self._domain_data.get("devices", {})
+            added = [did for did in cloud_locks if did not in known]
+            removed = [did for did in known if did not in cloud_locks]
+
+            master_uid = self._domain_data.get("master_uid", "unknown")
+            new_entities = []
+            for did in added:
+                group, device_info = cloud_locks[did]
+                try:
+                    new_entities.extend(await build_device_entities(
+                        self.hass, self._entry, self._session, group, device_info, master_uid
+                    ))
+                except Exception as e:
+                    _LOGGER.error("添加门锁 %s 失败: %s", did, e)
+            self.register_entities(new_entities)
+
+            for did in removed:
+                await self._remove_lock(did)
+
+            if added or removed:
+                _LOGGER.info("门锁拓扑已同步: 新增 %s 个, 移除 %s 个", len(added), len(removed))
+
+    def is_pending(self, did):
+        return did in self._domain_data.get("pending_hydration", {})
+
+    async def async_hydrate(self, did):
+        """完整加载按需加载的门锁, 返回是否进行了加载
+
+        等待各平台添加完新实体后再返回, 调用方随后写入的状态和触发的事件不会丢失.
+        """
+        async with self._lock:
+            pending = self._domain_data.get("pending_hydration", {})
+            if did not in pending:
+                return False
+            group, device_info = pending[did]
+            master_uid = self._domain_data.get("master_uid", "unknown")
+            entities = await build_lock_entities(
+                self.hass, self._entry, self._session, group, device_info, master_uid
+            )
+            pending.pop(did, None)
+            # 设备外壳中已存在的实体保持不变
+            existing = {entity.unique_id for entity in self._domain_data.get("devices", {}).get(did, [])}
+            new_entities = [entity for entity in entities if entity.unique_id not in existing]
+            self.register_entities(new_entities)
+        await self._async_wait_added(new_entities)
+        _LOGGER.info("门锁 %s 已按需加载", did)
+        return True
+
+    def _is_added(self, entity):
+        """实体已写入状态, 或在注册表中被禁用而不会添加"""
+        if entity.entity_id and self.hass.states.get(entity.entity_id) is not None:
+            return True
+        registry_entry = entity.registry_entry
+        return registry_entry is not None and registry_entry.disabled
+
+    async def _async_wait_added(self, entities):
+        """平台在后台任务中添加实体, 这里轮询直到全部添加完成或超时"""
+        try:
+            async with asyncio.timeout(HYDRATE_ADD_TIMEOUT):
+                while not all(self._is_added(entity) for entity in entities):
+                    await asyncio.sleep(0.05)
+        except TimeoutError:
+            _LOGGER.warning("等待门锁实体添加超时, 部分状态可能稍后才会更新")
+
+    async def _remove_lock(self, did):
+        self._domain_data.get("pending_hydration", {}).pop(did, None)
+        await self._remove_entities(list(self._domain_data.get("devices", {}).get(did, [])))
+        self._domain_data.get("devices", {}).pop(did, None)
+        self._domain_data.get("user_aliases", {}).pop(did, None)
+        device_registry = dr.async_get(self.hass)
+        device = device_registry.async_get_device(identifiers={(DOMAIN, did)})
+        if device is not None:
+            device_registry.async_update_device(device.id, remove_config_entry_id=self._entry.entry_id)
+
+    def _diff_users(self, did, users):
+        """返回 (实体列表, 需移除的实体, 需新增的用户), 无变化时返回 None"""
+        entities = self._domain_data.get("devices", {}).get(did)
+        if not entities:
+            return None
+        existing = {
+            (entity._user_type, entity._user_number): entity
+            for entity in entities if isinstance(entity, KiwiLockUser)
+        }
+        cloud_users = {(user.get("type", "unknown"), user.get("number", "unknown")): user for user in users}
+        if existing.keys() == cloud_users.keys():
+            return None
+        removed = [entity for key, entity in existing.items() if key not in cloud_users]
+        added = [user for key, user in cloud_users.items() if key not in existing]
+        return entities, removed, added
+
+    async def async_sync_users(self, did, users):
+        """按 (类型, 编号) 对比门锁用户列表, 只增删变化的用户实体
+
+        由 WebSocket 读取循环直接等待, 用户未变化时不获取锁, 避免被正在进行的全量同步阻塞;
+        有变化时在锁内重新对比一次, 以锁内的结果为准.
+        """
+        if users is None or self._diff_users(did, users) is None:
+            return
+        async with self._lock:
+            diff = self._diff_users(did, users)
+            if diff is None:
+                return
+            entities, removed, added = diff
+            if removed:
+                await self._remove_entities(removed)
+            if added:
+                lock_device = next(
+                    (getattr(e, "_device", None) for e in entities if getattr(e, "_device", None) is not None),
+                    None
+                )
+                if lock_device is None:
+                    return
+                self.register_entities(build_user_entities(self.hass, self._entry, lock_device, added))
+            _LOGGER.info("门锁 %s 用户已同步: 新增 %s 个, 移除 %s 个", did, len(added), len(removed))
@@ -0,0 +1,168 @@
+"""Device triggers for kiwiot_ws locks."""
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+import voluptuous as vol
+
+from homeassistant.components.device_automation import DEVICE_TRIGGER_BASE_SCHEMA
+from homeassistant.components.device_automation.exceptions import InvalidDeviceAutomationConfig
+from homeassistant.const import CONF_DEVICE_ID, CONF_DOMAIN, CONF_PLATFORM, CONF_TYPE
+from homeassistant.core import CALLBACK_TYPE, HassJob, HomeAssistant, callback
+from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers.trigger import TriggerActionType, TriggerInfo
+from homeassistant.helpers.typing import ConfigType
+
+from .const import DOMAIN, LOGGER_NAME
+from .conn.utils import EVENT_TYPES, EVENT_UNLOCKED_BY_USER, LOCK_USER_TYPES
+
+_LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
+
+CONF_METHOD = "method"
+CONF_USER_ID = "user_id"
+
+TRIGGER_INDEX_KEY = f"{DOMAIN}_trigger_index"
+
+TRIGGER_SCHEMA = DEVICE_TRIGGER_BASE_SCHEMA.extend(
+    {
+        vol.Required(CONF_TYPE): vol.In(EVENT_TYPES),
+        vol.Optional(CONF_METHOD): vol.In(sorted(LOCK_USER_TYPES)),
+        vol.Optional(CONF_USER_ID): vol.Coerce(int),
+    }
+)
+
+
+class TriggerIndex:
+    """按 (门锁, 事件类型, 用户) 预编译的触发器索引, 每个事件只需几次字典查找"""
+
+    def __init__(self) -> None:
+        self._index: dict[tuple, list] = {}
+
+    @staticmethod
+    def make_key(did: str, event_type: str, method: str | None = None, user_id: int | None = None) -> tuple:
+        if method is None and user_id is None:
+            return (did, event_type, None)
+        return (did, event_type, (method, user_id))
+
+    @callback
+    def async_add(self, key: tuple, handler) -> CALLBACK_TYPE:
+        handlers = self._index.setdefault(key, [])
+        handlers.append(handler)
+
+        @callback
+        def _remove() -> None:
+            handlers.remove(handler)
+            if not handlers:
+                self._index.pop(key, None)
+
+        return _remove
+
+    @callback
+    def async_dispatch(self, did: str, event: dict[str, Any]) -> None:
+        """将规范化事件分发给匹配的触发器"""
+        if not self._index:
+            return
+        event_type = event["event_type"]
+        method = event.get("method")
+        user_id = event.get("user_id")
+        keys = {
+            (did, event_type, None),
+            (did, event_type, (method, None)),
+            (did, event_type, (None, user_id)),
+            (did, event_type, (method, user_id)),
+        }
+        for key in keys:
+            for handler in list(self._index.get(key, ())):
+                handler(event)
+
+
+def get_trigger_index(hass: HomeAssistant) -> TriggerIndex:
+    """触发器索引独立于配置项生命周期, 集成重载时已挂载的自动化不受影响"""
+    if TRIGGER_INDEX_KEY not in hass.data:
+        hass.data[TRIGGER_INDEX_KEY] = TriggerIndex()
+    return hass.data[TRIGGER_INDEX_KEY]
+
+
+@callback
+def async_fire_device_triggers(hass: HomeAssistant, did: str, event: dict[str, Any]) -> None:
+    index = hass.data.get(TRIGGER_INDEX_KEY)
+    if index:
+        index.async_dispatch(did, event)
+
+
+def _get_lock_did(hass: HomeAssistant, device_id: str) -> str | None:
+    device = dr.async_get(hass).async_get(device_id)
+    # 集成自身的服务设备(诊断指标)不是门锁
+    if device is None or device.entry_type == dr.DeviceEntryType.SERVICE:
+        return None
+    for domain, identifier in device.identifiers:
+        if domain == DOMAIN:
+            return identifier
+    return None
+
+
+async def async_validate_trigger_config(hass: HomeAssistant, config: ConfigType) -> ConfigType:
+    config = TRIGGER_SCHEMA(config)
+    if _get_lock_did(hass, config[CONF_DEVICE_ID]) is None:
+        raise InvalidDeviceAutomationConfig(f"未找到 KiwiOT 门锁设备: {config[CONF_DEVICE_ID]}")
+    return config
+
+
+async def async_get_triggers(hass: HomeAssistant, device_id: str) -> list[dict[str, Any]]:
+    if _get_lock_did(hass, device_id) is None:
+        return []
+    return [
+        {
+            CONF_PLATFORM: "device",
+            CONF_DOMAIN: DOMAIN,
+            CONF_DEVICE_ID: device_id,
+            CONF_TYPE: event_type,
+        }
+        for event_type in EVENT_TYPES
+    ]
+
+
+async def async_get_trigger_capabilities(hass: HomeAssistant, config: ConfigType) -> dict[str, vol.Schema]:
+    if config[CONF_TYPE] != EVENT_UNLOCKED_BY_USER:
+        return {}
+    return {
+        "extra_fields": vol.Schema(
+            {
+                vol.Optional(CONF_METHOD): vol.In(sorted(LOCK_USER_TYPES)),
+                vol.Optional(CONF_USER_ID): vol.Coerce(int),
+            }
+        )
+    }
+
+
+async def async_attach_trigger(
+    hass: HomeAssistant,
+    config: ConfigType,
+    action: TriggerActionType,
+    trigger_info: TriggerInfo,
+) -> CALLBACK_TYPE:
+    did = _get_lock_did(hass, config[CONF_DEVICE_ID])
+    event_type = config[CONF_TYPE]
+    key = TriggerIndex.make_key(did, event_type, config.get(CONF_METHOD), config.get(CONF_USER_ID))
+    job = HassJob(action, f"{DOMAIN} device trigger {event_type}")
+    trigger_data = trigger_info["trigger_data"]
+
+    @callback
+    def _handle_event(event: dict[str, Any]) -> None:
+        hass.async_run_hass_job(
+            job,
+            {
+                "trigger": {
+                    **trigger_data,
+                    CONF_PLATFORM: "device",
+                    CONF_DOMAIN: DOMAIN,
+                    CONF_DEVICE_ID: config[CONF_DEVICE_ID],
+                    CONF_TYPE: event_type,
+                    "event": event,
+                    "description": f"{DOMAIN} {event_type}",
+                }
+            },
+        )
+
+    return get_trigger_index(hass).async_add(key, _handle_event)
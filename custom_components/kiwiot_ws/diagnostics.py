@@ -0,0 +1,128 @@
+"""Diagnostics support for kiwiot_ws."""
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import device_registry as dr
+
+from .const import DOMAIN, CONF_CREDENTIAL, CONF_IDENTIFIER, CONF_CLIENT_ID, CONF_ACCESS_TOKEN
+from .conn.metrics import get_metrics
+from .conn.tracing import get_traces
+from .conn.utils import SENSITIVE_KEYS
+from .conn.websocket import is_websocket_open
+from .entity.lock import KiwiLockEvent
+
+TO_REDACT = {
+    CONF_CREDENTIAL,
+    CONF_IDENTIFIER,
+    CONF_CLIENT_ID,
+    CONF_ACCESS_TOKEN,
+    "uri",
+    "image_uri",
+    "user_alias",
+    *SENSITIVE_KEYS,
+}
+
+
+def _task_running(task) -> bool:
+    return task is not None and not task.done()
+
+
+def _connection_diagnostics(hass: HomeAssistant, domain_data) -> dict[str, Any]:
+    """WebSocket 连接、轮询回退和消息队列状态"""
+    last_rx = domain_data.get("ws_last_rx")
+    poller = domain_data.get("poller")
+    msg_queue = domain_data.get("msg_queue")
+    return {
+        "websocket_open": is_websocket_open(hass),
+        "ws_task_running": _task_running(domain_data.get("ws_task")),
+        "discovery_running": _task_running(domain_data.get("discovery_task")),
+        "last_message_ago": round(time.monotonic() - last_rx, 1) if last_rx else None,
+        "polling": {
+            "active": poller.active,
+            "interval": poller.interval,
+            "polls": poller.polls,
+            "events": poller.events,
+        } if poller else None,
+        "msg_queue_depth": msg_queue.qsize() if msg_queue else None,
+        "in_flight_responses": sum(
+            1 for future in domain_data.get("response_futures", {}).values() if not future.done()
+        ),
+    }
+
+
+def _cache_diagnostics(domain_data, metrics) -> dict[str, Any]:
+    validator_cache = domain_data.get("validator_cache")
+    storage = domain_data.get("storage")
+    media_resolver = domain_data.get("media_resolver")
+    return {
+        "validator": validator_cache.stats() if validator_cache else None,
+        "storage": storage.stats() if storage else None,
+        "media": media_resolver.stats() if media_resolver else None,
+        "image": {
+            "hits": metrics.image_hits,
+            "misses": metrics.image_misses,
+            "hit_ratio": metrics.image_hit_ratio,
+            "bytes": metrics.image_cache_bytes,
+        },
+        "user_aliases": len(domain_data.get("user_aliases", {})),
+    }
+
+
+def _device_diagnostics(domain_data, did, entities) -> dict[str, Any]:
+    """单个门锁的诊断数据, 包含未写入数据库的完整事件内容和最近的规范化事件"""
+    diagnostics = {
+        "entities": [entity.entity_id for entity in entities if entity.entity_id],
+        "pending_hydration": did in domain_data.get("pending_hydration", {}),
+        "recent_events": async_redact_data(list(domain_data.get("recent_events", {}).get(did, ())), TO_REDACT),
+    }
+    for entity in entities:
+        if isinstance(entity, KiwiLockEvent):
+            diagnostics["last_event"] = async_redact_data(entity._event, TO_REDACT)
+            break
+    return diagnostics
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """返回配置项诊断信息"""
+    domain_data = hass.data.get(DOMAIN, {})
+    devices = domain_data.get("devices", {})
+    token_manager = domain_data.get("token_manager")
+    metrics = get_metrics(hass)
+    return {
+        "entry": async_redact_data(dict(entry.data), TO_REDACT),
+        "options": async_redact_data(dict(entry.options), TO_REDACT),
+        "connection": _connection_diagnostics(hass, domain_data),
+        "token": token_manager.status() if token_manager else None,
+        "caches": _cache_diagnostics(domain_data, metrics),
+        "metrics": metrics.as_dict(),
+        "traces": get_traces(hass).as_list(),
+        "devices": {
+            device_id: _device_diagnostics(domain_data, device_id, entities)
+            for device_id, entities in devices.items()
+        },
+    }
+
+
+async def async_get_device_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry, device: dr.DeviceEntry
+) -> dict[str, Any]:
+    """返回单个门锁的诊断信息, 集成服务设备返回连接状态和运行指标"""
+    domain_data = hass.data.get(DOMAIN, {})
+    if device.entry_type == dr.DeviceEntryType.SERVICE:
+        return {
+            "connection": _connection_diagnostics(hass, domain_data),
+            "metrics": get_metrics(hass).as_dict(),
+        }
+
+    did = next((identifier for domain, identifier in device.identifiers if domain == DOMAIN), None)
+    return {
+        "device": _device_diagnostics(domain_data, did, domain_data.get("devices", {}).get(did, [])),
+        "traces": get_traces(hass).as_list(did),
+    }
@@ -1,25 +1,43 @@
-﻿import logging
+﻿import asyncio
+import logging
 from pathlib import Path
 
 from homeassistant.helpers.entity import Entity, DeviceInfo
-from ..const import DOMAIN, LOGGER_NAME
+from ..const import DOMAIN, LOGGER_NAME, DEFAULT_IMAGE_ROTATION
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from ..conn.utils import ImageCache
-from PIL import ImageFile
-from homeassistant.components.camera import Camera
+from ..conn.utils import ImageCache, EVENT_TYPES, build_user_aliases, redact_url, redact_error
+from ..conn.media import get_media_uri, is_video_media
+from ..conn.tracing import trace_span
+from homeassistant.components.camera import Camera, CameraEntityFeature
 from homeassistant.const import STATE_UNKNOWN
 from homeassistant.const import EntityCategory
 from ..conn.userinfo import update_lock_user_alias
 from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.components.text import TextEntity
+from homeassistant.components.sensor import SensorEntity, SensorDeviceClass
+from homeassistant.components.event import EventEntity
 from homeassistant.config_entries import ConfigEntry
 from ..conn.token_manager import TokenManager
 
 
 _LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
 
-ImageFile.LOAD_TRUNCATED_IMAGES = True
+def parse_event_time(event):
+    """解析事件的 UTC 时间并转换为本地时间, 失败时返回 None"""
+    try:
+        event_time_utc = datetime.fromisoformat(event["created_at"].replace('Z', '+00:00'))
+        return event_time_utc.astimezone(ZoneInfo("Asia/Shanghai"))
+    except Exception as e:
+        _LOGGER.error("处理事件时间失败: %s", e)
+        return None
+
+
+def format_event_time(event):
+    """将事件的 UTC 时间转换为本地时间字符串, 返回 (完整时间, 时分秒)"""
+    event_time_local = parse_event_time(event) or datetime.now(ZoneInfo("Asia/Shanghai"))
+    return event_time_local.strftime("%Y-%m-%d %H:%M:%S"), event_time_local.strftime("%H:%M:%S")
+
 
 class KiwiLockDevice:
     """表示一个智能锁设备"""
@@ -31,10 +49,7 @@ class KiwiLockDevice:
         self.group_id = group_id
         self.group_name = group_name
         self.unique_id = f"{DOMAIN}_{self.device_id}"
-
-    def get_device_info(self):
-        """返回设备信息"""
-        return DeviceInfo(
+        self._device_info = DeviceInfo(
             identifiers={(DOMAIN, self.device_id)},
             name=f"{self.group_name} - {self.name}",
             manufacturer="KiwiOT",
@@ -42,6 +57,10 @@ class KiwiLockDevice:
             sw_version=self.device_info.get("version", "unknown")
         )
 
+    def get_device_info(self):
+        """返回设备信息"""
+        return self._device_info
+
 class KiwiLockInfo(Entity):
     """获取组名"""
     def __init__(self, hass, device, group):
@@ -54,23 +73,15 @@ class KiwiLockInfo(Entity):
         self._attr_entity_category = None
         self._attr_translation_key = "lock_info"
         self._attr_should_poll = False
-
-    @property
-    def device_info(self):
-        """返回设备信息"""
-        return self._device.get_device_info()
-    
-    @property
-    def icon(self):
-        return "mdi:home"
-
-    @property
-    def state(self):
-        return self._group.get("name", "unknown")
+        self._attr_device_info = device.get_device_info()
+        self._attr_icon = "mdi:home"
+        self._attr_state = group.get("name", "unknown")
 
 
 class KiwiLockStatus(Entity):
     """状态"""
+    # 时间和带签名的图片地址每次事件都不同, 不写入数据库
+    _unrecorded_attributes = frozenset({"更新时间", "图像地址"})
     USER_TYPE_MAP = {
         "FACE": "人脸",
         "PASSWORD": "密码",
@@ -87,52 +98,34 @@ class KiwiLockStatus(Entity):
     def __init__(self, hass, device, event, history_events):
         self.hass = hass
         self._device = device
-        self._event = event
         self._attr_has_entity_name = True
         self._attr_unique_id = f"{DOMAIN}_{device.device_id}_status"
         self._attr_name = "门锁状态"
-        self._event_time = None
         self._event_history = history_events or []
         self._attr_entity_category = None 
         self._attr_entity_registry_enabled_default = True
         self._attr_entity_registry_visible_default = True
         self._attr_translation_key = "lock_status"
         self._attr_should_poll = False
+        self._attr_device_info = device.get_device_info()
+        self.apply_event(event)
 
-        try:
-            event_time_utc = datetime.fromisoformat(event["created_at"].replace('Z', '+00:00'))
-            event_time_local = event_time_utc.astimezone(ZoneInfo("Asia/Shanghai"))
-            self._event_time = event_time_local.strftime("%Y-%m-%d %H:%M:%S")
-            self._notify_time = event_time_local.strftime("%H:%M:%S")
-        except Exception as e:
-            _LOGGER.error(f"处理事件时间失败: {e}")
-            self._event_time = str(datetime.now())
-        
-
-    @property
-    def device_info(self):
-        """返回设备信息"""
-        return self._device.get_device_info()
+    def apply_event(self, event):
+        """应用新事件, 一次性计算状态、图标和属性, 属性读取时直接返回缓存"""
+        self._event = event or {}
+        self._event_time, self._notify_time = format_event_time(self._event)
+        name = self._event.get("name", "unknown")
+        state_name = self.STATE_MAP.get(name, name)
 
-    @property
-    def icon(self):
-        if self._event.get("name") == "UNLOCKED" or self._event.get("name") == "LOCK_INDOOR_BUTTON_UNLOCK":
-            return "mdi:door-open"
-        elif self._event.get("name") == "LOCKED":
-            return "mdi:door-closed-lock"
+        if name in ("UNLOCKED", "LOCK_INDOOR_BUTTON_UNLOCK"):
+            self._attr_icon = "mdi:door-open"
+        elif name == "LOCKED":
+            self._attr_icon = "mdi:door-closed-lock"
         else:
-            return "mdi:alert-circle"
+            self._attr_icon = "mdi:alert-circle"
 
-    @property
-    def state(self):
-        _LOGGER.info(f"事件数据: {self._event}")
-        name = self._event.get("name", "unknown")
-        return self._notify_time + " " + self.STATE_MAP.get(name, name)
+        self._attr_state = state_name
 
-    @property
-    def extra_state_attributes(self):
-        """返回额外的状态属性"""
-        name = self._event.get("name", "unknown")
         raw_data = self._event.get("data", {}) or {}
         lock_user = raw_data.get("lock_user", {}) or {}
         raw_id = lock_user.get("id", 0000)
@@ -141,9 +134,9 @@ class KiwiLockStatus(Entity):
             user_id = int(float(raw_id)) if isinstance(raw_id, str) else int(raw_id)
         except (ValueError, TypeError):
             user_id = 0000  
-        if self._event.get("name") == "LOCK_INDOOR_BUTTON_UNLOCK":
-            attributes = {
-                "状态": self.STATE_MAP.get(name, name),
+        if name == "LOCK_INDOOR_BUTTON_UNLOCK":
+            self._attr_extra_state_attributes = {
+                "状态": state_name,
                 "更新时间": self._event_time,
                 "设备ID": self._device.device_id,
                 "用户ID": "unknown",
@@ -151,21 +144,21 @@ class KiwiLockStatus(Entity):
                 "图像地址": "unknown",
                 "类型": self._event.get("level", "unknown"),
             }
-            return attributes
         else:
-            return {
-                "状态": self.STATE_MAP.get(name, name),
+            self._attr_extra_state_attributes = {
+                "状态": state_name,
                 "更新时间": self._event_time,
                 "设备ID": self._device.device_id,
                 "用户ID": user_id,
-                "开关锁方式": self.USER_TYPE_MAP.get(self._event.get("data", {}).get("lock_user", {}).get("type", "unknown"), "unknown"),
-                "图像地址": self._event.get("data", {}).get("image", {}).get("uri", "unknown"),                
+                "开关锁方式": self.USER_TYPE_MAP.get(lock_user.get("type", "unknown"), "unknown"),
+                "图像地址": (raw_data.get("image", {}) or {}).get("uri", "unknown"),
                 "类型": self._event.get("level", "unknown"),
-
             }
 
 class KiwiLockEvent(Entity):
     """事件"""
+    # 完整事件数据只保留在当前状态中, 历史可在诊断信息中查看
+    _unrecorded_attributes = frozenset({"更新时间", "数据"})
     USER_TYPE_MAP = {
         "FACE": "人脸",
         "PASSWORD": "密码",
@@ -183,78 +176,61 @@ class KiwiLockEvent(Entity):
     def __init__(self, hass, device, event, history_events, users):
         self.hass = hass
         self._device = device
-        self._event = event
         self._attr_has_entity_name = True
         self._attr_unique_id = f"{DOMAIN}_{device.device_id}_event"
         self._attr_name = "门锁事件"
-        self._event_time = None
         self._event_history = history_events or []
-        self._users = users
         self._attr_entity_category = None  
         self._attr_entity_registry_enabled_default = True
         self._attr_entity_registry_visible_default = True
         self._attr_translation_key = "lock_event"
         self._attr_should_poll = False
+        self._attr_device_info = device.get_device_info()
+        self._set_users(users)
+        self.apply_event(event)
 
-        try:
-            event_time_utc = datetime.fromisoformat(event["created_at"].replace('Z', '+00:00'))
-            event_time_local = event_time_utc.astimezone(ZoneInfo("Asia/Shanghai"))
-            self._event_time = event_time_local.strftime("%Y-%m-%d %H:%M:%S")
-            self._notify_time = event_time_local.strftime("%H:%M:%S")
-        except Exception as e:
-            _LOGGER.error(f"处理事件时间失败: {e}")
-            self._event_time = str(datetime.now())
-        
+    def _set_users(self, users):
+        """建立 (类型, 编号) -> 别名 的索引, 避免每次渲染都遍历用户列表"""
+        self._users = users
+        self._user_aliases = build_user_aliases(users)
 
-    @property
-    def device_info(self):
-        """返回设备信息"""
-        return self._device.get_device_info()
+    def apply_event(self, event, users=None):
+        """应用新事件, 一次性计算状态、图标和属性, 属性读取时直接返回缓存"""
+        if users is not None:
+            self._set_users(users)
+        self._event = event or {}
+        self._event_time, self._notify_time = format_event_time(self._event)
 
-    @property
-    def icon(self):
-        if self._event.get("name") == "UNLOCKED":
-            return "mdi:door-open"
-        elif self._event.get("name") == "LOCKED":
-            return "mdi:door-closed-lock"
-        else:
-            return "mdi:alert-circle"
-
-    @property
-    def state(self):
         name = self._event.get("name", "unknown")
-        data = self._event.get("data", "unknown")
-        lock_user = data.get("lock_user", {})
+        data = self._event.get("data") or {}
+        lock_user = data.get("lock_user", {}) or {}
         event_type = lock_user.get("type", "unknown")
         user_id = lock_user.get("id", "unknown")
 
         alias = user_id
-        if self._users and isinstance(self._users, list):
-            try:
-                user_id_int = int(user_id) if user_id != "unknown" else -1
-                matching_user = next(
-                    (user for user in self._users 
-                     if user.get("type") == event_type 
-                     and user.get("number") == user_id_int),
-                    None
-                )
-                if matching_user and matching_user.get("alias"):
-                    alias = matching_user["alias"]
-            except (ValueError, TypeError) as e:
-                _LOGGER.warning(f"处理用户ID时出错: {e}")
+        try:
+            user_id_int = int(user_id) if user_id != "unknown" else -1
+            alias = self._user_aliases.get((event_type, user_id_int)) or user_id
+        except (ValueError, TypeError) as e:
+            _LOGGER.warning("处理用户ID时出错: %s", e)
+
+        if name == "UNLOCKED":
+            self._attr_icon = "mdi:door-open"
+        elif name == "LOCKED":
+            self._attr_icon = "mdi:door-closed-lock"
+        else:
+            self._attr_icon = "mdi:alert-circle"
+
+        # 状态只保留事件类型, 事件时间由 KiwiLockEventTime 提供
         if name == "UNLOCKED" :
             the_type = self.USER_TYPE_MAP.get(event_type, event_type)
-            return f"{self._notify_time} {alias}{the_type}解锁"
+            self._attr_state = f"{alias}{the_type}解锁"
         elif name == "REMOTE_UNLOCK" and self._event.get("level", "unknown") == "CRITICAL":
-            return f"{self._notify_time} 门铃"
+            self._attr_state = "门铃"
         else:    
-            return self._notify_time + " " + self.STATE_MAP.get(name, name)
-
-    @property
-    def extra_state_attributes(self):
-        """返回额外的状态属性"""
+            self._attr_state = self.STATE_MAP.get(name, name)
 
-        attributes = { 
+        self._attr_extra_state_attributes = { 
             "更新时间": self._event_time,
             "设备ID": self._device.device_id,
             "类型": self._event.get("level", "unknown"),
@@ -264,11 +240,57 @@ class KiwiLockEvent(Entity):
         # if self._event_history:
         #     attributes["history"] = self._event_history
 
-        return attributes
+
+class KiwiLockEventTime(SensorEntity):
+    """最近一次事件时间"""
+    def __init__(self, hass, device, event):
+        self.hass = hass
+        self._device = device
+        self._attr_has_entity_name = True
+        self._attr_unique_id = f"{DOMAIN}_{device.device_id}_event_time"
+        self._attr_name = "最近事件时间"
+        self._attr_device_class = SensorDeviceClass.TIMESTAMP
+        self._attr_translation_key = "event_time"
+        self._attr_icon = "mdi:clock-outline"
+        self._attr_should_poll = False
+        self._attr_device_info = device.get_device_info()
+        self._attr_native_value = None
+        self.apply_event(event)
+
+    def apply_event(self, event):
+        """应用新事件时间"""
+        if event:
+            self._attr_native_value = parse_event_time(event) or self._attr_native_value
+
+
+class KiwiLockEventNotify(EventEntity):
+    """门铃、徘徊、开关锁通知事件, 触发时附带结构化字段"""
+    def __init__(self, hass, device):
+        self.hass = hass
+        self._device = device
+        self._attr_has_entity_name = True
+        self._attr_unique_id = f"{DOMAIN}_{device.device_id}_notify"
+        self._attr_name = "门锁通知"
+        self._attr_translation_key = "lock_notify"
+        self._attr_icon = "mdi:bell-ring"
+        self._attr_should_poll = False
+        self._attr_event_types = EVENT_TYPES
+        self._attr_device_info = device.get_device_info()
+
+    def apply_event(self, normalized):
+        """按规范化后的事件触发对应类型的事件"""
+        event_type = normalized["event_type"]
+        self._trigger_event(event_type, {k: v for k, v in normalized.items() if k != "event_type"})
 
 
 class KiwiLockUser(TextEntity, RestoreEntity):
     """锁用户实体"""
+    USER_ICONS = {
+        "FACE": "mdi:face-recognition",
+        "PASSWORD": "mdi:key",
+        "FINGERPRINT": "mdi:fingerprint",
+    }
+
     def __init__(self, hass, entry, lock_device, user_info, device_id, unique_id):
         self.hass = hass
         self._entry = entry
@@ -284,6 +306,14 @@ class KiwiLockUser(TextEntity, RestoreEntity):
         self._attr_native_value = user_info.get("alias", "")
         self._attr_mode = "text"
         self._attr_native_max = 16
+        self._attr_icon = self.USER_ICONS.get(self._user_type, "mdi:account")
+        self._attr_device_info = lock_device.get_device_info()
+        self._attr_extra_state_attributes = {
+            "类型": self._user_type,
+            "用户id": self._user_number,
+            "created_at": user_info.get("created_at"), 
+            "updated_at": user_info.get("updated_at")
+        }
         
     @property
     def name(self):
@@ -295,37 +325,9 @@ class KiwiLockUser(TextEntity, RestoreEntity):
         """唯一标识符"""  
         return self._unique_id
 
-    @property
-    def icon(self):
-        if self._user_type == "FACE":
-            return "mdi:face-recognition"
-        elif self._user_type == "PASSWORD":
-            return "mdi:key"
-        elif self._user_type == "FINGERPRINT":
-            return "mdi:fingerprint"
-        else:
-            return "mdi:account"
-        
-    @property
-    def device_info(self):
-        """设备信息"""
-        return {
-            "identifiers": {(DOMAIN, self._device_id)},
-        }
-
     @property
     def state(self):
         return self._user_info.get("alias", "unknown")
-    
-    @property
-    def extra_state_attributes(self):
-        """额外属性"""
-        return {
-            "类型": self._user_type,
-            "用户id": self._user_number,
-            "created_at": self._user_info.get("created_at"), 
-            "updated_at": self._user_info.get("updated_at")
-        }
 
     async def async_set_value(self, value: str) -> None:
         """处理值的更新"""
@@ -364,6 +366,7 @@ class KiwiLockUser(TextEntity, RestoreEntity):
             self._attr_native_value = last_state.state
 
 class KiwiLockCamera(Camera):
+    _unrecorded_attributes = frozenset({"created_at", "事件时间", "图片更新时间"})
     USER_TYPE_MAP = {
         "FACE": "人脸",
         "PASSWORD": "密码",
@@ -378,99 +381,190 @@ class KiwiLockCamera(Camera):
         "LOCK_ADD_USER": "添加用户"
     }
 
-    def __init__(self, hass, device, event_data, video_info):
+    def __init__(self, hass, device, event_data, rotation_mode=DEFAULT_IMAGE_ROTATION):
         super().__init__()
         self.hass = hass
         self._device = device
-        self._event_data = event_data
-        self._video_info = video_info
         self._attr_has_entity_name = True
         self._attr_unique_id = f"{DOMAIN}_{device.device_id}_camera"
         self._attr_name = "最近一次图像事件"
         self._attr_is_streaming = False
-        self._state = STATE_UNKNOWN
+        self._attr_device_info = device.get_device_info()
+        self._apply_event(event_data)
         
         cache_dir = Path(hass.config.path("custom_components", DOMAIN, "cache"))
-        self._image_cache = ImageCache(hass, cache_dir)
+        self._image_cache = ImageCache(hass, cache_dir, rotation_mode)
+        # 当前对外提供的图片来源 (stream_id, 图片URL), 仅在新图片就绪后才切换
+        self._image_source = self._resolve_image_source()
+        # 当前来源解析出的媒体是否为视频, 只有视频才声明支持流
+        self._source_is_video = False
+        self._prefetch_task = None
+
+    def _resolve_image_source(self):
+        """从事件数据中解析流ID和图片URL"""
+        data = (self._event_data or {}).get("data") or {}
+        stream_id = data.get("stream_id")
+        url = (data.get("image") or {}).get("uri")
+        return stream_id, url
+
+    @property
+    def _media_resolver(self):
+        return self.hass.data.get(DOMAIN, {}).get("media_resolver")
+
+    async def _resolve_is_video(self, stream_id):
+        resolver = self._media_resolver
+        if not stream_id or not resolver:
+            return False
+        return is_video_media(await resolver.get_stream(self._device.device_id, stream_id))
+
+    async def _refresh_stream_support(self):
+        """启动时解析初始事件的媒体类型, 更新支持的功能"""
+        try:
+            is_video = await self._resolve_is_video(self._image_source[0])
+        except Exception as e:
+            _LOGGER.debug("解析媒体类型失败: %s", e)
+            return
+        if is_video != self._source_is_video:
+            self._source_is_video = is_video
+            self.async_write_ha_state()
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        if self._image_source[0]:
+            self._prefetch_task = self.hass.async_create_background_task(
+                self._refresh_stream_support(),
+                f"{DOMAIN}_{self._device.device_id}_stream_support"
+            )
+
+    async def _load_image(self, stream_id, url):
+        """按来源获取图片: 视频片段取封面, 流信息为图片时使用其地址, 否则使用事件图片"""
+        resolver = self._media_resolver
+        if stream_id and resolver:
+            stream_info = await resolver.get_stream(self._device.device_id, stream_id)
+            if is_video_media(stream_info):
+                poster = await resolver.get_poster(self._device.device_id, stream_id)
+                if poster:
+                    return poster
+            elif get_media_uri(stream_info):
+                url = get_media_uri(stream_info)
+
+        if not url:
+            return None
+        return await self._image_cache.get_image(url)
 
     async def async_camera_image(self, width=320, height=480):
         """获取摄像头图片."""
         _LOGGER.debug("开始获取相机图片")
-        url = None
-        if self._video_info and "media" in self._video_info and "uri" in self._video_info["media"]:
-            url = self._video_info["media"]["uri"]
-            _LOGGER.debug(f"使用视频信息URL: {url}")
-        elif (self._event_data and 
-              "data" in self._event_data and 
-              "image" in self._event_data["data"] and 
-              "uri" in self._event_data["data"]["image"]):
-            url = self._event_data["data"]["image"]["uri"]
-            _LOGGER.debug(f"使用事件数据URL: {url}")
-            
-        if not url:
+        stream_id, url = self._image_source
+        if not stream_id and not url:
             _LOGGER.warning("没有找到有效的图片URL")
             return None
 
-        image_data = await self._image_cache.get_image(url)
-        _LOGGER.info(f"图片获取{'成功' if image_data else '失败'}")
+        image_data = await self._load_image(stream_id, url)
+        _LOGGER.debug("图片获取%s", '成功' if image_data else '失败')
         return image_data
 
-    async def update_from_event(self, event_data):
-        """从新事件更新相机数据."""
+    async def stream_source(self):
+        """返回当前事件的视频片段地址"""
+        stream_id, _ = self._image_source
+        resolver = self._media_resolver
+        if not stream_id or not resolver:
+            return None
+        stream_info = await resolver.get_stream(self._device.device_id, stream_id)
+        return get_media_uri(stream_info) if is_video_media(stream_info) else None
+
+    @property
+    def supported_features(self):
+        if self._source_is_video:
+            return CameraEntityFeature.STREAM
+        return CameraEntityFeature(0)
+
+    async def _prefetch_image(self, source, event_data, trace=None):
+        """后台预下载新事件图片, 完成后再切换对外提供的图片并归档"""
         try:
-            _LOGGER.info(f"更新相机事件数据: {event_data.get('name')}")
-            self._event_data = event_data
-            
-            await self._image_cache.clear_cache()
-            
-            url = None
-            if (self._event_data and 
-                "data" in self._event_data and 
-                "image" in self._event_data["data"] and 
-                "uri" in self._event_data["data"]["image"]):
-                url = self._event_data["data"]["image"]["uri"]
-                
-            if url:
-                _LOGGER.debug(f"开始预下载图片: {url}")
-                await self._image_cache.get_image(url)
+            _LOGGER.debug("开始预下载图片: %s", source[0] or redact_url(source[1] or ""))
+            with trace_span(trace, "image_download"):
+                image_data = await self._load_image(*source)
+            if image_data:
+                # 流信息已由 _load_image 缓存, 这里不会再发请求
+                self._source_is_video = await self._resolve_is_video(source[0])
+                self._image_source = source
+                # 再写一次状态, 前端和自动化据此获取新图片, 而不是事件发布时仍在使用的旧图片
+                self._attr_extra_state_attributes = {
+                    **self._attr_extra_state_attributes,
+                    "图片更新时间": datetime.now(ZoneInfo("Asia/Shanghai")).isoformat(),
+                }
+                self.async_write_ha_state()
                 _LOGGER.debug("图片预下载完成")
-                
+                archive = self.hass.data.get(DOMAIN, {}).get("snapshots")
+                if archive:
+                    await archive.async_add(
+                        self._device.device_id,
+                        event_data.get("created_at"),
+                        event_data.get("name"),
+                        image_data
+                    )
+        except asyncio.CancelledError:
+            _LOGGER.debug("图片预下载已被新事件取消: %s", source[0] or redact_url(source[1] or ""))
+            raise
+        except Exception as e:
+            _LOGGER.error("预下载图片失败: %s", redact_error(e))
+
+    def _cancel_prefetch(self):
+        if self._prefetch_task and not self._prefetch_task.done():
+            self._prefetch_task.cancel()
+        self._prefetch_task = None
+
+    async def update_from_event(self, event_data, trace=None):
+        """从新事件更新相机数据, 状态立即发布, 图片在后台下载."""
+        try:
+            _LOGGER.debug("更新相机事件数据: %s", event_data.get('name'))
+            self._apply_event(event_data)
             self.async_write_ha_state()
+
+            self._cancel_prefetch()
+            source = self._resolve_image_source()
+            if any(source) and source != self._image_source:
+                self._prefetch_task = self.hass.async_create_background_task(
+                    self._prefetch_image(source, event_data, trace),
+                    f"{DOMAIN}_{self._device.device_id}_image_prefetch"
+                )
             return True
             
         except Exception as e:
-            _LOGGER.error(f"更新相机事件数据失败: {e}")
+            _LOGGER.error("更新相机事件数据失败: %s", e)
             return False
 
-    @property
-    def device_info(self):
-        return self._device.get_device_info()
+    async def async_will_remove_from_hass(self):
+        """实体移除时取消未完成的预下载"""
+        self._cancel_prefetch()
+        await super().async_will_remove_from_hass()
 
-    @property
-    def state(self):
-        if not self._event_data:
-            return STATE_UNKNOWN
-        name = self._event_data.get("name", "")
-        if name == "REMOTE_UNLOCK" and self._event_data.get("level", "unknown") == "CRITICAL":
-            return "门铃"
-        else:
-            return self.STATE_MAP.get(name, name)
+    def _apply_event(self, event_data):
+        """应用新事件, 一次性计算状态和属性"""
+        self._event_data = event_data
+        if not event_data:
+            self._state = STATE_UNKNOWN
+            self._attr_extra_state_attributes = {}
+            return
 
-    @property
-    def extra_state_attributes(self):
-        if not self._event_data:
-            return {}
+        name = event_data.get("name", "")
+        if name == "REMOTE_UNLOCK" and event_data.get("level", "unknown") == "CRITICAL":
+            self._state = "门铃"
+        else:
+            self._state = self.STATE_MAP.get(name, name)
 
-        data = self._event_data.get("data", {})
-        lock_user = data.get("lock_user", {})
-        
+        data = event_data.get("data", {}) or {}
+        lock_user = data.get("lock_user", {}) or {}
         user_type = lock_user.get("type", "")
-        displayed_type = self.USER_TYPE_MAP.get(user_type, user_type)
-        
-        return  {
-            "level": self._event_data.get("level"),
-            "created_at": self._event_data.get("created_at"),
+        self._attr_extra_state_attributes = {
+            "level": event_data.get("level"),
+            "created_at": event_data.get("created_at"),
             "用户ID": lock_user.get("id"),
-            "开锁类型": displayed_type,
-            "事件时间": self._event_data.get("created_at")
-        }
\ No newline at end of file
+            "开锁类型": self.USER_TYPE_MAP.get(user_type, user_type),
+            "事件时间": event_data.get("created_at")
+        }
+
+    @property
+    def state(self):
+        return self._state
@@ -1,15 +1,19 @@
 import logging
-import os
-import json
-import aiofiles
 from homeassistant.components.text import TextEntity
 from homeassistant.components.button import ButtonEntity
 from ..const import DOMAIN, LOGGER_NAME
 from ..conn.userinfo import create_mfa_token
+from ..conn.storage import get_storage
 import asyncio
+import time
 from datetime import datetime
-from ..conn.websocket import send_unlock_command
-from pathlib import Path
+from ..conn.websocket import send_unlock_command, is_ctrl_response_ok, wait_websocket_alive, release_response_future
+from ..conn.utils import redact, normalize_lock_event, EVENT_LOCKED, EVENT_UNLOCKED, EVENT_UNLOCKED_BY_USER
+from homeassistant.components.lock import LockEntity
+from homeassistant.const import ATTR_CODE
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
 
 _LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
 
@@ -63,38 +67,27 @@ class KiwiLockUnlockDataInput(TextEntity):
         self._attr_entity_category = None
         self._attr_translation_key = "password_input"
         self._attr_should_poll = False
-        config_dir = Path(hass.config.path("kiwiot_config"))
-        config_dir.mkdir(exist_ok=True)
-        self._config_file = config_dir / f"unlock_data_{device_id}.json"
         self._attr_native_value = ""
 
     async def async_added_to_hass(self) -> None:
         """当实体被添加到 HA 时调用"""
-        await self._load_stored_value()
+        self._load_stored_value()
         
-    async def _load_stored_value(self) -> None:
-        """加载存储的值"""
-        try:
-            if self._config_file.exists():
-                async with aiofiles.open(self._config_file, 'r') as f:
-                    content = await f.read()
-                    config = json.loads(content)
-                    self._attr_native_value = config.get('unlock_data', '')
-                    _LOGGER.debug(f"已加载存储的解锁数据: {self._config_file}")
-                    self.async_write_ha_state()
-        except Exception as e:
-            _LOGGER.error(f"加载解锁数据失败: {e}")
-
-    async def _save_value(self, value: str) -> None:
-        """保存值到配置文件"""
-        try:
-            config = {'unlock_data': value}
-            async with aiofiles.open(self._config_file, 'w') as f:
-                await f.write(json.dumps(config, indent=2))
-            _LOGGER.debug(f"已保存解锁数据到: {self._config_file}")
-        except Exception as e:
-            _LOGGER.error(f"保存解锁数据失败: {e}")
-            raise
+    def _load_stored_value(self) -> None:
+        """从已加载到内存的存储中读取"""
+        storage = get_storage(self.hass)
+        stored = storage.get_unlock_data(self._device_id) if storage else None
+        if stored:
+            self._attr_native_value = stored
+            _LOGGER.debug("已加载存储的解锁数据: %s", self._device_id)
+            self.async_write_ha_state()
+
+    def _save_value(self, value: str) -> None:
+        """保存值, 由存储层合并延迟写入"""
+        storage = get_storage(self.hass)
+        if storage is None:
+            raise ValueError("无法获取存储")
+        storage.set_unlock_data(self._device_id, value)
 
     async def async_set_value(self, value: str) -> None:
         """设置并保存密码值"""
@@ -102,7 +95,7 @@ class KiwiLockUnlockDataInput(TextEntity):
             raise ValueError("解锁数据不能为空")   
         self._attr_native_value = value
         self.async_write_ha_state()
-        await self._save_value(value)
+        self._save_value(value)
 
     @property
     def icon(self):
@@ -134,12 +127,18 @@ class KiwiLockPasswordConfirm(ButtonEntity):
         self._cooldown_period = 60  
         self._update_timer = None
     
-    async def _schedule_update(self):
-        """安排一个状态更新"""
-        await asyncio.sleep(self._cooldown_period)
+    @callback
+    def _cooldown_finished(self, _now):
+        """冷却结束后恢复按钮可用状态"""
+        self._update_timer = None
         self._last_press_time = None
         self.async_write_ha_state()
 
+    async def async_will_remove_from_hass(self) -> None:
+        if self._update_timer:
+            self._update_timer()
+            self._update_timer = None
+
     @property
     def icon(self):
         return "mdi:lock-open-check"
@@ -185,7 +184,8 @@ class KiwiLockPasswordConfirm(ButtonEntity):
             password,
             session
         )
-        _LOGGER.info(f"验证结果: {response}")
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("验证结果: %s", redact(response))
         
         if response.get("success"):
             self._last_press_time = datetime.now()  
@@ -194,12 +194,148 @@ class KiwiLockPasswordConfirm(ButtonEntity):
             self.async_write_ha_state()  
             #开锁ws
             send_token = response.get("data", {}).get("access_token", '')
-            #_LOGGER.info(f"发送开锁ws: {send_token},unlock_data: {unlock_data},device_id: {self._device_id}")
-            await send_unlock_command(self.hass, send_token, unlock_data, self._device_id)
-            # 创建自动更新任务
+            #_LOGGER.info("发送开锁ws: %s,unlock_data: %s,device_id: %s", send_token, unlock_data, self._device_id)
+            await send_unlock_command(self.hass, send_token, unlock_data, self._device_id, bypass_queue=True)
+            # 冷却结束后自动更新, 实体移除时取消
             if self._update_timer:
-                self._update_timer.cancel()
-            self._update_timer = asyncio.create_task(self._schedule_update())
+                self._update_timer()
+            self._update_timer = async_call_later(self.hass, self._cooldown_period, self._cooldown_finished)
             return
 
-        raise ValueError("验证失败")
\ No newline at end of file
+        raise ValueError("验证失败")
+
+async def _timed(phases, name, awaitable):
+    """执行并记录耗时(秒)到 phases"""
+    started = time.monotonic()
+    try:
+        return await awaitable
+    finally:
+        phases[name] = round(time.monotonic() - started, 3)
+
+
+class KiwiLock(LockEntity):
+    """远程开锁实体: 乐观显示开锁中, 由 CtrlResponse 或开锁事件确认, 超时回退"""
+    # 每次开锁的耗时和确认方式都不同, 不写入数据库
+    _unrecorded_attributes = frozenset({"开锁耗时", "确认方式", "阶段耗时"})
+
+    def __init__(self, hass, entry, lock_device, uid, password_entity, unlock_data_entity, latest_event):
+        self.hass = hass
+        self._entry = entry
+        self._device = lock_device
+        self._device_id = lock_device.device_id
+        self._uid = uid
+        self._password_entity = password_entity
+        self._unlock_data_entity = unlock_data_entity
+        self._attr_has_entity_name = True
+        self._attr_unique_id = f"{DOMAIN}_{self._device_id}_lock"
+        self._attr_name = "门锁"
+        self._attr_translation_key = "lock"
+        self._attr_should_poll = False
+        self._attr_device_info = lock_device.get_device_info()
+        self._attr_extra_state_attributes = {}
+        self._confirm_timeout = 15
+        self._unlocked_event = asyncio.Event()
+        self._attr_is_locked = None
+        normalized = normalize_lock_event(latest_event, {})
+        if normalized:
+            self.apply_event(normalized)
+
+    def apply_event(self, normalized):
+        """根据规范化事件更新锁状态, 开锁事件同时用于确认远程开锁"""
+        event_type = normalized["event_type"]
+        if event_type in (EVENT_UNLOCKED, EVENT_UNLOCKED_BY_USER):
+            self._attr_is_locked = False
+            self._unlocked_event.set()
+        elif event_type == EVENT_LOCKED:
+            self._attr_is_locked = True
+        else:
+            return False
+        return True
+
+    async def _wait_for_confirmation(self, response_future):
+        """等待 CtrlResponse 或开锁事件, 先到者为准"""
+        event_wait = asyncio.ensure_future(self._unlocked_event.wait())
+        try:
+            done, _ = await asyncio.wait(
+                [response_future, event_wait],
+                timeout=self._confirm_timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            event_wait.cancel()
+            if not response_future.done():
+                response_future.cancel()
+            release_response_future(self.hass, response_future)
+
+        if event_wait in done:
+            return "event"
+        if response_future in done and not response_future.cancelled():
+            if is_ctrl_response_ok(response_future.result()):
+                return "ctrl_response"
+            raise HomeAssistantError(f"门锁拒绝开锁指令: {response_future.result().get('payload')}")
+        return None
+
+    async def async_unlock(self, **kwargs) -> None:
+        """执行 MFA 验证并发送开锁指令"""
+        password = kwargs.get(ATTR_CODE) or self._password_entity._attr_native_value
+        if not password:
+            raise HomeAssistantError("请先输入远程开锁密码")
+        unlock_data = self._unlock_data_entity._attr_native_value
+        if not unlock_data:
+            raise HomeAssistantError("请先输入远程开锁数据")
+        session = self.hass.data.get(DOMAIN, {}).get("session")
+        if not session:
+            raise HomeAssistantError("无法获取必要组件")
+
+        started = time.monotonic()
+        phases = {}
+        was_locked = self._attr_is_locked
+        self._unlocked_event.clear()
+        self._attr_is_unlocking = True
+        self.async_write_ha_state()
+
+        try:
+            # MFA 请求与 WebSocket 连接检查并行执行
+            response, ws_alive = await asyncio.gather(
+                _timed(phases, "mfa", create_mfa_token(self.hass, self._entry, self._uid, password, session)),
+                _timed(phases, "ws_check", wait_websocket_alive(self.hass)),
+            )
+            if not response or not response.get("success"):
+                raise HomeAssistantError("开锁验证失败")
+            if not ws_alive:
+                raise HomeAssistantError("WebSocket 未连接, 无法发送开锁指令")
+
+            if not kwargs.get(ATTR_CODE):
+                self._password_entity._attr_native_value = ""
+                self._password_entity.async_write_ha_state()
+
+            send_token = response.get("data", {}).get("access_token", '')
+            response_future = self.hass.loop.create_future()
+            sent = await _timed(phases, "send", send_unlock_command(
+                self.hass, send_token, unlock_data, self._device_id, response_future, bypass_queue=True
+            ))
+            if not sent:
+                release_response_future(self.hass, response_future)
+                raise HomeAssistantError("开锁指令发送失败")
+
+            confirmed_by = await _timed(phases, "confirm", self._wait_for_confirmation(response_future))
+            if confirmed_by is None:
+                raise HomeAssistantError(f"{self._confirm_timeout} 秒内未收到开锁确认")
+
+            self._attr_is_locked = False
+            self._attr_extra_state_attributes = {
+                "开锁耗时": round(time.monotonic() - started, 3),
+                "确认方式": confirmed_by,
+                "阶段耗时": phases,
+            }
+            _LOGGER.info("远程开锁已确认(%s), 耗时 %.3f 秒, 各阶段: %s", confirmed_by, time.monotonic() - started, phases)
+        except Exception:
+            self._attr_is_locked = was_locked
+            self._attr_extra_state_attributes = {"阶段耗时": phases}
+            raise
+        finally:
+            self._attr_is_unlocking = False
+            self.async_write_ha_state()
+
+    async def async_lock(self, **kwargs) -> None:
+        raise HomeAssistantError("门锁不支持远程关锁")
@@ -0,0 +1,160 @@
+"""Diagnostic sensors publishing the integration's runtime metrics."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import PERCENTAGE, EntityCategory, UnitOfInformation, UnitOfTime
+from homeassistant.helpers.device_registry import DeviceEntryType
+from homeassistant.helpers.entity import DeviceInfo
+
+from ..const import DOMAIN
+from ..conn.metrics import IntegrationMetrics, get_metrics, percentile, to_ms
+
+
+@dataclass(frozen=True, kw_only=True)
+class KiwiMetricDescription(SensorEntityDescription):
+    value_fn: Callable[[IntegrationMetrics], Any]
+    attrs_fn: Callable[[IntegrationMetrics], dict] | None = None
+
+
+METRIC_SENSORS: tuple[KiwiMetricDescription, ...] = (
+    KiwiMetricDescription(
+        key="ws_connected",
+        name="WebSocket 连接",
+        icon="mdi:lan-connect",
+        device_class=SensorDeviceClass.ENUM,
+        options=["connected", "disconnected"],
+        value_fn=lambda m: "connected" if m.ws_connected_at is not None else "disconnected",
+    ),
+    KiwiMetricDescription(
+        key="ws_uptime",
+        name="WebSocket 连接时长",
+        icon="mdi:timer-outline",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.SECONDS,
+        value_fn=lambda m: round(m.ws_uptime) if m.ws_uptime is not None else None,
+    ),
+    KiwiMetricDescription(
+        key="ws_reconnects",
+        name="WebSocket 重连次数",
+        icon="mdi:lan-pending",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda m: m.ws_reconnects,
+    ),
+    KiwiMetricDescription(
+        key="ping_rtt",
+        name="心跳往返时间",
+        icon="mdi:timer-sync-outline",
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda m: to_ms(m.ping_rtt),
+    ),
+    KiwiMetricDescription(
+        key="message_rate",
+        name="消息速率",
+        icon="mdi:message-processing-outline",
+        native_unit_of_measurement="msg/min",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda m: m.message_rate(),
+        attrs_fn=lambda m: {"total": m.messages},
+    ),
+    KiwiMetricDescription(
+        key="event_latency",
+        name="事件处理延迟",
+        icon="mdi:timer-play-outline",
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda m: to_ms(percentile(m.event_latencies, 50)),
+        attrs_fn=lambda m: {
+            "p90": to_ms(percentile(m.event_latencies, 90)),
+            "p99": to_ms(percentile(m.event_latencies, 99)),
+            "samples": len(m.event_latencies),
+        },
+    ),
+    KiwiMetricDescription(
+        key="rest_requests",
+        name="接口请求数",
+        icon="mdi:api",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda m: m.rest_requests,
+        attrs_fn=lambda m: {name: stats.as_dict() for name, stats in m.endpoints.items()},
+    ),
+    KiwiMetricDescription(
+        key="rest_error_rate",
+        name="接口错误率",
+        icon="mdi:api-off",
+        native_unit_of_measurement=PERCENTAGE,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda m: m.rest_error_rate,
+    ),
+    KiwiMetricDescription(
+        key="rest_latency",
+        name="接口延迟",
+        icon="mdi:timer-outline",
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda m: m.rest_latency(50),
+        attrs_fn=lambda m: {"p95": m.rest_latency(95), "p99": m.rest_latency(99)},
+    ),
+    KiwiMetricDescription(
+        key="token_refreshes",
+        name="Token 刷新次数",
+        icon="mdi:key-change",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda m: m.token_refreshes,
+    ),
+    KiwiMetricDescription(
+        key="image_cache_hit_ratio",
+        name="图片缓存命中率",
+        icon="mdi:image-check-outline",
+        native_unit_of_measurement=PERCENTAGE,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda m: m.image_hit_ratio,
+        attrs_fn=lambda m: {"hits": m.image_hits, "misses": m.image_misses},
+    ),
+    KiwiMetricDescription(
+        key="image_cache_bytes",
+        name="图片缓存大小",
+        icon="mdi:harddisk",
+        device_class=SensorDeviceClass.DATA_SIZE,
+        native_unit_of_measurement=UnitOfInformation.BYTES,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda m: m.image_cache_bytes,
+    ),
+)
+
+
+class KiwiMetricSensor(SensorEntity):
+    """集成运行指标, 默认禁用, 启用后按平台扫描间隔读取内存中的计数"""
+
+    entity_description: KiwiMetricDescription
+
+    def __init__(self, hass, entry: ConfigEntry, description: KiwiMetricDescription):
+        self.hass = hass
+        self.entity_description = description
+        self._attr_has_entity_name = True
+        self._attr_unique_id = f"{DOMAIN}_{entry.entry_id}_metric_{description.key}"
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._attr_entity_registry_enabled_default = False
+        self._attr_should_poll = True
+        self._attr_device_info = DeviceInfo(
+            identifiers={(DOMAIN, entry.entry_id)},
+            name="KiwiOT 集成",
+            manufacturer="KiwiOT",
+            entry_type=DeviceEntryType.SERVICE,
+        )
+
+    async def async_update(self) -> None:
+        metrics = get_metrics(self.hass)
+        description = self.entity_description
+        self._attr_native_value = description.value_fn(metrics)
+        if description.attrs_fn:
+            self._attr_extra_state_attributes = description.attrs_fn(metrics)
@@ -0,0 +1,30 @@
+"""Lock platform for kiwiot_ws integration."""
+from __future__ import annotations
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .const import DOMAIN, SIGNAL_NEW_ENTITIES
+from .entity.lock_ctrl import KiwiLock
+
+async def async_setup_entry(
+    hass: HomeAssistant,
+    entry: ConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+) -> None:
+    @callback
+    def _add_entities(entities):
+        lock_entities = [
+            entity for entity in entities 
+            if isinstance(entity, KiwiLock)
+        ]
+        if lock_entities:
+            async_add_entities(lock_entities, True)
+
+    _add_entities(hass.data[DOMAIN][entry.entry_id].get("entities", []))
+    # 拓扑同步新增的门锁和用户实体
+    entry.async_on_unload(
+        async_dispatcher_connect(hass, SIGNAL_NEW_ENTITIES.format(entry.entry_id), _add_entities)
+    )
@@ -0,0 +1,170 @@
+"""Media source for kiwiot_ws event snapshots."""
+from __future__ import annotations
+
+from aiohttp import web
+from homeassistant.components.http import KEY_HASS, HomeAssistantView
+from homeassistant.components.media_player import MediaClass, MediaType
+from homeassistant.components.media_source import (
+    BrowseMediaSource,
+    MediaSource,
+    MediaSourceItem,
+    PlayMedia,
+)
+from homeassistant.components.media_source.error import Unresolvable
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+
+SNAPSHOT_URL = f"/api/{DOMAIN}/snapshots/{{device_id}}/{{snapshot_id}}"
+
+EVENT_TITLES = {
+    "REMOTE_UNLOCK": "门铃",
+    "HUMAN_WANDERING": "有人徘徊",
+    "UNLOCKED": "开锁",
+    "LOCKED": "关锁",
+}
+
+
+async def async_get_media_source(hass: HomeAssistant) -> MediaSource:
+    return KiwiOTMediaSource(hass)
+
+
+def _get_archive(hass):
+    return hass.data.get(DOMAIN, {}).get("snapshots")
+
+
+def _device_title(hass, device_id):
+    for entity in hass.data.get(DOMAIN, {}).get("devices", {}).get(device_id, []):
+        device = getattr(entity, "_device", None)
+        if device is not None:
+            return f"{device.group_name} - {device.name}"
+    return device_id
+
+
+def _snapshot_url(device_id, snapshot_id, thumbnail=False):
+    url = SNAPSHOT_URL.format(device_id=device_id, snapshot_id=snapshot_id)
+    return f"{url}?thumb=1" if thumbnail else url
+
+
+class KiwiOTMediaSource(MediaSource):
+    """按门锁和日期浏览事件快照"""
+
+    name = "KiwiOT 事件快照"
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        super().__init__(DOMAIN)
+        self.hass = hass
+
+    async def async_resolve_media(self, item: MediaSourceItem) -> PlayMedia:
+        archive = _get_archive(self.hass)
+        parts = (item.identifier or "").split("/")
+        if not archive or len(parts) != 3:
+            raise Unresolvable(f"无效的快照标识: {item.identifier}")
+        device_id, _, snapshot_id = parts
+        if archive.get_path(device_id, snapshot_id) is None:
+            raise Unresolvable(f"快照不存在: {item.identifier}")
+        return PlayMedia(_snapshot_url(device_id, snapshot_id), "image/jpeg")
+
+    async def async_browse_media(self, item: MediaSourceItem) -> BrowseMediaSource:
+        archive = _get_archive(self.hass)
+        if not archive:
+            raise Unresolvable("KiwiOT 集成未加载")
+
+        parts = item.identifier.split("/") if item.identifier else []
+        if not parts:
+            return self._browse_root(archive)
+        if len(parts) == 1:
+            return self._browse_device(archive, parts[0])
+        if len(parts) == 2:
+            return self._browse_day(archive, parts[0], parts[1])
+        raise Unresolvable(f"无效的快照标识: {item.identifier}")
+
+    def _browse_root(self, archive):
+        return BrowseMediaSource(
+            domain=DOMAIN,
+            identifier=None,
+            media_class=MediaClass.DIRECTORY,
+            media_content_type=MediaType.IMAGE,
+            title=self.name,
+            can_play=False,
+            can_expand=True,
+            children_media_class=MediaClass.DIRECTORY,
+            children=[
+                BrowseMediaSource(
+                    domain=DOMAIN,
+                    identifier=device_id,
+                    media_class=MediaClass.DIRECTORY,
+                    media_content_type=MediaType.IMAGE,
+                    title=_device_title(self.hass, device_id),
+                    can_play=False,
+                    can_expand=True,
+                )
+                for device_id in archive.devices()
+            ],
+        )
+
+    def _browse_device(self, archive, device_id):
+        return BrowseMediaSource(
+            domain=DOMAIN,
+            identifier=device_id,
+            media_class=MediaClass.DIRECTORY,
+            media_content_type=MediaType.IMAGE,
+            title=_device_title(self.hass, device_id),
+            can_play=False,
+            can_expand=True,
+            children_media_class=MediaClass.DIRECTORY,
+            children=[
+                BrowseMediaSource(
+                    domain=DOMAIN,
+                    identifier=f"{device_id}/{day}",
+                    media_class=MediaClass.DIRECTORY,
+                    media_content_type=MediaType.IMAGE,
+                    title=f"{day[:4]}-{day[4:6]}-{day[6:]}",
+                    can_play=False,
+                    can_expand=True,
+                )
+                for day in archive.days(device_id)
+            ],
+        )
+
+    def _browse_day(self, archive, device_id, day):
+        return BrowseMediaSource(
+            domain=DOMAIN,
+            identifier=f"{device_id}/{day}",
+            media_class=MediaClass.DIRECTORY,
+            media_content_type=MediaType.IMAGE,
+            title=f"{_device_title(self.hass, device_id)} {day[:4]}-{day[4:6]}-{day[6:]}",
+            can_play=False,
+            can_expand=True,
+            children_media_class=MediaClass.IMAGE,
+            children=[
+                BrowseMediaSource(
+                    domain=DOMAIN,
+                    identifier=f"{device_id}/{day}/{record.snapshot_id}",
+                    media_class=MediaClass.IMAGE,
+                    media_content_type="image/jpeg",
+                    title=f"{record.time.strftime('%H:%M:%S')} {EVENT_TITLES.get(record.event_name, record.event_name)}",
+                    can_play=True,
+                    can_expand=False,
+                    thumbnail=_snapshot_url(device_id, record.snapshot_id, thumbnail=True),
+                )
+                for record in archive.snapshots(device_id, day)
+            ],
+        )
+
+
+class KiwiOTSnapshotView(HomeAssistantView):
+    """提供快照原图和缩略图"""
+
+    url = SNAPSHOT_URL
+    name = f"api:{DOMAIN}:snapshots"
+    requires_auth = True
+
+    async def get(self, request: web.Request, device_id: str, snapshot_id: str) -> web.StreamResponse:
+        archive = _get_archive(request.app[KEY_HASS])
+        if not archive:
+            raise web.HTTPNotFound()
+        path = archive.get_path(device_id, snapshot_id, thumbnail=request.query.get("thumb") == "1")
+        if path is None:
+            raise web.HTTPNotFound()
+        return web.FileResponse(path, headers={"Cache-Control": "private, max-age=86400"})
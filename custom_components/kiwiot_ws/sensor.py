@@ -1,21 +1,36 @@
 from __future__ import annotations
 
+from datetime import timedelta
+
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
-from .const import DOMAIN
-from .entity.lock import KiwiLockInfo, KiwiLockEvent, KiwiLockStatus
+from .const import DOMAIN, SIGNAL_NEW_ENTITIES, METRICS_PUBLISH_INTERVAL
+from .entity.lock import KiwiLockInfo, KiwiLockEvent, KiwiLockStatus, KiwiLockEventTime
+from .entity.metrics import KiwiMetricSensor, METRIC_SENSORS
+
+# 只有启用的诊断指标传感器会轮询, 门锁实体由事件推送更新
+SCAN_INTERVAL = timedelta(seconds=METRICS_PUBLISH_INTERVAL)
+
 async def async_setup_entry(
     hass: HomeAssistant,
     entry: ConfigEntry,
     async_add_entities: AddEntitiesCallback,
 ) -> None:
-    entities = hass.data[DOMAIN][entry.entry_id].get("entities", [])
-    sensor_entities = [
-        entity for entity in entities 
-        if isinstance(entity, (KiwiLockInfo, KiwiLockEvent, KiwiLockStatus))
-    ]
-    
-    if sensor_entities:
-        async_add_entities(sensor_entities, True)
\ No newline at end of file
+    @callback
+    def _add_entities(entities):
+        sensor_entities = [
+            entity for entity in entities 
+            if isinstance(entity, (KiwiLockInfo, KiwiLockEvent, KiwiLockStatus, KiwiLockEventTime))
+        ]
+        if sensor_entities:
+            async_add_entities(sensor_entities, True)
+
+    _add_entities(hass.data[DOMAIN][entry.entry_id].get("entities", []))
+    async_add_entities([KiwiMetricSensor(hass, entry, description) for description in METRIC_SENSORS])
+    # 拓扑同步新增的门锁和用户实体
+    entry.async_on_unload(
+        async_dispatcher_connect(hass, SIGNAL_NEW_ENTITIES.format(entry.entry_id), _add_entities)
+    )
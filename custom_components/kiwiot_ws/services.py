@@ -0,0 +1,181 @@
+"""Services for kiwiot_ws integration."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+import voluptuous as vol
+
+from homeassistant.const import ATTR_DEVICE_ID
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
+from homeassistant.exceptions import ServiceValidationError
+from homeassistant.helpers import config_validation as cv, device_registry as dr
+
+from .const import DOMAIN, LOGGER_NAME
+from .conn.userinfo import get_llock_info
+from .conn.utils import get_latest_event
+from .conn.websocket import update_device_state
+from .entity.lock import KiwiLockUser
+from .entity.lock_ctrl import KiwiLock
+
+_LOGGER = logging.getLogger(f"{LOGGER_NAME}_{__name__}")
+
+SERVICE_UNLOCK = "unlock"
+SERVICE_SET_USER_ALIAS = "set_user_alias"
+SERVICE_REFRESH = "refresh"
+
+ATTR_CODE = "code"
+ATTR_USER_TYPE = "user_type"
+ATTR_USER_NUMBER = "user_number"
+ATTR_ALIAS = "alias"
+ATTR_MAX_PARALLEL = "max_parallel"
+
+DEFAULT_MAX_PARALLEL = 4
+
+BASE_SCHEMA = {
+    vol.Optional(ATTR_MAX_PARALLEL, default=DEFAULT_MAX_PARALLEL): vol.All(vol.Coerce(int), vol.Range(min=1, max=16)),
+}
+
+UNLOCK_SCHEMA = vol.Schema({
+    vol.Required(ATTR_DEVICE_ID): vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional(ATTR_CODE): cv.string,
+    **BASE_SCHEMA,
+})
+
+SET_USER_ALIAS_SCHEMA = vol.Schema({
+    vol.Required(ATTR_DEVICE_ID): vol.All(cv.ensure_list, [cv.string]),
+    vol.Required(ATTR_USER_TYPE): vol.In(["FINGERPRINT", "PASSWORD", "CARD", "FACE"]),
+    vol.Required(ATTR_USER_NUMBER): vol.Coerce(int),
+    vol.Required(ATTR_ALIAS): vol.All(cv.string, vol.Length(min=1, max=16)),
+    **BASE_SCHEMA,
+})
+
+REFRESH_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_DEVICE_ID): vol.All(cv.ensure_list, [cv.string]),
+    **BASE_SCHEMA,
+})
+
+
+def _resolve_lock_ids(hass: HomeAssistant, device_ids) -> dict[str, str]:
+    """将 HA 设备ID转换为门锁 did, 同时接受直接传入的 did"""
+    registry = dr.async_get(hass)
+    known = hass.data.get(DOMAIN, {}).get("devices", {})
+    resolved = {}
+    for device_id in device_ids:
+        if device_id in known:
+            resolved[device_id] = device_id
+            continue
+        device = registry.async_get(device_id)
+        did = None
+        if device and device.entry_type != dr.DeviceEntryType.SERVICE:
+            did = next((i[1] for i in device.identifiers if i[0] == DOMAIN), None)
+        if did is None:
+            raise ServiceValidationError(f"未找到 KiwiOT 门锁: {device_id}")
+        resolved[device_id] = did
+    return resolved
+
+
+async def _async_hydrate(hass: HomeAssistant, did: str) -> bool:
+    """按需加载的门锁在首次被服务访问时完整加载, 返回是否进行了加载"""
+    reconciler = hass.data.get(DOMAIN, {}).get("topology")
+    return bool(reconciler and await reconciler.async_hydrate(did))
+
+
+def _get_domain_data(hass: HomeAssistant) -> dict:
+    """服务在集成加载前后都已注册, 未加载配置项时拒绝调用"""
+    domain_data = hass.data.get(DOMAIN)
+    if not domain_data or "entry" not in domain_data:
+        raise ServiceValidationError("KiwiOT 集成尚未加载")
+    return domain_data
+
+
+def _find_entity(hass: HomeAssistant, did: str, entity_type):
+    for entity in hass.data.get(DOMAIN, {}).get("devices", {}).get(did, []):
+        if isinstance(entity, entity_type):
+            return entity
+    return None
+
+
+async def _run_for_targets(targets: dict[str, str], max_parallel: int, handler) -> dict:
+    """对每个门锁并发执行 handler, 并发数受限, 返回每个目标的结果和耗时"""
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def _run(target, did):
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                result = await handler(did) or {}
+                result.setdefault("success", True)
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+            result["elapsed"] = round(time.monotonic() - started, 3)
+            return target, result
+
+    results = await asyncio.gather(*(_run(target, did) for target, did in targets.items()))
+    return {"results": dict(results)}
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """注册集成服务, 在 async_setup 中调用一次, 重载配置项时保持不变"""
+
+    async def _unlock(call: ServiceCall) -> ServiceResponse:
+        _get_domain_data(hass)
+        targets = _resolve_lock_ids(hass, call.data[ATTR_DEVICE_ID])
+
+        async def _handler(did):
+            await _async_hydrate(hass, did)
+            lock = _find_entity(hass, did, KiwiLock)
+            if lock is None:
+                raise ServiceValidationError(f"门锁 {did} 没有可用的锁实体")
+            kwargs = {ATTR_CODE: call.data[ATTR_CODE]} if call.data.get(ATTR_CODE) else {}
+            await lock.async_unlock(**kwargs)
+            return dict(lock.extra_state_attributes or {})
+
+        return await _run_for_targets(targets, call.data[ATTR_MAX_PARALLEL], _handler)
+
+    async def _set_user_alias(call: ServiceCall) -> ServiceResponse:
+        _get_domain_data(hass)
+        targets = _resolve_lock_ids(hass, call.data[ATTR_DEVICE_ID])
+        user_type = call.data[ATTR_USER_TYPE]
+        user_number = call.data[ATTR_USER_NUMBER]
+
+        async def _handler(did):
+            await _async_hydrate(hass, did)
+            for entity in hass.data.get(DOMAIN, {}).get("devices", {}).get(did, []):
+                if isinstance(entity, KiwiLockUser) and \
+                        entity._user_type == user_type and entity._user_number == user_number:
+                    await entity.async_set_value(call.data[ATTR_ALIAS])
+                    return {}
+            raise ServiceValidationError(f"门锁 {did} 没有用户 {user_type} {user_number}")
+
+        return await _run_for_targets(targets, call.data[ATTR_MAX_PARALLEL], _handler)
+
+    async def _refresh(call: ServiceCall) -> ServiceResponse:
+        domain_data = _get_domain_data(hass)
+        if call.data.get(ATTR_DEVICE_ID):
+            targets = _resolve_lock_ids(hass, call.data[ATTR_DEVICE_ID])
+        else:
+            targets = {did: did for did in domain_data.get("devices", {})}
+
+        async def _handler(did):
+            if await _async_hydrate(hass, did):
+                return {"hydrated": True}
+            events = await get_llock_info(hass, domain_data["entry"], did, domain_data["session"])
+            latest_event = await get_latest_event(events)
+            if not latest_event:
+                raise ValueError("获取最新事件失败")
+            await update_device_state(hass, domain_data["entry"], did, latest_event, notify=False)
+            return {"event": latest_event.get("name"), "created_at": latest_event.get("created_at")}
+
+        return await _run_for_targets(targets, call.data[ATTR_MAX_PARALLEL], _handler)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_UNLOCK, _unlock, schema=UNLOCK_SCHEMA, supports_response=SupportsResponse.OPTIONAL
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_SET_USER_ALIAS, _set_user_alias, schema=SET_USER_ALIAS_SCHEMA, supports_response=SupportsResponse.OPTIONAL
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_REFRESH, _refresh, schema=REFRESH_SCHEMA, supports_response=SupportsResponse.OPTIONAL
+    )
@@ -2,10 +2,11 @@
 from __future__ import annotations
 
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
-from .const import DOMAIN
+from .const import DOMAIN, SIGNAL_NEW_ENTITIES
 from .entity.lock import KiwiLockUser
 from .entity.lock_ctrl import KiwiLockPasswordInput, KiwiLockUnlockDataInput
 
@@ -14,11 +15,17 @@ async def async_setup_entry(
     entry: ConfigEntry,
     async_add_entities: AddEntitiesCallback,
 ) -> None:
-    entities = hass.data[DOMAIN][entry.entry_id].get("entities", [])
-    text_entities = [
-        entity for entity in entities 
-        if isinstance(entity, (KiwiLockUser, KiwiLockPasswordInput, KiwiLockUnlockDataInput))
-    ]
-    
-    if text_entities:
-        async_add_entities(text_entities, True)
\ No newline at end of file
+    @callback
+    def _add_entities(entities):
+        text_entities = [
+            entity for entity in entities 
+            if isinstance(entity, (KiwiLockUser, KiwiLockPasswordInput, KiwiLockUnlockDataInput))
+        ]
+        if text_entities:
+            async_add_entities(text_entities, True)
+
+    _add_entities(hass.data[DOMAIN][entry.entry_id].get("entities", []))
+    # 拓扑同步新增的门锁和用户实体
+    entry.async_on_unload(
+        async_dispatcher_connect(hass, SIGNAL_NEW_ENTITIES.format(entry.entry_id), _add_entities)
+    )
@@ -0,0 +1 @@
+"""Tests for the kiwiot_ws integration."""
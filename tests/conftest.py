@@ -0,0 +1,173 @@
+"""Fixtures for kiwiot_ws tests: cloud API responses are stubbed, Home Assistant runs for real."""
+import asyncio
+import io
+from unittest.mock import patch
+
+import pytest
+from aiohttp import web
+from homeassistant import block_async_io
+from homeassistant.helpers.frame import MissingIntegrationFrame, get_integration_frame
+from homeassistant.util import loop as loop_util
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.kiwiot_ws.config_flow import KiwiOTConfigFlow
+from custom_components.kiwiot_ws.const import (
+    DOMAIN,
+    CONF_IDENTIFIER,
+    CONF_CREDENTIAL,
+    CONF_CLIENT_ID,
+)
+
+LOCK_DID = "lock-1"
+GROUPS = [{"gid": "group-1", "name": "家"}]
+DEVICES = [{"did": LOCK_DID, "name": "前门", "type": "LOCK", "version": "1.0"}]
+USERS = [
+    {"type": "FINGERPRINT", "number": 1, "alias": "张三"},
+    {"type": "PASSWORD", "number": 2, "alias": "李四"},
+]
+EVENTS = [
+    {
+        "device_id": LOCK_DID,
+        "name": "LOCKED",
+        "level": "INFO",
+        "created_at": "2026-01-01T08:00:00Z",
+        "data": {},
+    }
+]
+
+
+@pytest.fixture(autouse=True)
+def auto_enable_custom_integrations(enable_custom_integrations):
+    """加载 custom_components 下的集成"""
+    yield
+
+
+@pytest.fixture(autouse=True)
+def blocking_calls(disable_block_async_io):
+    """在事件循环中检测本集成发起的阻塞调用, 测试结束时要求没有任何记录
+
+    测试环境默认跳过文件读写等检测项, 这里全部启用, 并按调用来源只收集本集成的调用.
+    """
+    detected = []
+
+    def _record(func, check_allowed=None, strict=True, strict_core=True, **mapped_args):
+        if check_allowed is not None and check_allowed(mapped_args):
+            return
+        try:
+            frame = get_integration_frame()
+        except MissingIntegrationFrame:
+            return
+        if frame.integration == DOMAIN:
+            detected.append(f"{func.__name__} at {frame.relative_filename}:{frame.line_number}: {frame.line}")
+
+    with (
+        patch.object(block_async_io, "_IN_TESTS", False),
+        patch.object(loop_util, "raise_for_blocking_call", _record),
+    ):
+        block_async_io.enable()
+        yield detected
+    assert not detected, "在事件循环中的阻塞调用:\n" + "\n".join(detected)
+
+
+@pytest.fixture(autouse=True)
+def config_dir(hass, tmp_path):
+    """缓存和快照写入临时目录"""
+    hass.config.config_dir = str(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def config_entry(hass):
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        title="KiwiOT",
+        # 与配置流程创建的配置项版本一致
+        version=KiwiOTConfigFlow.VERSION,
+        data={
+            CONF_IDENTIFIER: "user@example.com",
+            CONF_CREDENTIAL: "secret",
+            CONF_CLIENT_ID: "client-id",
+        },
+    )
+    entry.add_to_hass(hass)
+    return entry
+
+
+def _returns(value):
+    """返回固定结果的接口桩, 不记录调用参数, 重载测试中不会持有每次创建的 session"""
+    async def _stub(*args, **kwargs):
+        return value
+    return _stub
+
+
+async def _wait_forever(*args, **kwargs):
+    """代替 WebSocket 连接, 直到卸载时被取消"""
+    await asyncio.Event().wait()
+
+
+@pytest.fixture
+def mock_cloud():
+    """桩掉所有云端接口, 返回一个门锁"""
+    with (
+        patch(
+            "custom_components.kiwiot_ws.TokenManager.get_token",
+            _returns("access-token"),
+        ),
+        patch("custom_components.kiwiot_ws.get_ggid", _returns(GROUPS)),
+        patch(
+            "custom_components.kiwiot_ws.device_manager.get_user_info",
+            _returns({"uid": "master"}),
+        ),
+        patch(
+            "custom_components.kiwiot_ws.device_manager.get_ddevices",
+            _returns(DEVICES),
+        ),
+        patch(
+            "custom_components.kiwiot_ws.device_manager.get_llock_userinfo",
+            _returns(USERS),
+        ),
+        patch(
+            "custom_components.kiwiot_ws.device_manager.get_llock_info",
+            _returns(EVENTS),
+        ),
+        patch(
+            "custom_components.kiwiot_ws.conn.websocket.get_llock_userinfo",
+            _returns(USERS),
+        ),
+        patch("custom_components.kiwiot_ws.start_websocket_connection", _wait_forever),
+    ):
+        yield
+
+
+async def setup_integration(hass, config_entry):
+    """加载配置项并等待后台门锁发现完成"""
+    assert await hass.config_entries.async_setup(config_entry.entry_id)
+    await hass.data[DOMAIN]["discovery_task"]
+    await hass.async_block_till_done()
+
+
+def make_jpeg(color="red") -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 48), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+async def image_server(aiohttp_server, socket_enabled):
+    """本地图片服务器, 路径对应 images 中的图片"""
+    images = {"red.jpg": make_jpeg("red"), "blue.jpg": make_jpeg("blue")}
+
+    async def _handle(request):
+        name = request.match_info["name"]
+        # 签名URL的查询参数不影响图片内容
+        if name not in images:
+            raise web.HTTPNotFound()
+        return web.Response(body=images[name], content_type="image/jpeg")
+
+    app = web.Application()
+    app.router.add_get("/{name}", _handle)
+    server = await aiohttp_server(app)
+    server.images = images
+    return server
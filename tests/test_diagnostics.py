@@ -0,0 +1,44 @@
+"""Diagnostics output must not leak tokens, image links or user names."""
+import json
+
+from custom_components.kiwiot_ws.const import DOMAIN, CONF_ACCESS_TOKEN
+from custom_components.kiwiot_ws.conn.utils import REDACTED
+from custom_components.kiwiot_ws.conn.websocket import process_device_event
+from custom_components.kiwiot_ws.diagnostics import async_get_config_entry_diagnostics
+from custom_components.kiwiot_ws.entity.lock import KiwiLockCamera
+
+from .conftest import LOCK_DID, setup_integration
+
+TOKEN = "secret-access-token"
+
+
+async def test_diagnostics_redacts_sensitive_fields(hass, config_entry, mock_cloud, image_server):
+    hass.config_entries.async_update_entry(config_entry, data={**config_entry.data, CONF_ACCESS_TOKEN: TOKEN})
+    await setup_integration(hass, config_entry)
+    hass.data[DOMAIN]["token_manager"]._access_token = TOKEN
+    image_uri = str(image_server.make_url("/red.jpg?sign=secret-signature"))
+
+    await process_device_event(hass, config_entry, {
+        "payload": {
+            "did": LOCK_DID,
+            "name": "UNLOCKED",
+            "level": "INFO",
+            "created_at": "2026-01-01T09:00:00Z",
+            "data": {"image_uri": image_uri, "lock_user": {"id": 1, "type": 1}},
+        },
+    })
+    camera = next(e for e in hass.data[DOMAIN]["devices"][LOCK_DID] if isinstance(e, KiwiLockCamera))
+    await camera._prefetch_task
+
+    diagnostics = await async_get_config_entry_diagnostics(hass, config_entry)
+    device = diagnostics["devices"][LOCK_DID]
+
+    assert diagnostics["entry"][CONF_ACCESS_TOKEN] == REDACTED
+    assert diagnostics["token"]["has_access_token"] is True
+    assert device["recent_events"][-1]["user_alias"] == REDACTED
+    assert device["last_event"]["data"]["image"]["uri"] == REDACTED
+    dumped = json.dumps(diagnostics, ensure_ascii=False, default=str)
+    for secret in (TOKEN, "secret-signature", "张三"):
+        assert secret not in dumped
+
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
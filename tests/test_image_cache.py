@@ -0,0 +1,44 @@
+"""ImageCache download, reuse and cleanup, with blocking-call detection enabled."""
+from custom_components.kiwiot_ws.conn.utils import ImageCache
+from custom_components.kiwiot_ws.const import IMAGE_ROTATION_EXIF, IMAGE_ROTATION_PIL
+
+
+async def test_download_and_cache_hit(hass, tmp_path, image_server):
+    cache = ImageCache(hass, tmp_path / "cache", IMAGE_ROTATION_EXIF)
+    url = str(image_server.make_url("/red.jpg?sign=1"))
+
+    first = await cache.get_image(url)
+    assert first
+    assert (tmp_path / "cache" / cache._get_cache_filename(url)).exists()
+    # 同一地址直接读取缓存文件
+    assert await cache.get_image(url) == first
+
+
+async def test_same_content_reuses_cached_file(hass, tmp_path, image_server):
+    cache = ImageCache(hass, tmp_path / "cache", IMAGE_ROTATION_EXIF)
+    first = await cache.get_image(str(image_server.make_url("/red.jpg?sign=1")))
+
+    # 签名变化但内容相同, 不再处理和写入新文件
+    resigned = str(image_server.make_url("/red.jpg?sign=2"))
+    assert await cache.get_image(resigned) == first
+    assert not (tmp_path / "cache" / cache._get_cache_filename(resigned)).exists()
+
+
+async def test_new_image_replaces_previous_file(hass, tmp_path, image_server):
+    cache = ImageCache(hass, tmp_path / "cache", IMAGE_ROTATION_PIL)
+    red = str(image_server.make_url("/red.jpg"))
+    blue = str(image_server.make_url("/blue.jpg"))
+
+    await cache.get_image(red)
+    assert await cache.get_image(blue)
+    files = list((tmp_path / "cache").glob("*.jpg"))
+    assert [f.name for f in files] == [cache._get_cache_filename(blue)]
+    assert cache._cache_bytes == sum(f.stat().st_size for f in files)
+
+    await cache.clear_cache()
+    assert not list((tmp_path / "cache").glob("*.jpg"))
+
+
+async def test_missing_image_returns_none(hass, tmp_path, image_server):
+    cache = ImageCache(hass, tmp_path / "cache")
+    assert await cache.get_image(str(image_server.make_url("/missing.jpg"))) is None
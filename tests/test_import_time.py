@@ -0,0 +1,80 @@
+"""Importing the integration must not load image/file-I/O dependencies and must stay within a time budget."""
+import subprocess
+import sys
+from pathlib import Path
+
+# 本机测得约 60ms (含 -X importtime 自身开销), 预算留出 CI 抖动的余量
+IMPORT_BUDGET_MS = 250
+# 只在下载或处理图片时才导入
+DEFERRED_MODULES = ("PIL", "aiofiles")
+
+# 集成依赖的 HA 组件先行导入, 不计入集成自身的导入开销
+PRELOAD = (
+    "homeassistant.components.button",
+    "homeassistant.components.camera",
+    "homeassistant.components.device_automation",
+    "homeassistant.components.diagnostics",
+    "homeassistant.components.event",
+    "homeassistant.components.http",
+    "homeassistant.components.lock",
+    "homeassistant.components.media_source",
+    "homeassistant.components.sensor",
+    "homeassistant.components.text",
+)
+MODULES = (
+    "custom_components.kiwiot_ws",
+    "custom_components.kiwiot_ws.button",
+    "custom_components.kiwiot_ws.camera",
+    "custom_components.kiwiot_ws.config_flow",
+    "custom_components.kiwiot_ws.device_trigger",
+    "custom_components.kiwiot_ws.diagnostics",
+    "custom_components.kiwiot_ws.event",
+    "custom_components.kiwiot_ws.lock",
+    "custom_components.kiwiot_ws.media_source",
+    "custom_components.kiwiot_ws.sensor",
+    "custom_components.kiwiot_ws.text",
+)
+MARKER = "--- kiwiot_ws import ---"
+
+SCRIPT = f"""
+import importlib, sys
+for name in {PRELOAD!r}:
+    importlib.import_module(name)
+print({MARKER!r}, file=sys.stderr, flush=True)
+for name in {MODULES!r}:
+    importlib.import_module(name)
+print(",".join(sorted(m for m in {DEFERRED_MODULES!r} if m in sys.modules)))
+"""
+
+
+def _import_integration():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCRIPT],
+        cwd=Path(__file__).parents[1],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip(), result.stderr.split(MARKER, 1)[1]
+
+
+def _self_time_ms(importtime_output: str) -> float:
+    """累加 -X importtime 输出中每个模块的自身耗时"""
+    total_us = 0
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        total_us += int(line.split(":", 1)[1].split("|", 1)[0])
+    return total_us / 1000
+
+
+def test_import_defers_heavy_dependencies():
+    loaded, _ = _import_integration()
+    assert loaded == ""
+
+
+def test_import_time_budget():
+    _, importtime_output = _import_integration()
+    assert "custom_components.kiwiot_ws" in importtime_output
+    elapsed = _self_time_ms(importtime_output)
+    assert elapsed < IMPORT_BUDGET_MS, f"导入耗时 {elapsed:.1f}ms 超出预算 {IMPORT_BUDGET_MS}ms"
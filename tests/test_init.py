@@ -0,0 +1,114 @@
+"""Setup and WebSocket event handling, with blocking-call detection enabled."""
+import pytest
+from homeassistant.exceptions import ServiceValidationError
+from homeassistant.helpers import entity_registry as er
+
+from custom_components.kiwiot_ws.const import DOMAIN, CONF_LAZY_HYDRATION
+from custom_components.kiwiot_ws.conn.metrics import get_metrics
+from custom_components.kiwiot_ws.conn.websocket import process_device_event
+from custom_components.kiwiot_ws.entity.lock import KiwiLockCamera
+
+from .conftest import LOCK_DID, setup_integration
+
+
+def _entity_id(hass, domain, suffix):
+    return er.async_get(hass).async_get_entity_id(domain, DOMAIN, f"{DOMAIN}_{LOCK_DID}_{suffix}")
+
+
+async def test_setup_creates_lock_entities(hass, config_entry, mock_cloud):
+    await setup_integration(hass, config_entry)
+
+    assert LOCK_DID in hass.data[DOMAIN]["devices"]
+    lock = hass.states.get(_entity_id(hass, "lock", "lock"))
+    assert lock is not None
+    assert lock.state == "locked"
+    assert hass.states.get(_entity_id(hass, "camera", "camera")) is not None
+
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
+
+
+async def test_event_push_updates_entities(hass, config_entry, mock_cloud, image_server):
+    await setup_integration(hass, config_entry)
+    camera_id = _entity_id(hass, "camera", "camera")
+
+    await process_device_event(hass, config_entry, {
+        "payload": {
+            "did": LOCK_DID,
+            "name": "UNLOCKED",
+            "level": "INFO",
+            "created_at": "2026-01-01T09:00:00Z",
+            "data": {
+                "image_uri": str(image_server.make_url("/red.jpg?sign=1")),
+                "lock_user": {"id": 1, "type": 1},
+            },
+        },
+    })
+    # 令牌预热和 WebSocket 任务常驻后台, 只等待图片预下载完成
+    camera = next(e for e in hass.data[DOMAIN]["devices"][LOCK_DID] if isinstance(e, KiwiLockCamera))
+    await camera._prefetch_task
+    await hass.async_block_till_done()
+
+    assert hass.states.get(_entity_id(hass, "lock", "lock")).state == "unlocked"
+    # 图片在后台下载完成后再写一次状态
+    assert "图片更新时间" in hass.states.get(camera_id).attributes
+    assert get_metrics(hass).image_misses == 1
+    assert hass.data[DOMAIN]["snapshots"].snapshots(LOCK_DID)
+    assert hass.data[DOMAIN]["recent_events"][LOCK_DID]
+
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
+
+
+async def test_first_event_hydrates_lazy_lock(hass, config_entry, mock_cloud, image_server):
+    hass.config_entries.async_update_entry(config_entry, options={CONF_LAZY_HYDRATION: True})
+    await setup_integration(hass, config_entry)
+    assert _entity_id(hass, "lock", "lock") is None
+
+    await process_device_event(hass, config_entry, {
+        "payload": {
+            "did": LOCK_DID,
+            "name": "UNLOCKED",
+            "level": "INFO",
+            "created_at": "2026-01-01T09:00:00Z",
+            "data": {
+                "image_uri": str(image_server.make_url("/red.jpg?sign=1")),
+                "lock_user": {"id": 1, "type": 1},
+            },
+        },
+    })
+    camera = next(e for e in hass.data[DOMAIN]["devices"][LOCK_DID] if isinstance(e, KiwiLockCamera))
+    await camera._prefetch_task
+    await hass.async_block_till_done()
+
+    # 加载后与已加载的门锁走同一更新路径: 通知事件、状态、快照和用户别名都已更新
+    assert hass.states.get(_entity_id(hass, "lock", "lock")).state == "unlocked"
+    assert hass.states.get(_entity_id(hass, "event", "notify")).attributes["event_type"] == "unlocked_by_user"
+    assert hass.data[DOMAIN]["snapshots"].snapshots(LOCK_DID)
+    assert hass.data[DOMAIN]["recent_events"][LOCK_DID][-1]["user_alias"] == "张三"
+
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
+
+
+async def test_options_flow_updates_hydration(hass, config_entry, mock_cloud):
+    await setup_integration(hass, config_entry)
+
+    result = await hass.config_entries.options.async_init(config_entry.entry_id)
+    result = await hass.config_entries.options.async_configure(
+        result["flow_id"], user_input={CONF_LAZY_HYDRATION: True, "hydrate_devices": ""}
+    )
+    await hass.data[DOMAIN]["discovery_task"]
+    await hass.async_block_till_done()
+
+    assert config_entry.options[CONF_LAZY_HYDRATION] is True
+    # 选项保存后重新加载, 门锁只保留设备外壳, 首次访问时再加载
+    assert LOCK_DID in hass.data[DOMAIN]["pending_hydration"]
+
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
+
+
+async def test_services_survive_unload(hass, config_entry, mock_cloud):
+    await setup_integration(hass, config_entry)
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
+
+    assert hass.services.has_service(DOMAIN, "refresh")
+    with pytest.raises(ServiceValidationError):
+        await hass.services.async_call(DOMAIN, "refresh", {}, blocking=True, return_response=True)
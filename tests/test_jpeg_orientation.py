@@ -0,0 +1,82 @@
+"""EXIF orientation insertion for cached images."""
+import io
+
+from PIL import Image
+
+from custom_components.kiwiot_ws.conn.utils import (
+    EXIF_ORIENTATION_CW90,
+    JpegOrientationWriter,
+    set_jpeg_orientation,
+)
+
+from .conftest import make_jpeg
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def _segments(data):
+    """返回 SOI 之后、第一个非 APPn 标记之前的 (标记, 段数据)"""
+    pos = 2
+    segments = []
+    while 0xE0 <= data[pos + 1] <= 0xEF:
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        segments.append((data[pos + 1], data[pos + 4:pos + 2 + length]))
+        pos += 2 + length
+    return segments
+
+
+def _exif_jpeg(orientation):
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION_TAG] = orientation
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 16), "green").save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def test_jfif_keeps_app0_and_adds_orientation():
+    data = make_jpeg()
+    rotated = set_jpeg_orientation(data)
+
+    markers = [marker for marker, _ in _segments(rotated)]
+    assert markers[:2] == [0xE0, 0xE1]
+    # 图像数据原样保留
+    assert rotated.endswith(data[len(data) - 64:])
+    with Image.open(io.BytesIO(rotated)) as image:
+        assert image.getexif()[EXIF_ORIENTATION_TAG] == EXIF_ORIENTATION_CW90
+        image.load()
+
+
+def test_existing_exif_is_replaced():
+    rotated = set_jpeg_orientation(_exif_jpeg(3))
+
+    exif_segments = [body for marker, body in _segments(rotated) if marker == 0xE1 and body.startswith(b"Exif")]
+    assert len(exif_segments) == 1
+    with Image.open(io.BytesIO(rotated)) as image:
+        assert image.getexif()[EXIF_ORIENTATION_TAG] == EXIF_ORIENTATION_CW90
+
+
+def test_invalid_or_truncated_input_is_rejected():
+    data = make_jpeg()
+    assert set_jpeg_orientation(b"not a jpeg") is None
+    assert set_jpeg_orientation(b"") is None
+    # 头部中途截断
+    assert set_jpeg_orientation(data[:10]) is None
+    # 段长度小于 2
+    assert set_jpeg_orientation(b"\xff\xd8\xff\xe0\x00\x01") is None
+
+
+def test_streaming_matches_whole_buffer():
+    data = make_jpeg()
+    writer = JpegOrientationWriter()
+    streamed = b"".join(writer.feed(data[i:i + 7]) for i in range(0, len(data), 7)) + writer.close()
+
+    assert not writer.failed
+    assert streamed == set_jpeg_orientation(data)
+
+
+def test_streaming_passes_through_non_jpeg():
+    writer = JpegOrientationWriter()
+    streamed = writer.feed(b"GIF89a") + writer.feed(b"rest") + writer.close()
+
+    assert writer.failed
+    assert streamed == b"GIF89arest"
@@ -0,0 +1,24 @@
+"""MediaResolver stream cache."""
+from unittest.mock import patch
+
+from custom_components.kiwiot_ws.conn.media import MediaResolver
+
+from .conftest import LOCK_DID
+
+
+async def _video(hass, entry, did, session, stream_id):
+    return {"media": {"uri": f"https://example.com/{stream_id}.mp4", "type": "video/mp4"}}
+
+
+async def test_stream_cache_is_bounded(hass, config_entry):
+    resolver = MediaResolver(hass, config_entry, None)
+
+    with patch("custom_components.kiwiot_ws.conn.media.get_llock_video", _video):
+        for index in range(resolver._max_streams + 5):
+            assert await resolver.get_stream(LOCK_DID, f"stream-{index}")
+        # 最新的条目仍命中缓存
+        assert await resolver.get_stream(LOCK_DID, f"stream-{resolver._max_streams + 4}")
+
+    assert len(resolver._streams) == resolver._max_streams
+    assert "stream-0" not in resolver._streams
+    assert resolver.stream_hits == 1
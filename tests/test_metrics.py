@@ -0,0 +1,72 @@
+"""Runtime metrics and their diagnostic sensors, driven by one WebSocket event."""
+import json
+
+import aiohttp
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.entity_component import async_update_entity
+
+from custom_components.kiwiot_ws.const import DOMAIN
+from custom_components.kiwiot_ws.conn.metrics import get_metrics
+from custom_components.kiwiot_ws.conn.websocket import handle_websocket_messages
+from custom_components.kiwiot_ws.entity.lock import KiwiLockCamera
+
+from .conftest import LOCK_DID, setup_integration
+
+
+class FakeWebSocket:
+    """依次产出给定消息后结束, 相当于服务器关闭连接"""
+
+    def __init__(self, *messages):
+        self._messages = [
+            aiohttp.WSMessage(aiohttp.WSMsgType.TEXT, json.dumps(message), None) for message in messages
+        ]
+
+    async def __aiter__(self):
+        for message in self._messages:
+            yield message
+
+
+def _enable_metric_sensor(hass, config_entry, key):
+    """指标传感器默认禁用, 在加载前预先登记为启用"""
+    return er.async_get(hass).async_get_or_create(
+        "sensor", DOMAIN, f"{DOMAIN}_{config_entry.entry_id}_metric_{key}", config_entry=config_entry
+    ).entity_id
+
+
+async def test_event_updates_metrics_and_sensors(hass, config_entry, mock_cloud, image_server):
+    sensors = {
+        key: _enable_metric_sensor(hass, config_entry, key)
+        for key in ("message_rate", "event_latency", "image_cache_hit_ratio", "image_cache_bytes")
+    }
+    await setup_integration(hass, config_entry)
+
+    await handle_websocket_messages(FakeWebSocket({
+        "header": {"namespace": "Iot.Device", "name": "EventNotify"},
+        "payload": {
+            "did": LOCK_DID,
+            "name": "UNLOCKED",
+            "level": "INFO",
+            "created_at": "2026-01-01T09:00:00Z",
+            "data": {
+                "image_uri": str(image_server.make_url("/red.jpg?sign=1")),
+                "lock_user": {"id": 1, "type": 1},
+            },
+        },
+    }), hass, config_entry)
+    camera = next(e for e in hass.data[DOMAIN]["devices"][LOCK_DID] if isinstance(e, KiwiLockCamera))
+    await camera._prefetch_task
+
+    metrics = get_metrics(hass)
+    assert metrics.messages == 1
+    assert len(metrics.event_latencies) == 1
+    assert (metrics.image_hits, metrics.image_misses) == (0, 1)
+    assert metrics.image_cache_bytes > 0
+
+    for entity_id in sensors.values():
+        await async_update_entity(hass, entity_id)
+    assert hass.states.get(sensors["message_rate"]).attributes["total"] == 1
+    assert hass.states.get(sensors["event_latency"]).attributes["samples"] == 1
+    assert float(hass.states.get(sensors["image_cache_hit_ratio"]).state) == 0
+    assert int(hass.states.get(sensors["image_cache_bytes"]).state) == metrics.image_cache_bytes
+
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
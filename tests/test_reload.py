@@ -0,0 +1,96 @@
+"""Repeated setup/unload must not leak tasks, threads, memory, futures or domain data."""
+import asyncio
+from collections import Counter
+import gc
+import logging
+import threading
+import tracemalloc
+from pathlib import Path
+
+import aiohttp
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.helpers.storage import Store
+
+from custom_components.kiwiot_ws.const import DOMAIN
+from custom_components.kiwiot_ws.conn.websocket import get_response_futures
+
+from .conftest import LOCK_DID, setup_integration
+
+RELOAD_CYCLES = 100
+WARMUP_CYCLES = 5
+# 预热后剩余的重载周期累计允许增长的内存和线程
+MEMORY_TOLERANCE = 32 * 1024
+THREAD_TOLERANCE = 1
+INTEGRATION_MODULE = "custom_components.kiwiot_ws"
+INTEGRATION_FILES = str(Path(__file__).parents[1] / "custom_components" / DOMAIN / "*")
+
+
+async def _reload_cycle(hass, config_entry):
+    await setup_integration(hass, config_entry)
+    assert config_entry.state is ConfigEntryState.LOADED
+    assert LOCK_DID in hass.data[DOMAIN]["devices"]
+    assert hass.services.has_service(DOMAIN, "unlock")
+
+    # 一个未收到响应的开锁指令, 卸载时应被取消并随域数据释放
+    future = hass.loop.create_future()
+    get_response_futures(hass)["pending"] = future
+
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
+    await hass.async_block_till_done()
+
+    assert config_entry.state is ConfigEntryState.NOT_LOADED
+    assert DOMAIN not in hass.data
+    assert future.cancelled()
+    # 服务在 async_setup 中注册一次, 卸载配置项后仍然保留
+    assert hass.services.has_service(DOMAIN, "unlock")
+
+    # 测试环境的存储桩会记录每次调用及其 Store 实例, 清空以免被计为集成的泄漏
+    for method in (Store._async_load, Store._async_write_data, Store.async_remove):
+        method.reset_mock()
+
+
+def _live_objects() -> Counter:
+    """本集成的类以及 aiohttp session 和连接器的存活实例数"""
+    gc.collect()
+    return Counter(
+        type(obj).__qualname__
+        for obj in gc.get_objects()
+        if str(type(obj).__module__).startswith(INTEGRATION_MODULE)
+        or isinstance(obj, (aiohttp.ClientSession, aiohttp.BaseConnector))
+    )
+
+
+def _traced_bytes() -> int:
+    """本集成代码分配且仍存活的内存"""
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, INTEGRATION_FILES)])
+    return sum(stat.size for stat in snapshot.statistics("filename"))
+
+
+async def test_reload_does_not_leak(hass, config_entry, mock_cloud):
+    tracemalloc.start()
+    try:
+        # 预热: 首次加载会导入平台并创建注册表条目, 这些只发生一次
+        for _ in range(WARMUP_CYCLES):
+            await _reload_cycle(hass, config_entry)
+
+        baseline_memory = _traced_bytes()
+        baseline_objects = _live_objects()
+        baseline_tasks = len(asyncio.all_tasks())
+        baseline_threads = threading.active_count()
+
+        # pytest 会保存每条日志记录及其参数, 测量期间关闭日志以免被计为集成的泄漏
+        logging.disable(logging.CRITICAL)
+        for _ in range(RELOAD_CYCLES - WARMUP_CYCLES):
+            await _reload_cycle(hass, config_entry)
+
+        grown = _traced_bytes() - baseline_memory
+    finally:
+        logging.disable(logging.NOTSET)
+        tracemalloc.stop()
+
+    assert get_response_futures(hass) == {}
+    assert _live_objects() == baseline_objects
+    assert len(asyncio.all_tasks()) <= baseline_tasks
+    assert threading.active_count() <= baseline_threads + THREAD_TOLERANCE
+    assert grown < MEMORY_TOLERANCE, f"{RELOAD_CYCLES - WARMUP_CYCLES} 次重载后内存增长 {grown} 字节"
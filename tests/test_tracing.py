@@ -0,0 +1,46 @@
+"""Event trace ring buffer."""
+from custom_components.kiwiot_ws.conn.tracing import TraceBuffer, trace_span
+
+
+def _trace(buffer, did, event, received_at):
+    trace = buffer.start(received_at)
+    trace.set_event(did, event, "2026-01-01T09:00:00Z")
+    trace.add_span("convert", received_at, received_at + 0.002)
+    trace.finish()
+    return trace
+
+
+def test_buffer_evicts_oldest_traces():
+    buffer = TraceBuffer(maxlen=3)
+    for index in range(5):
+        _trace(buffer, "lock-1", f"EVENT_{index}", 100.0 + index)
+
+    assert len(buffer) == 3
+    # 最新的在前, 最早的两条已被淘汰
+    assert [t["event"] for t in buffer.as_list()] == ["EVENT_4", "EVENT_3", "EVENT_2"]
+
+
+def test_as_list_filters_by_lock():
+    buffer = TraceBuffer()
+    _trace(buffer, "lock-1", "LOCKED", 100.0)
+    _trace(buffer, "lock-2", "UNLOCKED", 101.0)
+    _trace(buffer, "lock-1", "UNLOCKED", 102.0)
+
+    assert [t["event"] for t in buffer.as_list("lock-1")] == ["UNLOCKED", "LOCKED"]
+    assert [t["did"] for t in buffer.as_list("lock-2")] == ["lock-2"]
+    assert buffer.as_list("lock-3") == []
+    assert len(buffer.as_list()) == 3
+
+
+def test_trace_as_dict():
+    buffer = TraceBuffer()
+    trace = _trace(buffer, "lock-1", "LOCKED", 100.0)
+    trace.set_event("lock-1", "LOCKED", "not a time")
+
+    result = buffer.as_list()[0]
+    assert result["delivery_lag_ms"] is None
+    assert result["spans"] == [{"name": "convert", "start_ms": 0.0, "duration_ms": 2.0}]
+    assert result["total_ms"] is not None
+    # 轮询补发的事件没有追踪记录
+    with trace_span(None, "convert"):
+        pass
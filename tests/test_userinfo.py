@@ -0,0 +1,52 @@
+"""Conditional REST requests through the validator cache."""
+import aiohttp
+import pytest
+from aiohttp import web
+
+from custom_components.kiwiot_ws.const import DOMAIN
+from custom_components.kiwiot_ws.conn.userinfo import _make_request, get_validator_cache
+
+from .conftest import USERS, setup_integration
+
+ETAG = '"users-v1"'
+
+
+@pytest.fixture
+async def users_server(aiohttp_server, socket_enabled):
+    """锁用户接口, 带 ETag, 请求头匹配时返回 304"""
+    async def _handle(request):
+        request.app["requests"].append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == ETAG:
+            return web.Response(status=304, headers={"ETag": ETAG})
+        return web.json_response(USERS, headers={"ETag": ETAG})
+
+    app = web.Application()
+    app["requests"] = []
+    app.router.add_get("/api/locks/{did}/users", _handle)
+    return await aiohttp_server(app)
+
+
+async def test_etag_round_trip_returns_copies(hass, config_entry, mock_cloud, users_server):
+    await setup_integration(hass, config_entry)
+    url = str(users_server.make_url("/api/locks/lock-1/users?access_token=first"))
+
+    async with aiohttp.ClientSession() as session:
+        first = await _make_request(hass, session, url)
+        # token 变化后仍命中同一缓存键
+        second = await _make_request(hass, session, url.replace("first", "second"))
+        second[0]["alias"] = "改过"
+        third = await _make_request(hass, session, url)
+
+    assert users_server.app["requests"] == [None, ETAG, ETAG]
+    assert first == USERS
+    # 304 时每次返回独立的副本, 调用方修改不会影响缓存
+    assert second is not first
+    assert third == USERS
+    stats = hass.data[DOMAIN]["validator_cache"].stats()
+    assert stats["not_modified"] == 2
+    assert stats["entries"] == 1
+
+    assert await hass.config_entries.async_unload(config_entry.entry_id)
+    # 卸载后不会重新创建域数据
+    get_validator_cache(hass)
+    assert DOMAIN not in hass.data